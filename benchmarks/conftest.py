@@ -0,0 +1,134 @@
+"""Benchmark fixtures.
+
+Benchmarks require pytest-benchmark and run separately from the tests,
+
+    pytest benchmarks
+
+Dataset counts default to 100. Set DTOOL_SYNC_BENCHMARK_SIZES to a comma-separated
+list of counts to benchmark larger repositories, i.e.
+
+    DTOOL_SYNC_BENCHMARK_SIZES=100,10000,100000 pytest benchmarks
+
+Items per dataset default to 1 and are set via DTOOL_SYNC_BENCHMARK_ITEMS.
+Synthetic repositories on disk are generated once per session and size.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid as UUID
+
+import pytest
+
+import dtoolcore
+
+# Pytest does not add the working directory to the path so we do it here.
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.join(_HERE, "..")
+sys.path.insert(0, _ROOT)
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [int(n) for n in os.environ.get("DTOOL_SYNC_BENCHMARK_SIZES", "100").split(",")]
+ITEMS = int(os.environ.get("DTOOL_SYNC_BENCHMARK_ITEMS", "1"))
+
+
+def pytest_generate_tests(metafunc):
+    if "size" in metafunc.fixturenames:
+        metafunc.parametrize("size", SIZES, scope="session")
+
+
+def make_admin_metadata(i, base_uri="file:///lhs", frozen=True):
+    """Synthetic admin metadata as listed by dtool_sync._direct_list(raw=True)."""
+    admin_metadata = {
+        "uuid": str(UUID.UUID(int=i)),
+        "dtoolcore_version": dtoolcore.__version__,
+        "name": f"dataset-{i:07d}",
+        "type": "dataset" if frozen else "protodataset",
+        "creator_username": "benchmark",
+        "created_at": 1630851890.0 + i,
+        "uri": f"{base_uri}/dataset-{i:07d}",
+    }
+    if frozen:
+        admin_metadata["frozen_at"] = 1630851896.375779 + i
+    return admin_metadata
+
+
+def make_dataset_lists(size):
+    """Source and target lists with 80 % equal, 10 % changed and 10 % missing datasets."""
+    source = [make_admin_metadata(i) for i in range(size)]
+    target = [make_admin_metadata(i, base_uri="file:///rhs", frozen=(i % 10 != 0))
+              for i in range(size) if i % 10 != 1]
+    return source, target
+
+
+def make_repository(base_uri, size, items=ITEMS):
+    for i in range(size):
+        proto_dataset = dtoolcore.create_proto_dataset(f"dataset-{i:07d}", base_uri)
+        proto_dataset.put_readme("")
+        for j in range(items):
+            handle = f"item-{j}.txt"
+            fpath = os.path.join(tempfile.gettempdir(), f"{proto_dataset.uuid}-{handle}")
+            with open(fpath, 'w') as f:
+                f.write(handle)
+            proto_dataset.put_item(fpath, handle)
+            os.remove(fpath)
+        proto_dataset.freeze()
+
+
+@pytest.fixture(scope="session")
+def tmp_session_dir(request):
+    d = tempfile.mkdtemp()
+
+    @request.addfinalizer
+    def teardown():
+        shutil.rmtree(d)
+
+    return d
+
+
+@pytest.fixture(autouse=True)
+def dtool_cache_dir_fixture(tmp_session_dir, monkeypatch):
+    """Keep dtool cache and listing index apart from the user's."""
+    d = tempfile.mkdtemp(dir=tmp_session_dir)
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", d)
+    return d
+
+
+@pytest.fixture(scope="session")
+def repository_factory(tmp_session_dir):
+    """Create synthetic repositories on disk once per name and size."""
+    repositories = {}
+
+    def factory(name, size):
+        if (name, size) not in repositories:
+            d = os.path.join(tmp_session_dir, f"{name}-{size}")
+            os.mkdir(d)
+            base_uri = "file://" + d
+            t = time.time()
+            make_repository(base_uri, size)
+            print(f"Created {size} datasets at {base_uri} in {time.time() - t:.1f} s.")
+            repositories[(name, size)] = base_uri
+        return repositories[(name, size)]
+
+    return factory
+
+
+@pytest.fixture(scope="session")
+def comparable_repositories_factory(tmp_session_dir, repository_factory):
+    """Source repository and target repository lacking every tenth dataset."""
+    repositories = {}
+
+    def factory(size):
+        if size not in repositories:
+            lhs_uri = repository_factory("lhs", size)
+            lhs_dir = dtoolcore.utils.generous_parse_uri(lhs_uri).path
+            rhs_dir = shutil.copytree(lhs_dir, os.path.join(tmp_session_dir, f"rhs-{size}"))
+            for name in sorted(os.listdir(rhs_dir))[::10]:
+                shutil.rmtree(os.path.join(rhs_dir, name))
+            repositories[size] = (lhs_uri, "file://" + rhs_dir)
+        return repositories[size]
+
+    return factory
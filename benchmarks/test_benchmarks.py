@@ -0,0 +1,80 @@
+"""Benchmark list, compare, format, diff and cache cleaning hot paths and CLI startup."""
+
+import os
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+from .conftest import make_dataset_lists
+
+
+def test_direct_list(benchmark, size, repository_factory):
+    from dtool_sync import _direct_list
+    base_uri = repository_factory("lhs", size)
+    result = benchmark(_direct_list, base_uri, use_index=False)
+    assert len(result) == size
+
+
+def test_direct_list_indexed(benchmark, size, repository_factory):
+    from dtool_sync import _direct_list
+    base_uri = repository_factory("lhs", size)
+    _direct_list(base_uri, use_index=True)  # fill index
+    result = benchmark(_direct_list, base_uri, use_index=True)
+    assert len(result) == size
+
+
+def test_compare_dataset_lists(benchmark, size):
+    from dtool_sync.cli import DEFAULT_COMPARISON_MARKER
+    from dtool_sync.compare import compare_dataset_lists
+    source, target = make_dataset_lists(size)
+    equal, changed, missing = benchmark(compare_dataset_lists, source, target, DEFAULT_COMPARISON_MARKER)
+    assert len(equal) + len(changed) + len(missing) == size
+
+
+def _categorized_dataset_lists(size):
+    from dtool_sync.cli import DEFAULT_COMPARISON_MARKER
+    from dtool_sync.compare import compare_dataset_lists
+    equal, changed, missing = compare_dataset_lists(*make_dataset_lists(size), DEFAULT_COMPARISON_MARKER)
+    return {"equal": equal, "changed": changed, "missing": missing}
+
+
+def test_format_dataset_enumerable_txt(benchmark, size):
+    from dtool_sync import _format_dataset_enumerable
+    out_dict = _categorized_dataset_lists(size)
+    benchmark(_format_dataset_enumerable, out_dict, verbose=True, json=False)
+
+
+def test_format_dataset_enumerable_json(benchmark, size):
+    from dtool_sync import _format_dataset_enumerable
+    out_dict = _categorized_dataset_lists(size)
+    benchmark(_format_dataset_enumerable, out_dict, verbose=True, json=True)
+
+
+def test_diff(benchmark, size, comparable_repositories_factory):
+    from dtool_sync.cli import diff
+    lhs_uri, rhs_uri = comparable_repositories_factory(size)
+    runner = CliRunner()
+    result = benchmark(runner.invoke, diff, ['-q', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+
+
+def test_clean_cache(benchmark, size, dtool_cache_dir_fixture):
+    from dtool_sync import _clean_cache
+
+    def setup():
+        for i in range(size):
+            entry = os.path.join(dtool_cache_dir_fixture, f"entry-{i:07d}")
+            os.makedirs(entry, exist_ok=True)
+            with open(os.path.join(entry, "item"), 'w') as f:
+                f.write("x"*100)
+
+    # evict half of the entries
+    result = benchmark.pedantic(_clean_cache, args=(size*50,), setup=setup, rounds=3)
+    assert result <= size*50
+
+
+def test_import_cli(benchmark):
+    # fresh interpreter per round, includes interpreter startup
+    benchmark.pedantic(subprocess.run, args=([sys.executable, "-c", "import dtool_sync.cli"],),
+                       kwargs=dict(check=True), rounds=5)
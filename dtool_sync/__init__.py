@@ -1,38 +1,47 @@
 """dtool_sync module."""
 import json
 
-try:
-    from importlib.metadata import version, PackageNotFoundError
-except ModuleNotFoundError:
-    from importlib_metadata import version, PackageNotFoundError
-
-try:
-    __version__ = version(__name__)
-except PackageNotFoundError:
-    # package is not installed
-   pass
-
-
+import concurrent.futures
 import json as JSON
 import logging
 import os
 import shutil
 
 import click
-import dtoolcore
-import humanfriendly
 
+from dtool_info.utils import sizeof_fmt, date_fmt
+
+from .index import INDEX_DIRNAME, _is_current, _signature, load_index, update_index
+from .record import DatasetRecord, _as_builtin, _record_of
+from .timing import span
 
-from dtoolcore.utils import (
-    get_config_value,
-    DEFAULT_CACHE_PATH,
-)
 
-from dtool_cli.cli import (
-    CONFIG_PATH,
-)
+# same as dtool_cli.cli.CONFIG_PATH, without loading dtool's command line interface and all its plugins
+CONFIG_PATH = os.path.expanduser("~/.config/dtool/dtool.json")
 
-from dtool_info.utils import sizeof_fmt, date_fmt
+
+def __getattr__(name):
+    """Look up __version__ only on first access, scanning installed distributions is slow."""
+    if name != "__version__":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ModuleNotFoundError:
+        from importlib_metadata import version, PackageNotFoundError
+
+    try:
+        globals()["__version__"] = version(__name__)
+    except PackageNotFoundError:
+        # package is not installed
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    return globals()["__version__"]
+
+
+CACHE_LEDGER_FILENAME = "cache-sizes.json"
+
+# fields always retained when projecting dataset entries
+PROJECTION_KEEP_FIELDS = ("uuid", "name", "uri")
 
 
 logger = logging.getLogger(__name__)
@@ -42,54 +51,181 @@ logger = logging.getLogger(__name__)
 
 
 def _get_dir_size(directory):
-    """Get directory size in bytes."""
+    """Get directory size in bytes.
+
+    Symbolic links are neither followed nor counted."""
     total_size = 0
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for file in filenames:
-            filepath = os.path.join(dirpath, file)
-            if not os.path.islink(filepath):
-                total_size += os.path.getsize(filepath)
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total_size += entry.stat(follow_symlinks=False).st_size
     return total_size
 
 
-def _get_cache_size(config_path=None):
-    cache_abspath = get_config_value(
+def _get_entry_size(entry):
+    """Get size in bytes of a single os.DirEntry, descend into directories."""
+    if entry.is_dir(follow_symlinks=False):
+        return _get_dir_size(entry.path)
+    elif entry.is_file(follow_symlinks=False):
+        return entry.stat(follow_symlinks=False).st_size
+    return 0
+
+
+def _get_entry_sizes(entries, jobs=1):
+    """Size os.DirEntry objects, walk up to 'jobs' entries concurrently.
+
+    Returns dict of name: size."""
+    entries = list(entries)
+    if jobs > 1 and len(entries) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            sizes = executor.map(_get_entry_size, entries)
+            return {entry.name: size for entry, size in zip(entries, sizes)}
+    return {entry.name: _get_entry_size(entry) for entry in entries}
+
+
+def _get_entry_mtime_ns(entry):
+    """Get latest modification time in ns of os.DirEntry and, for directories, of all directories within.
+
+    Adding, removing or renaming files anywhere within a directory tree
+    changes it, files modified in place do not. Files are never stat'ed."""
+    mtime_ns = entry.stat(follow_symlinks=False).st_mtime_ns
+    if not entry.is_dir(follow_symlinks=False):
+        return mtime_ns
+    stack = [entry.path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for sub_entry in it:
+                if sub_entry.is_dir(follow_symlinks=False):
+                    mtime_ns = max(mtime_ns, sub_entry.stat(follow_symlinks=False).st_mtime_ns)
+                    stack.append(sub_entry.path)
+    return mtime_ns
+
+
+def _get_dir_entry_sizes(directory, jobs=1):
+    """Size all top-level entries within directory, up to 'jobs' concurrently.
+
+    Returns dict of name: size and total size in bytes."""
+    with os.scandir(directory) as it:
+        sizes = _get_entry_sizes(it, jobs=jobs)
+    return sizes, sum(sizes.values())
+
+
+def _get_cache_abspath(config_path=None):
+    from dtoolcore.utils import get_config_value, DEFAULT_CACHE_PATH
+    return get_config_value(
         "DTOOL_CACHE_DIRECTORY",
         config_path=config_path,
         default=DEFAULT_CACHE_PATH
     )
-    return _get_dir_size(cache_abspath)
 
 
-def _clean_cache(upper_limit=0, config_path=None):
+def _get_cache_size(config_path=None, jobs=1):
+    """Return total size of cache entries in bytes, without the listing index."""
+    sizes, _ = _get_dir_entry_sizes(_get_cache_abspath(config_path), jobs=jobs)
+    return sum(size for name, size in sizes.items() if name != INDEX_DIRNAME)
+
+
+def _get_cache_ledger_path(cache_abspath):
+    return os.path.join(cache_abspath, INDEX_DIRNAME, CACHE_LEDGER_FILENAME)
+
+
+def _load_cache_ledger(cache_abspath):
+    """Load sizes of cache entries from previous runs as dict of name: (mtime_ns, size)."""
+    try:
+        with open(_get_cache_ledger_path(cache_abspath), 'r') as f:
+            return {name: tuple(value) for name, value in JSON.load(f).items()}
+    except (OSError, ValueError) as exc:
+        logger.debug(f"No usable cache size ledger: {exc}")
+        return {}
+
+
+def _dump_cache_ledger(cache_abspath, ledger):
+    ledger_path = _get_cache_ledger_path(cache_abspath)
+    try:
+        os.makedirs(os.path.dirname(ledger_path), exist_ok=True)
+        with open(ledger_path, 'w') as f:
+            JSON.dump(ledger, f)
+    except OSError as exc:
+        logger.warning(f"Could not write cache size ledger: {exc}")
+
+
+def _get_cache_entry_sizes(entries, ledger=None, jobs=1):
+    """Size each cache entry once, up to 'jobs' entries concurrently, returns dict of name: size.
+
+    Sizes recorded in ledger are reused as long as no directory within the
+    entry has been modified, see _get_entry_mtime_ns. This holds for entries
+    written by dtool storage brokers, which only ever add item files, but
+    misses files growing in place. The ledger is updated in place."""
+    sizes = {}
+    mtimes = {}
+    entries_to_size = []
+    for entry in entries:
+        if ledger is None:
+            entries_to_size.append(entry)
+            continue
+        mtime_ns = _get_entry_mtime_ns(entry)
+        if entry.name in ledger and ledger[entry.name][0] == mtime_ns:
+            sizes[entry.name] = ledger[entry.name][1]
+        else:
+            mtimes[entry.name] = mtime_ns
+            entries_to_size.append(entry)
+
+    sizes.update(_get_entry_sizes(entries_to_size, jobs=jobs))
+
+    if ledger is not None:
+        for name, mtime_ns in mtimes.items():
+            ledger[name] = (mtime_ns, sizes[name])
+    return sizes
+
+
+def _clean_cache(upper_limit=0, config_path=None, persist_sizes=False, jobs=1, on_evict=None):
     """Delete cache entries until total cache size is below or equal upper limit in bytes.
 
+    Every entry is sized once, the cache size is then tracked while deleting.
+    If persist_sizes is set, entry sizes are recorded in a ledger within the
+    cache directory and reused by later calls for entries in which no
+    directory has been modified, see _get_cache_entry_sizes. Up to 'jobs'
+    entries are sized concurrently.
+    If on_evict is set, it is called with name and size of every deleted entry.
+
     Returns size of cache after deletion."""
-    cache_abspath = get_config_value(
-        "DTOOL_CACHE_DIRECTORY",
-        config_path=config_path,
-        default=DEFAULT_CACHE_PATH
-    )
-    unsorted_directory_contents = os.scandir(cache_abspath)
+    with span("clean cache"):
+        return _clean_cache_entries(upper_limit, config_path=config_path, persist_sizes=persist_sizes,
+                                    jobs=jobs, on_evict=on_evict)
+
 
-    # sor ascending by mtime, delete older entries first
-    mtime_sorted_directory_contents = sorted(unsorted_directory_contents,
+def _clean_cache_entries(upper_limit=0, config_path=None, persist_sizes=False, jobs=1, on_evict=None):
+    import humanfriendly
+
+    cache_abspath = _get_cache_abspath(config_path)
+    # keep the listing index, it is small and expensive to rebuild, and does not count towards the cache size
+    directory_contents = [d for d in os.scandir(cache_abspath) if d.name != INDEX_DIRNAME]
+
+    ledger = _load_cache_ledger(cache_abspath) if persist_sizes else None
+    entry_sizes = _get_cache_entry_sizes(directory_contents, ledger=ledger, jobs=jobs)
+    cache_size = sum(entry_sizes.values())
+
+    # sort ascending by mtime, delete older entries first
+    mtime_sorted_directory_contents = sorted(directory_contents,
                                              key=lambda d: d.stat().st_mtime)
     directory_content_names = [d.name for d in mtime_sorted_directory_contents]
 
     logger.debug(f"Entries in '{cache_abspath}': {JSON.dumps(directory_content_names)}")
 
     for entry in mtime_sorted_directory_contents:
-        cache_size = _get_cache_size()
         if cache_size <= upper_limit:
             logger.debug(f"Cache size {humanfriendly.format_size(cache_size)} "
-                         f"fulfils upper limit {humanfriendly.format_size(cache_size)}.")
+                         f"fulfils upper limit {humanfriendly.format_size(upper_limit)}.")
             break
-        logger.debug(f"Cache size {humanfriendly.format_size(cache_size)}"
-                     f"exceeds upper limit {humanfriendly.format_size(cache_size)}.")
-        if entry.is_dir:
+        logger.debug(f"Cache size {humanfriendly.format_size(cache_size)} "
+                     f"exceeds upper limit {humanfriendly.format_size(upper_limit)}.")
+        if entry.is_dir():
             logger.debug(f"Remove directory entry {entry.name}")
-            shutil.rmtree(os.path.join(cache_abspath, entry.name))
+            shutil.rmtree(entry.path)
         # chache entries are only directories, never files
         # elif entry.if_file:
         #    logger.debug(f"Remove file entry {entry.name}")
@@ -97,7 +233,18 @@ def _clean_cache(upper_limit=0, config_path=None):
         else:
             raise NotADirectoryError(f"Cache entry {entry.name} not a directory.")
 
-    return _get_cache_size()
+        cache_size -= entry_sizes[entry.name]
+        if ledger is not None:
+            ledger.pop(entry.name, None)
+        if on_evict is not None:
+            on_evict(entry.name, entry_sizes[entry.name])
+
+    if ledger is not None:
+        # forget about entries removed by others
+        present = set(entry_sizes)
+        _dump_cache_ledger(cache_abspath, {name: value for name, value in ledger.items() if name in present})
+
+    return cache_size
 
 
 def _parse_file_size(ctx, param, value):
@@ -107,12 +254,14 @@ def _parse_file_size(ctx, param, value):
     if value.lower() == "none":
         return None
 
+    import humanfriendly
     try:
         return humanfriendly.parse_size(value)  # TODO: remove dependency on humanfriendly
     except Exception as exc:
         logger.exception(exc)
+        name = "MAX_CACHE_SIZE" if param is None else param.name.upper()
         raise click.BadParameter(
-            "Format of MAX_CACHE_SIZE must be integer (i.e 1000000000), properly suffixed (i.e. 1GB), or 'none'")
+            f"Format of {name} must be integer (i.e 1000000000), properly suffixed (i.e. 1GB), or 'none'")
 
 
 def _parse_query(ctx, param, value):
@@ -130,22 +279,111 @@ def _parse_query(ctx, param, value):
             "Format of a query must be valid JSON.")
 
 
-def _lookup_list(*args, query={}, **kwargs):
-    """List all datasets registered at lookup server, filtered by query."""
+def _parse_comparison_marker(ctx, param, value):
+    """Parse comma-separated field names or JSON field list or nested marker into a comparison marker.
+
+        Returns None to compare everything for 'all'. Field 'type' is always compared."""
+    from .compare import make_comparison_marker
+
+    if value.lower() == "all":
+        return None
+
+    if value.lstrip().startswith(("{", "[")):
+        try:
+            value = json.loads(value)
+        except Exception as exc:
+            logger.exception(exc)
+            raise click.BadParameter(
+                "Format of a comparison marker must be valid JSON.")
+    else:
+        value = [field.strip() for field in value.split(",") if field.strip()]
+
     try:
-        import dtool_lookup_api.synchronous as dl
-    except ImportError as exc:
-        logger.error("Please install dtool-lookup-api to compare against lookup server.")
-        raise exc
-    res = dl.query(query)
+        marker = make_comparison_marker(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
 
-    # depending on the underlying storage, it is possible to have the same dataset with equivalent UUID
-    # exist multiple times under differing names.
-    by_uuid_and_name = sorted(res, key=lambda d: (d['uuid'], d['name']))
-    return by_uuid_and_name
+    # partial copies only differ from their source by type, always tell them apart
+    return {**marker, "type": True}
 
 
-def _direct_list(base_uri, *args, config_path=CONFIG_PATH, raw=True, **kwargs):
+def _admin_metadata_from_uris(uris, config_path=CONFIG_PATH, jobs=1):
+    """Yield (uri, admin metadata) tuples in order of uris.
+
+    With jobs > 1, admin metadata is fetched by a pool of up to 'jobs' threads concurrently."""
+    import dtoolcore
+    if jobs > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            yield from zip(uris, executor.map(
+                lambda uri: dtoolcore._admin_metadata_from_uri(uri, config_path), uris))
+    else:
+        for uri in uris:
+            yield uri, dtoolcore._admin_metadata_from_uri(uri, config_path)
+
+
+def _format_admin_metadata(admin_metadata, uri, raw=True):
+    """Record admin metadata with uri attached or reformatted as done by dtool_info.dataset._list_datasets."""
+    if raw:
+        return DatasetRecord(admin_metadata, uri=uri)
+
+    name = admin_metadata["name"]
+    if admin_metadata["type"] == "protodataset":
+        name = "*" + name
+    i = dict(
+        name=name,
+        uuid=admin_metadata["uuid"],
+        creator_username=admin_metadata["creator_username"],
+        uri=uri)
+    if "frozen_at" in admin_metadata:
+        i["frozen_at"] = date_fmt(admin_metadata["frozen_at"])
+    return DatasetRecord(i)
+
+
+def _project(dataset, fields=None):
+    """Reduce dataset entry to fields, always keep 'uuid', 'name' and 'uri'."""
+    if fields is None:
+        return dataset
+    return DatasetRecord((k, v) for k, v in dataset.items() if k in fields or k in PROJECTION_KEEP_FIELDS)
+
+
+def _iter_direct_list(base_uri, *args, config_path=CONFIG_PATH, raw=True, jobs=1,
+                      use_index=False, refresh=False, fields=None, **kwargs):
+    """Directly list datasets at base_uri via suitable storage broker, yield them as they arrive.
+
+    Datasets are yielded unsorted. Parameters as for _direct_list."""
+    import dtoolcore
+    base_uri = dtoolcore.utils.sanitise_uri(base_uri)
+    storage_broker = dtoolcore._get_storage_broker(base_uri, config_path)
+    uris = list(storage_broker.list_dataset_uris(base_uri, config_path))
+
+    indexed = {}
+    if use_index and not refresh:
+        indexed = load_index(base_uri, config_path=config_path)
+
+    # admin metadata of frozen datasets never changes, only that of proto datasets might,
+    # e.g. partial copies at a sync target. These are always fetched again.
+    signatures = {uri: _signature(uri) for uri in uris} if use_index else {}
+    uris_to_fetch = []
+    for uri in uris:
+        admin_metadata, indexed_signature = indexed.get(uri, (None, None))
+        if (admin_metadata is not None and _is_current(uri, admin_metadata, indexed_signature, signatures[uri])
+                and admin_metadata["type"] != "protodataset"):
+            yield _project(_format_admin_metadata(admin_metadata, uri, raw=raw), fields)
+        else:
+            uris_to_fetch.append(uri)
+
+    fetched = {}
+    for uri, admin_metadata in _admin_metadata_from_uris(uris_to_fetch, config_path=config_path, jobs=jobs):
+        fetched[uri] = admin_metadata
+        yield _project(_format_admin_metadata(admin_metadata, uri, raw=raw), fields)
+
+    logger.debug(f"Fetched admin metadata of {len(fetched)} out of {len(uris)} datasets at '{base_uri}'.")
+
+    if use_index:
+        update_index(base_uri, fetched, uris, signatures=signatures, config_path=config_path)
+
+
+def _direct_list(base_uri, *args, **kwargs):
     """Directly list all datasets at base_uri via suitable storage broker.
 
     Parameters
@@ -155,29 +393,23 @@ def _direct_list(base_uri, *args, config_path=CONFIG_PATH, raw=True, **kwargs):
     raw: bool, default: True
         if set, just yield admin metadata as returned by dtoolcore._admin_metadata_from_uri
         otherwise, reformat list entries as done by dtool_info.dataset._list_datasets
+    jobs: int, default: 1
+        number of concurrent admin metadata requests
+    use_index: bool, default: False
+        if set, only fetch admin metadata of datasets not yet in the local
+        listing index and of proto datasets, take everything else from the
+        index, see dtool_sync.index. The command line interface always uses it.
+    refresh: bool, default: False
+        if set, ignore and rebuild the local listing index
+    fields: set of str or None, default: None
+        if set, only these fields are needed, e.g. as returned by
+        compare._marker_projection. Entries are reduced to these and 'uuid',
+        'name' and 'uri' after their admin metadata has been read
+        completely, from the index or via the storage broker. dtoolcore
+        offers no partial reads. Thus, fields only save memory, not
+        listing time.
     """
-    base_uri = dtoolcore.utils.sanitise_uri(base_uri)
-    storage_broker = dtoolcore._get_storage_broker(base_uri, config_path)
-    info = []
-
-    for uri in storage_broker.list_dataset_uris(base_uri, config_path):
-        admin_metadata = dtoolcore._admin_metadata_from_uri(uri, config_path)
-
-        if raw:
-            i = admin_metadata
-            i['uri'] = uri
-        else:
-            name = admin_metadata["name"]
-            if admin_metadata["type"] == "protodataset":
-                name = "*" + name
-            i = dict(
-                name=name,
-                uuid=admin_metadata["uuid"],
-                creator_username=admin_metadata["creator_username"],
-                uri=uri)
-            if "frozen_at" in admin_metadata:
-                i["frozen_at"] = date_fmt(admin_metadata["frozen_at"])
-        info.append(i)
+    info = _iter_direct_list(base_uri, *args, **kwargs)
 
     # depending on the underlying storage, it is possible to have the same dataset with equivalent UUID
     # exist multiple times under differing names.
@@ -186,36 +418,37 @@ def _direct_list(base_uri, *args, config_path=CONFIG_PATH, raw=True, **kwargs):
 
 
 def _list(base_uri, *args, **kwargs):
-    """Delegates listing dataset either to storage broker or lookup server."""
-    if base_uri.startswith("lookup://"):  # the remainder won't matter for now
-        return _lookup_list(*args, **kwargs)
-    else:
-        return _direct_list(base_uri, *args, **kwargs)
+    """Delegates listing datasets to the listing backend registered for the scheme of base_uri.
 
+    Parameters as for dtool_sync.backends.ListingBackend.iter_list."""
+    from .backends import _get_listing_backend
+    return _get_listing_backend(base_uri).list(base_uri, *args, **kwargs)
 
-def _field_exists(e, field):
-    return field in e[0] if isinstance(e, tuple) else field in e
 
-
-def _extract_field(e, field):
-    return e[0][field] if isinstance(e, tuple) else e[field]
+def _iter_list(base_uri, *args, **kwargs):
+    """Like _list, but yield datasets unsorted as they arrive where supported by the listing backend."""
+    from .backends import _get_listing_backend
+    yield from _get_listing_backend(base_uri).iter_list(base_uri, *args, **kwargs)
 
 
 def _json_format_dataset_list(dataset_list, quiet=False, verbose=False):
     """Formats list of dataset for pretty JSON output, returns list with modified entries."""
     if quiet:
-        dataset_list = [_extract_field(element, 'uuid') for element in dataset_list]
+        dataset_list = [_record_of(element)['uuid'] for element in dataset_list]
     elif verbose:
-        pass
+        dataset_list = [_as_builtin(element) for element in dataset_list]
     else:
-        d = [{
-            "name": _extract_field(element, 'name'),
-            "uuid": _extract_field(element, 'uuid'),
-            "creator_username": _extract_field(element, 'creator_username'),
-        } for element in dataset_list]
-        for el, ed in zip(dataset_list, d):
-            if _field_exists(el, "frozen_at"):
-                ed["frozen_at"] = str(_extract_field(el, 'frozen_at'))
+        d = []
+        for element in dataset_list:
+            record = _record_of(element)
+            ed = {
+                "name": record['name'],
+                "uuid": record['uuid'],
+                "creator_username": record['creator_username'],
+            }
+            if "frozen_at" in record:
+                ed["frozen_at"] = str(record['frozen_at'])
+            d.append(ed)
         dataset_list = d
     return dataset_list
 
@@ -228,61 +461,121 @@ def _json_format_dataset_enumerable(dataset_enumerable, quiet=False, verbose=Fal
     return out_enumerable
 
 
-def _txt_format_dataset_list(dataset_list, quiet=False, verbose=False, ls_output=False):
-    """Format a list of dataset metadata entries as text."""
-    out_string = ''
+def _rstrip_lines(lines):
+    """Yield lines such that joining them with line breaks equals the rstripped join of the input lines."""
+    last = None
+    blank = []
+    for line in lines:
+        if line.strip():
+            if last is not None:
+                yield last
+            yield from blank
+            last, blank = line, []
+        else:
+            blank.append(line)
+    if last is not None:
+        yield last.rstrip()
+
+
+def _txt_iter_dataset_list(dataset_list, quiet=False, verbose=False, ls_output=False):
+    """Yield text lines, without line breaks, for a list of dataset metadata entries."""
     if ls_output:  # output as formatted by 'dtool ls', not very meaningful for diffs
-        for i in dataset_list:
-            if quiet:
-                out_string += _extract_field(i, "uri") + '\n'
-                continue
-            out_string += _extract_field(i, "name") + '\n'
-            out_string += "  " + _extract_field(i, "uri") + '\n'
-            if verbose:
-                out_string += "  " + _extract_field(i, "creator_username")
-                if _field_exists(i, "frozen_at"):
-                    out_string += "  " + str(_extract_field(i, "frozen_at"))
-                out_string += "  " + _extract_field(i, 'uuid') + '\n'
+        title_field, quiet_field, detail_field = "name", "uri", "uuid"
     else:  # ls-like output, but emphasizing uuids, excluding uris
-        for i in dataset_list:
-            if quiet:
-                out_string += _extract_field(i, 'uuid') + '\n'
-                continue
-            out_string += _extract_field(i, "uuid") + '\n'
-            out_string += "  " + _extract_field(i, "uri") + '\n'
-            if verbose:
-                out_string += "  " + _extract_field(i, "creator_username")
-                if _field_exists(i, "frozen_at"):
-                    out_string += "  " + str(_extract_field(i, 'frozen_at'))
-                out_string += "  " + _extract_field(i, "name") + '\n'
-    return out_string.rstrip()
+        title_field, quiet_field, detail_field = "uuid", "uuid", "name"
+
+    for element in dataset_list:
+        i = _record_of(element)
+        if quiet:
+            yield i[quiet_field]
+            continue
+        yield i[title_field]
+        yield "  " + i["uri"]
+        if verbose:
+            if "frozen_at" in i:
+                yield "  ".join(("", i["creator_username"], str(i["frozen_at"]), i[detail_field]))
+            else:
+                yield "  ".join(("", i["creator_username"], i[detail_field]))
 
 
-def _txt_format_dataset_enumerable(dataset_enumerable, quiet=False, verbose=False, ls_output=True):
-    key_label_pairs = {
-        "equal": "Datasets equal on source and target:",
-        "changed": "Datasets changed from source to target:",
-        "missing": "Datasets missing on target:",
-    }
-    key_color_pairs = {
-        "equal": "green",
-        "changed": "yellow",
-        "missing": "red"
-    }
+def _txt_format_dataset_list(dataset_list, quiet=False, verbose=False, ls_output=False):
+    """Format a list of dataset metadata entries as text."""
+    return '\n'.join(_txt_iter_dataset_list(dataset_list, quiet=quiet, verbose=verbose, ls_output=ls_output)).rstrip()
+
+
+def _style_lines(lines, **styles):
+    """Yield lines such that their join with line breaks equals click.style applied to the joined lines."""
+    prefix = click.style('', reset=False, **styles)
+    previous = None
+    for line in lines:
+        if previous is not None:
+            yield previous
+        previous = prefix + line if prefix is not None else line
+        prefix = None
+    if previous is None:
+        yield click.style('', **styles)
+    else:
+        yield previous + click.style('', reset=True)
+
+
+CATEGORY_LABELS = {
+    "equal": "Datasets equal on source and target:",
+    "changed": "Datasets changed from source to target:",
+    "missing": "Datasets missing on target:",
+    "extra": "Datasets extra on target:",
+}
+
+CATEGORY_COLORS = {
+    "equal": "green",
+    "changed": "yellow",
+    "missing": "red",
+    "extra": "blue",
+}
+
+
+def _txt_iter_dataset_enumerable(dataset_enumerable, quiet=False, verbose=False, ls_output=True):
+    """Yield text lines, without line breaks, for a dataset list or a dict of categorized dataset lists."""
     if isinstance(dataset_enumerable, dict):
-        out_string = ''
         for key, value in dataset_enumerable.items():
-            if key not in key_label_pairs:
+            if key not in CATEGORY_LABELS:
                 raise ValueError(f"{key} not allowed.")
             if not quiet:
-                out_string += click.style(key_label_pairs[key], bold=True) + '\n'
-            out_string += click.style(
-                _txt_format_dataset_list(value, quiet=quiet, verbose=verbose, ls_output=ls_output),
-                fg=key_color_pairs[key]) + '\n'
+                yield click.style(CATEGORY_LABELS[key], bold=True)
+            yield from _style_lines(
+                _rstrip_lines(_txt_iter_dataset_list(value, quiet=quiet, verbose=verbose, ls_output=ls_output)),
+                fg=CATEGORY_COLORS[key])
     else:
-        out_string = _txt_format_dataset_list(dataset_enumerable, quiet=quiet, verbose=verbose, ls_output=ls_output)
+        yield from _rstrip_lines(
+            _txt_iter_dataset_list(dataset_enumerable, quiet=quiet, verbose=verbose, ls_output=ls_output))
 
-    return out_string.rstrip()
+
+def _txt_format_dataset_enumerable(dataset_enumerable, quiet=False, verbose=False, ls_output=True):
+    return '\n'.join(
+        _txt_iter_dataset_enumerable(dataset_enumerable, quiet=quiet, verbose=verbose, ls_output=ls_output))
+
+
+def _txt_format_categorized_dataset(key, dataset, previous_key=None, quiet=False, verbose=False, ls_output=True):
+    """Format a single dataset of category key as text.
+
+    Unless quiet, the category label precedes the dataset if key differs from previous_key."""
+    if key not in CATEGORY_LABELS:
+        raise ValueError(f"{key} not allowed.")
+    out_string = ''
+    if not quiet and key != previous_key:
+        out_string += click.style(CATEGORY_LABELS[key], bold=True) + '\n'
+    out_string += click.style(
+        _txt_format_dataset_list([dataset], quiet=quiet, verbose=verbose, ls_output=ls_output),
+        fg=CATEGORY_COLORS[key])
+    return out_string
+
+
+def _txt_format_categorized_dataset_stream(categorized_datasets, quiet=False, verbose=False, ls_output=True):
+    """Yield text blocks for (category, dataset) tuples as they arrive."""
+    previous_key = None
+    for key, dataset in categorized_datasets:
+        yield _txt_format_categorized_dataset(key, dataset, previous_key=previous_key,
+                                              quiet=quiet, verbose=verbose, ls_output=ls_output)
+        previous_key = key
 
 
 def _format_dataset_enumerable(dataset_enumerable, quiet=False, verbose=False, json=False, ls_output=False):
@@ -292,3 +585,44 @@ def _format_dataset_enumerable(dataset_enumerable, quiet=False, verbose=False, j
             indent=4)
     else:
         return _txt_format_dataset_enumerable(dataset_enumerable, quiet=quiet, verbose=verbose, ls_output=ls_output)
+
+
+def _ndjson_format_categorized_dataset(key, dataset, quiet=False, verbose=False):
+    """Format a single dataset of category key as one line of JSON."""
+    return JSON.dumps({
+        "category": key,
+        "dataset": _json_format_dataset_list([dataset], quiet=quiet, verbose=verbose)[0],
+    })
+
+
+def _iter_format_dataset_enumerable(dataset_enumerable, quiet=False, verbose=False, json=False, ls_output=False,
+                                    ndjson=False, category=None):
+    """Like _format_dataset_enumerable, but yield output line by line as formatted.
+
+    With ndjson, yield one JSON object per dataset, tagged by its category. Categories
+    are the keys of a dataset dict, plain dataset lists are tagged with category."""
+    if ndjson:
+        if isinstance(dataset_enumerable, dict):
+            for key, value in dataset_enumerable.items():
+                for dataset in value:
+                    yield _ndjson_format_categorized_dataset(key, dataset, quiet=quiet, verbose=verbose)
+        else:
+            for dataset in dataset_enumerable:
+                yield _ndjson_format_categorized_dataset(category, dataset, quiet=quiet, verbose=verbose)
+    elif json:
+        yield _format_dataset_enumerable(dataset_enumerable, quiet=quiet, verbose=verbose, json=True)
+    else:
+        yield from _txt_iter_dataset_enumerable(dataset_enumerable, quiet=quiet, verbose=verbose, ls_output=ls_output)
+
+
+def _echo_dataset_enumerable(dataset_enumerable, **kwargs):
+    """Echo formatted datasets line by line, output equals click.echo(_format_dataset_enumerable(...)).
+
+    With ndjson, nothing is echoed for no datasets."""
+    with span("format"):
+        empty = True
+        for line in _iter_format_dataset_enumerable(dataset_enumerable, **kwargs):
+            click.echo(line)
+            empty = False
+        if empty and not kwargs.get("ndjson", False):
+            click.echo('')
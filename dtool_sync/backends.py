@@ -0,0 +1,165 @@
+"""Registry of listing backends, keyed by URI scheme.
+
+A listing backend lists datasets at a base URI in the shape produced by
+dtool_sync._direct_list. Backends advertise capabilities, which let callers
+pick the cheapest listing strategy per side of a comparison.
+
+Further backends are discovered via the entry point group
+'dtool_sync.listing_backends', e.g. in a package's setup.py::
+
+    entry_points={
+        'dtool_sync.listing_backends': ['s3=my_package:S3ListingBackend'],
+    }
+
+Every entry point must refer to a subclass of ListingBackend and overrides
+built-in backends for the schemes it declares. URIs of any other scheme
+are listed via their dtoolcore storage broker."""
+
+import functools
+import logging
+import sys
+
+from . import _iter_direct_list
+from .timing import span
+
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "dtool_sync.listing_backends"
+
+# Capabilities a backend may advertise:
+# Admin metadata of many datasets arrives per request, not one request per dataset.
+BULK_METADATA = "bulk_metadata"
+# Queries and UUID filters are applied at the source, not after listing.
+SERVER_SIDE_FILTERING = "server_side_filtering"
+# Datasets are yielded as they arrive, before the listing is complete.
+STREAMING = "streaming"
+
+
+class ListingBackend:
+    """Base class of listing backends.
+
+    Subclasses declare the URI schemes they serve and their capabilities
+    and implement iter_list."""
+
+    schemes = ()
+    capabilities = frozenset()
+
+    def iter_list(self, base_uri, *args, query=None, uuids=None, **kwargs):
+        """Yield datasets at base_uri, unsorted.
+
+        Parameters
+        ----------
+        base_uri: str
+        query: dict or None
+            mongo query, only supported with SERVER_SIDE_FILTERING
+        uuids: iterable of str or None
+            if set, only yield datasets with these UUIDs
+        further keyword arguments as for dtool_sync._direct_list, in particular
+        fields: set of str or None
+            if set, only these fields are needed and entries may be reduced
+            to these and 'uuid', 'name' and 'uri'. Backends able to fetch
+            only these fields may do so, built-in backends reduce entries
+            after fetching them completely.
+        """
+        raise NotImplementedError()
+
+    def list(self, base_uri, *args, **kwargs):
+        """List all datasets at base_uri, sorted by UUID and name.
+
+        Parameters as for iter_list."""
+        # depending on the underlying storage, it is possible to have the same dataset with equivalent UUID
+        # exist multiple times under differing names.
+        return sorted(self.iter_list(base_uri, *args, **kwargs), key=lambda d: (d['uuid'], d['name']))
+
+
+class StorageBrokerListingBackend(ListingBackend):
+    """List datasets via dtoolcore storage brokers, one admin metadata request per dataset.
+
+    Admin metadata of frozen datasets is served from the local listing index."""
+
+    capabilities = frozenset({STREAMING})
+
+    def iter_list(self, base_uri, *args, query=None, uuids=None, **kwargs):
+        if query is not None:
+            logger.warning("Storage broker listing of '%s' does not support queries, ignored.", base_uri)
+        datasets = _iter_direct_list(base_uri, *args, **kwargs)
+        if uuids is None:
+            yield from datasets
+        else:
+            uuids = set(uuids)
+            yield from (d for d in datasets if d['uuid'] in uuids)
+
+
+class LookupListingBackend(ListingBackend):
+    """List datasets registered at a lookup server in bulk, see dtool_sync.lookup."""
+
+    schemes = ("lookup", "lookup+http", "lookup+https")
+    capabilities = frozenset({BULK_METADATA, SERVER_SIDE_FILTERING, STREAMING})
+
+    def iter_list(self, base_uri, *args, query=None, uuids=None, **kwargs):
+        from .lookup import _iter_lookup_list
+        yield from _iter_lookup_list(base_uri, *args, query=query, uuids=uuids, **kwargs)
+
+
+BUILTIN_LISTING_BACKENDS = [LookupListingBackend]
+
+
+def _iter_entry_point_backends(group=ENTRY_POINT_GROUP):
+    from importlib.metadata import entry_points
+    if sys.version_info >= (3, 10):
+        entrypoints = entry_points(group=group)
+    else:
+        entrypoints = entry_points().get(group, [])
+
+    for entrypoint in entrypoints:
+        try:
+            yield entrypoint.load()
+        except Exception as exc:
+            logger.warning("Could not load '%s' from entry point group '%s': %s", entrypoint.name, group, exc)
+
+
+@functools.lru_cache(maxsize=None)
+def _generate_listing_backend_lookup():
+    """Return dict of available listing backends by URI scheme."""
+    listing_backend_lookup = {}
+    for Backend in [*BUILTIN_LISTING_BACKENDS, *_iter_entry_point_backends()]:
+        for scheme in Backend.schemes:
+            listing_backend_lookup[scheme] = Backend
+    return listing_backend_lookup
+
+
+def _get_listing_backend(base_uri):
+    """Return listing backend serving base_uri, fall back to storage broker listing."""
+    scheme = base_uri.split("://", 1)[0] if "://" in base_uri else "file"
+    Backend = _generate_listing_backend_lookup().get(scheme, StorageBrokerListingBackend)
+    logger.debug("List '%s' via %s.", base_uri, Backend.__name__)
+    return Backend()
+
+
+def _has_capability(base_uri, capability):
+    return capability in _get_listing_backend(base_uri).capabilities
+
+
+def _list_for_comparison(source_base_uri, target_base_uri, source_query=None, target_query=None,
+                         restrict_target=True, **kwargs):
+    """List source and target for a one-way comparison, sorted as by _list.
+
+    Only target datasets sharing their UUID with some source dataset matter
+    in a one-way comparison. If the target backend filters server-side, the
+    target listing is restricted to the UUIDs listed at the source, unless
+    restrict_target is False, i.e. datasets extra on target are of interest.
+    Further keyword arguments as for ListingBackend.iter_list."""
+    source_backend = _get_listing_backend(source_base_uri)
+    target_backend = _get_listing_backend(target_base_uri)
+
+    with span("list source"):
+        source_info = source_backend.list(source_base_uri, query=source_query, **kwargs)
+
+    uuids = None
+    if restrict_target and SERVER_SIDE_FILTERING in target_backend.capabilities:
+        uuids = [d['uuid'] for d in source_info]
+    with span("list target"):
+        target_info = target_backend.list(target_base_uri, query=target_query, uuids=uuids, **kwargs)
+
+    return source_info, target_info
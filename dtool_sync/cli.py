@@ -1,39 +1,157 @@
 """dtool_sync module."""
 
 import click
-import difflib
+import contextlib
 import logging
 
-import humanfriendly
-
-from dtool_create.dataset import _copy as copy_dataset
-
 from . import (
     _list,
+    _iter_list,
+    _ndjson_format_categorized_dataset,
+    _echo_dataset_enumerable,
     _format_dataset_enumerable,
+    _txt_format_categorized_dataset,
+    _txt_format_categorized_dataset_stream,
+    _parse_comparison_marker,
     _parse_file_size,
     _parse_query,
-    _clean_cache,
 )
 
-from .compare import compare_dataset_lists
+from .backends import STREAMING, _get_listing_backend, _list_for_comparison
+from .compare import ComparisonResult, _marker_projection, iter_compare_datasets
+from .monitor import TransferMonitor
+from .schedule import DEFAULT_SCHEDULING_POLICY, SCHEDULING_POLICIES, schedule_transfers
+from .timing import _profile_command, span
+from .verify import VERIFICATION_MODES, iter_verify_categorized_datasets
 
 
 logger = logging.getLogger(__name__)
 
 # TODO: use 'dtool diff' functionality to properly compare frozen datasets
-# TODO: make comparison marker a cli option
 DEFAULT_COMPARISON_MARKER = {'uuid': True, 'name': True, 'frozen_at': True, 'type': True}
 # key 'created_at' only introduced in later dtool versions, thus not included in comparison
 
+def _listing_fields(marker, quiet=False):
+    """Return fields needed from listings, only the compared ones and 'type' if output is quiet, otherwise None.
+
+    Output without -q shows complete entries and thus needs all fields. Fields
+    only reduce the entries held in memory, admin metadata is always fetched
+    completely, see dtool_sync._direct_list."""
+    fields = _marker_projection(marker)
+    if fields is None or not quiet:
+        return None
+    return fields | {"type"}
+
+
+def _stream_compare(source_base_uri, target_base_uri, lhs_query=None, rhs_query=None,
+                    raw=False, list_jobs=1, refresh=False, marker=None, verify="metadata", fields=None):
+    """List target completely, then yield categorized datasets while source is still being listed.
+
+    If the source listing backend cannot stream, nothing is gained by listing
+    the target first. Then list both as in batch mode."""
+    if STREAMING not in _get_listing_backend(source_base_uri).capabilities:
+        source_info, target_info = _list_for_comparison(
+            source_base_uri, target_base_uri, lhs_query, rhs_query,
+            raw=raw, jobs=list_jobs, refresh=refresh, use_index=True, fields=fields)
+    else:
+        with span("list target"):
+            target_info = _list(target_base_uri, query=rhs_query, raw=raw, jobs=list_jobs, refresh=refresh,
+                                use_index=True, fields=fields)
+        source_info = _iter_list(source_base_uri, query=lhs_query, raw=raw, jobs=list_jobs, refresh=refresh,
+                                 use_index=True, fields=fields)
+
+    categorized_datasets = iter_compare_datasets(source_info, target_info, marker)
+    if verify != "metadata":
+        categorized_datasets = iter_verify_categorized_datasets(categorized_datasets, jobs=list_jobs,
+                                                                hashes=verify == "hashes")
+    return categorized_datasets
+
+
+def _batch_compare(source_base_uri, target_base_uri, lhs_query=None, rhs_query=None,
+                   raw=False, list_jobs=1, refresh=False, marker=None, verify="metadata", fields=None,
+                   restrict_target=True):
+    """List source and target completely, return their lazily categorized ComparisonResult."""
+    source_info, target_info = _list_for_comparison(
+        source_base_uri, target_base_uri, lhs_query, rhs_query, restrict_target=restrict_target,
+        raw=raw, jobs=list_jobs, refresh=refresh, use_index=True, fields=fields)
+    result = ComparisonResult(source_info, target_info, marker)
+    if verify != "metadata":
+        result.verify_content(jobs=list_jobs, hashes=verify == "hashes")
+    return result
+
+
+def _journal_selection(target_base_uri, lhs_query=None, rhs_query=None, marker=None):
+    """Return what selects the datasets a sync run transfers, only runs of equal selection continue each other."""
+    return {"target_base_uri": target_base_uri, "lhs_query": lhs_query, "rhs_query": rhs_query, "marker": marker}
+
+
+@contextlib.contextmanager
+def _monitoring(progress=False, report=None, dry_run=False, **kwargs):
+    """Yield a TransferMonitor if progress or a report is requested, otherwise None.
+
+    The report is written when leaving the context, even on failure.
+    Further keyword arguments as for TransferMonitor."""
+    if dry_run or not (progress or report):
+        yield None
+        return
+
+    monitor = TransferMonitor(progress=progress, **kwargs)
+    try:
+        yield monitor
+    finally:
+        monitor.close()
+        if report is not None:
+            monitor.dump_report(report)
+
+
+def _echo_stream_compare(categorized_datasets, category=None, json=False, ndjson=False, **kwargs):
+    """Echo categorized datasets as they arrive, restricted to a single category if specified."""
+    with span("stream"):
+        _echo_categorized_datasets(categorized_datasets, category=category, json=json, ndjson=ndjson, **kwargs)
+
+
+def _echo_categorized_datasets(categorized_datasets, category=None, json=False, ndjson=False, **kwargs):
+    if ndjson:
+        for key, dataset in categorized_datasets:
+            if category is None or key == category:
+                click.echo(_ndjson_format_categorized_dataset(
+                    key, dataset, quiet=kwargs.get("quiet", False), verbose=kwargs.get("verbose", False)))
+        return
+    if json:
+        raise click.UsageError("Streamed output does not support JSON, use --ndjson or --batch instead.")
+    if category is not None:
+        for key, dataset in categorized_datasets:
+            if key == category:
+                click.echo(_format_dataset_enumerable([dataset], **kwargs))
+    else:
+        for block in _txt_format_categorized_dataset_stream(categorized_datasets, **kwargs):
+            click.echo(block)
+
+
+def _profile_options(func):
+    func = click.option('--profile-dir', type=click.Path(file_okay=False),
+                        help="""Like --profile, but additionally run cProfile per phase
+                                and write one .pstats file per phase to this directory.""")(func)
+    func = click.option('--profile', is_flag=True,
+                        help="""Time phases of the command (listing, comparison, formatting,
+                                transfers) and print a summary to stderr when done.""")(func)
+    return func
+
+
 @click.group()
-def sync():
+@_profile_options
+@click.pass_context
+def sync(ctx, profile, profile_dir):
     """repository synchronization utilities."""
+    _profile_command(ctx, profile, profile_dir)
 
 
 @click.group()
-def compare():
+@_profile_options
+@click.pass_context
+def compare(ctx, profile, profile_dir):
     """repository comparison utilities."""
+    _profile_command(ctx, profile, profile_dir)
 
 
 # textual compare
@@ -46,34 +164,50 @@ def compare():
               help="""If lhs source is a lookup server, filter listed datasets by query.""")
 @click.option('--rhs-query', default="none", type=click.UNPROCESSED, callback=_parse_query,
               help="""If rhs source is a lookup server, filter listed datasets by query.""")
+@click.option('--list-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of concurrent requests when listing datasets at base URIs.""")
+@click.option('--refresh', is_flag=True,
+              help="""Ignore and rebuild the local index of datasets' admin metadata at base URIs.""")
+@click.option("--difflib", "use_difflib", is_flag=True,
+              help="""Diff formatted lists line by line with Python's difflib instead of merging
+                      datasets by UUID. Slow for large lists, always used with --json.""")
 @click.argument("lhs_base_uri")
 @click.argument("rhs_base_uri")
-def diff(quiet, verbose, json, lhs_query, rhs_query, lhs_base_uri, rhs_base_uri):
+def diff(quiet, verbose, json, lhs_query, rhs_query, list_jobs, refresh, use_difflib, lhs_base_uri, rhs_base_uri):
     """Print textual diff between left hand side base URI and right hand side base URI UUID lists."""
-    lhs_info = _list(lhs_base_uri, query=lhs_query, raw=False)
-    rhs_info = _list(rhs_base_uri, query=rhs_query, raw=False)
-
-    lhs_str = _format_dataset_enumerable(lhs_info, quiet=quiet, verbose=verbose, json=json)
-    rhs_str = _format_dataset_enumerable(rhs_info, quiet=quiet, verbose=verbose, json=json)
-
-    diff = difflib.unified_diff(
-        lhs_str.splitlines(keepends=True),
-        rhs_str.splitlines(keepends=True),
-        fromfile=lhs_base_uri,
-        tofile=rhs_base_uri)
-
-    for i, line in enumerate(diff):
-        c = "white"
-        bold = False
-        if i < 2:
-            bold = True
-        elif len(line) > 0 and line[0] == '+':
-            c = "green"
-        elif len(line) > 0 and line[0] == '-':
-            c = "red"
-        elif len(line) > 1 and line[0:2] == '@@':
-            c = "bright_cyan"
-        click.secho(line, nl=False, fg=c, bold=bold)
+    with span("list source"):
+        lhs_info = _list(lhs_base_uri, query=lhs_query, raw=False, jobs=list_jobs, refresh=refresh, use_index=True)
+    with span("list target"):
+        rhs_info = _list(rhs_base_uri, query=rhs_query, raw=False, jobs=list_jobs, refresh=refresh, use_index=True)
+
+    with span("diff"):
+        if json or use_difflib:
+            import difflib
+            lhs_str = _format_dataset_enumerable(lhs_info, quiet=quiet, verbose=verbose, json=json)
+            rhs_str = _format_dataset_enumerable(rhs_info, quiet=quiet, verbose=verbose, json=json)
+
+            diff = difflib.unified_diff(
+                lhs_str.splitlines(keepends=True),
+                rhs_str.splitlines(keepends=True),
+                fromfile=lhs_base_uri,
+                tofile=rhs_base_uri)
+        else:
+            from .diff import unified_merge_diff
+            diff = unified_merge_diff(lhs_info, rhs_info, fromfile=lhs_base_uri, tofile=rhs_base_uri,
+                                      quiet=quiet, verbose=verbose)
+
+        for i, line in enumerate(diff):
+            c = "white"
+            bold = False
+            if i < 2:
+                bold = True
+            elif len(line) > 0 and line[0] == '+':
+                c = "green"
+            elif len(line) > 0 and line[0] == '-':
+                c = "red"
+            elif len(line) > 1 and line[0:2] == '@@':
+                c = "bright_cyan"
+            click.secho(line, nl=False, fg=c, bold=bold)
     click.secho('')
 
 
@@ -81,6 +215,8 @@ def diff(quiet, verbose, json, lhs_query, rhs_query, lhs_base_uri, rhs_base_uri)
 
 @compare.command(name="all")
 @click.option("-j", "--json", is_flag=True, help="Print metadata of compared datasets as JSON")
+@click.option("--ndjson", is_flag=True,
+              help="Print one JSON object per dataset, tagged with its category, as soon as it is compared. Overrides --json.")
 @click.option("-q", "--quiet", is_flag=True, help="Print less.")
 @click.option("-r", "--raw", is_flag=True, help="Compare and print raw metadata instead of reformatted values in the style of 'dtool ls' output.")
 @click.option("-u", "--uuid", is_flag=True, help="Print UUIDs instead of names.")
@@ -89,27 +225,48 @@ def diff(quiet, verbose, json, lhs_query, rhs_query, lhs_base_uri, rhs_base_uri)
               help="""If lhs source is a lookup server, filter listed datasets by query.""")
 @click.option('--rhs-query', default="none", type=click.UNPROCESSED, callback=_parse_query,
               help="""If rhs source is a lookup server, filter listed datasets by query.""")
+@click.option('--list-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of concurrent requests when listing datasets at base URIs.""")
+@click.option('--refresh', is_flag=True,
+              help="""Ignore and rebuild the local index of datasets' admin metadata at base URIs.""")
+@click.option('--verify', default="metadata", type=click.Choice(VERIFICATION_MODES),
+              help="""With 'content', additionally compare item manifests (identifiers, sizes, hashes)
+                      of datasets with equal metadata and check presence and size of items stored
+                      at the target, reporting them as changed on mismatch. With 'hashes', also
+                      regenerate item hashes at the target, which reads all item data. Up to
+                      --list-jobs datasets are verified concurrently. Per default, 'metadata' only.""")
+@click.option('--compare-fields', 'marker', default=",".join(DEFAULT_COMPARISON_MARKER), show_default=True,
+              type=click.UNPROCESSED, callback=_parse_comparison_marker,
+              help="""Comma-separated dataset fields to compare, nested fields separated by dots,
+                      or JSON list of fields or nested marker, e.g. '{"uuid": true, "frozen_at": true}'.
+                      'all' compares everything. 'type' is always compared to tell partial copies.""")
+@click.option('--stream/--batch', default=False,
+              help="""Stream datasets into comparison as soon as they are listed at the source base URI
+                      instead of listing and sorting both base URIs first. Per default, batch.""")
 @click.argument("source_base_uri")
 @click.argument("target_base_uri")
 def compare_all(source_base_uri, target_base_uri, lhs_query, rhs_query,
-            json, quiet, raw, uuid, verbose, marker=DEFAULT_COMPARISON_MARKER):
+            json, ndjson, quiet, raw, uuid, verbose, list_jobs, refresh, verify, stream, marker=DEFAULT_COMPARISON_MARKER):
     """Print diff report between source and target base URIs."""
-    source_info = _list(source_base_uri, query=lhs_query, raw=raw)
-    target_info = _list(target_base_uri, query=rhs_query, raw=raw)
+    if stream:
+        _echo_stream_compare(
+            _stream_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker, verify=verify,
+                            fields=_listing_fields(marker, quiet)),
+            json=json, ndjson=ndjson, quiet=quiet, verbose=verbose, ls_output=not uuid)
+        return
 
-    equal, changed, missing = compare_dataset_lists(source_info, target_info, marker)
-    out_dict = {
-        "equal": equal,
-        "changed": changed,
-        "missing": missing,
-    }
-    click.echo(
-        _format_dataset_enumerable(out_dict, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid)
-    )
+    result = _batch_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker, verify=verify,
+                            fields=_listing_fields(marker, quiet))
+    _echo_dataset_enumerable(result.categorized(), quiet=quiet, verbose=verbose, json=json, ls_output=not uuid,
+                             ndjson=ndjson)
 
 
 @compare.command(name="equal")
 @click.option("-j", "--json", is_flag=True, help="Print metadata of compared datasets as JSON")
+@click.option("--ndjson", is_flag=True,
+              help="Print one JSON object per dataset, tagged with its category, as soon as it is compared. Overrides --json.")
 @click.option("-q", "--quiet", is_flag=True, help="Print less.")
 @click.option("-r", "--raw", is_flag=True, help="Compare and print raw metadata instead of reformatted values in the style of 'dtool ls' output.")
 @click.option("-u", "--uuid", is_flag=True, help="Print UUIDs instead of names.")
@@ -118,22 +275,48 @@ def compare_all(source_base_uri, target_base_uri, lhs_query, rhs_query,
               help="""If lhs source is a lookup server, filter listed datasets by query.""")
 @click.option('--rhs-query', default="none", type=click.UNPROCESSED, callback=_parse_query,
               help="""If rhs source is a lookup server, filter listed datasets by query.""")
+@click.option('--list-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of concurrent requests when listing datasets at base URIs.""")
+@click.option('--refresh', is_flag=True,
+              help="""Ignore and rebuild the local index of datasets' admin metadata at base URIs.""")
+@click.option('--verify', default="metadata", type=click.Choice(VERIFICATION_MODES),
+              help="""With 'content', additionally compare item manifests (identifiers, sizes, hashes)
+                      of datasets with equal metadata and check presence and size of items stored
+                      at the target, reporting them as changed on mismatch. With 'hashes', also
+                      regenerate item hashes at the target, which reads all item data. Up to
+                      --list-jobs datasets are verified concurrently. Per default, 'metadata' only.""")
+@click.option('--compare-fields', 'marker', default=",".join(DEFAULT_COMPARISON_MARKER), show_default=True,
+              type=click.UNPROCESSED, callback=_parse_comparison_marker,
+              help="""Comma-separated dataset fields to compare, nested fields separated by dots,
+                      or JSON list of fields or nested marker, e.g. '{"uuid": true, "frozen_at": true}'.
+                      'all' compares everything. 'type' is always compared to tell partial copies.""")
+@click.option('--stream/--batch', default=False,
+              help="""Stream datasets into comparison as soon as they are listed at the source base URI
+                      instead of listing and sorting both base URIs first. Per default, batch.""")
 @click.argument("source_base_uri")
 @click.argument("target_base_uri")
 def compare_equal(source_base_uri, target_base_uri, lhs_query, rhs_query,
-            json, quiet, raw, uuid, verbose, marker=DEFAULT_COMPARISON_MARKER):
+            json, ndjson, quiet, raw, uuid, verbose, list_jobs, refresh, verify, stream, marker=DEFAULT_COMPARISON_MARKER):
     """Report datasets that equal each other at source and at target."""
-    source_info = _list(source_base_uri, query=lhs_query, raw=raw)
-    target_info = _list(target_base_uri, query=rhs_query, raw=raw)
+    if stream:
+        _echo_stream_compare(
+            _stream_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker, verify=verify,
+                            fields=_listing_fields(marker, quiet)),
+            category="equal", json=json, ndjson=ndjson, quiet=quiet, verbose=verbose, ls_output=not uuid)
+        return
 
-    equal, _, _ = compare_dataset_lists(source_info, target_info, marker)
-    click.echo(
-        _format_dataset_enumerable(equal, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid)
-    )
+    result = _batch_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker, verify=verify,
+                            fields=_listing_fields(marker, quiet))
+    _echo_dataset_enumerable(result.equal, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid,
+                             ndjson=ndjson, category="equal")
 
 
 @compare.command(name="changed")
 @click.option("-j", "--json", is_flag=True, help="Print metadata of compared datasets as JSON")
+@click.option("--ndjson", is_flag=True,
+              help="Print one JSON object per dataset, tagged with its category, as soon as it is compared. Overrides --json.")
 @click.option("-q", "--quiet", is_flag=True, help="Print less.")
 @click.option("-r", "--raw", is_flag=True, help="Compare and print raw metadata instead of reformatted values in the style of 'dtool ls' output.")
 @click.option("-u", "--uuid", is_flag=True, help="Print UUIDs instead of names.")
@@ -142,22 +325,48 @@ def compare_equal(source_base_uri, target_base_uri, lhs_query, rhs_query,
               help="""If lhs source is a lookup server, filter listed datasets by query.""")
 @click.option('--rhs-query', default="none", type=click.UNPROCESSED, callback=_parse_query,
               help="""If rhs source is a lookup server, filter listed datasets by query.""")
+@click.option('--list-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of concurrent requests when listing datasets at base URIs.""")
+@click.option('--refresh', is_flag=True,
+              help="""Ignore and rebuild the local index of datasets' admin metadata at base URIs.""")
+@click.option('--verify', default="metadata", type=click.Choice(VERIFICATION_MODES),
+              help="""With 'content', additionally compare item manifests (identifiers, sizes, hashes)
+                      of datasets with equal metadata and check presence and size of items stored
+                      at the target, reporting them as changed on mismatch. With 'hashes', also
+                      regenerate item hashes at the target, which reads all item data. Up to
+                      --list-jobs datasets are verified concurrently. Per default, 'metadata' only.""")
+@click.option('--compare-fields', 'marker', default=",".join(DEFAULT_COMPARISON_MARKER), show_default=True,
+              type=click.UNPROCESSED, callback=_parse_comparison_marker,
+              help="""Comma-separated dataset fields to compare, nested fields separated by dots,
+                      or JSON list of fields or nested marker, e.g. '{"uuid": true, "frozen_at": true}'.
+                      'all' compares everything. 'type' is always compared to tell partial copies.""")
+@click.option('--stream/--batch', default=False,
+              help="""Stream datasets into comparison as soon as they are listed at the source base URI
+                      instead of listing and sorting both base URIs first. Per default, batch.""")
 @click.argument("source_base_uri")
 @click.argument("target_base_uri")
 def compare_missing(source_base_uri, target_base_uri, lhs_query, rhs_query,
-            json, quiet, raw, uuid, verbose, marker=DEFAULT_COMPARISON_MARKER):
+            json, ndjson, quiet, raw, uuid, verbose, list_jobs, refresh, verify, stream, marker=DEFAULT_COMPARISON_MARKER):
     """Report datasets present at source but missing at target."""
-    source_info = _list(source_base_uri, query=lhs_query, raw=raw)
-    target_info = _list(target_base_uri, query=rhs_query, raw=raw)
+    if stream:
+        _echo_stream_compare(
+            _stream_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker, verify=verify,
+                            fields=_listing_fields(marker, quiet)),
+            category="changed", json=json, ndjson=ndjson, quiet=quiet, verbose=verbose, ls_output=not uuid)
+        return
 
-    _, changed, _ = compare_dataset_lists(source_info, target_info, marker)
-    click.echo(
-        _format_dataset_enumerable(changed, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid)
-    )
+    result = _batch_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker, verify=verify,
+                            fields=_listing_fields(marker, quiet))
+    _echo_dataset_enumerable(result.changed, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid,
+                             ndjson=ndjson, category="changed")
 
 
 @compare.command(name="missing")
 @click.option("-j", "--json", is_flag=True, help="Print metadata of compared datasets as JSON")
+@click.option("--ndjson", is_flag=True,
+              help="Print one JSON object per dataset, tagged with its category, as soon as it is compared. Overrides --json.")
 @click.option("-q", "--quiet", is_flag=True, help="Print less.")
 @click.option("-r", "--raw", is_flag=True, help="Compare and print raw metadata instead of reformatted values in the style of 'dtool ls' output.")
 @click.option("-u", "--uuid", is_flag=True, help="Print UUIDs instead of names.")
@@ -166,18 +375,63 @@ def compare_missing(source_base_uri, target_base_uri, lhs_query, rhs_query,
               help="""If lhs source is a lookup server, filter listed datasets by query.""")
 @click.option('--rhs-query', default="none", type=click.UNPROCESSED, callback=_parse_query,
               help="""If rhs source is a lookup server, filter listed datasets by query.""")
+@click.option('--list-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of concurrent requests when listing datasets at base URIs.""")
+@click.option('--refresh', is_flag=True,
+              help="""Ignore and rebuild the local index of datasets' admin metadata at base URIs.""")
+@click.option('--compare-fields', 'marker', default=",".join(DEFAULT_COMPARISON_MARKER), show_default=True,
+              type=click.UNPROCESSED, callback=_parse_comparison_marker,
+              help="""Comma-separated dataset fields to compare, nested fields separated by dots,
+                      or JSON list of fields or nested marker, e.g. '{"uuid": true, "frozen_at": true}'.
+                      'all' compares everything. 'type' is always compared to tell partial copies.""")
+@click.option('--stream/--batch', default=False,
+              help="""Stream datasets into comparison as soon as they are listed at the source base URI
+                      instead of listing and sorting both base URIs first. Per default, batch.""")
 @click.argument("source_base_uri")
 @click.argument("target_base_uri")
 def compare_missing(source_base_uri, target_base_uri, lhs_query, rhs_query,
-            json, quiet, raw, uuid, verbose, marker=DEFAULT_COMPARISON_MARKER):
+            json, ndjson, quiet, raw, uuid, verbose, list_jobs, refresh, stream, marker=DEFAULT_COMPARISON_MARKER):
     """Report datasets present at source but missing at target."""
-    source_info = _list(source_base_uri, query=lhs_query, raw=raw)
-    target_info = _list(target_base_uri, query=rhs_query, raw=raw)
-
-    _, _, missing = compare_dataset_lists(source_info, target_info, marker)
-    click.echo(
-        _format_dataset_enumerable(missing, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid)
-    )
+    if stream:
+        _echo_stream_compare(
+            _stream_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker,
+                            fields=_listing_fields(marker, quiet)),
+            category="missing", json=json, ndjson=ndjson, quiet=quiet, verbose=verbose, ls_output=not uuid)
+        return
+
+    result = _batch_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh, marker=marker,
+                            fields=_listing_fields(marker, quiet))
+    _echo_dataset_enumerable(result.missing, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid,
+                             ndjson=ndjson, category="missing")
+
+
+@compare.command(name="extra")
+@click.option("-j", "--json", is_flag=True, help="Print metadata of compared datasets as JSON")
+@click.option("--ndjson", is_flag=True, help="Print one JSON object per dataset, tagged with its category.")
+@click.option("-q", "--quiet", is_flag=True, help="Print less.")
+@click.option("-r", "--raw", is_flag=True, help="Compare and print raw metadata instead of reformatted values in the style of 'dtool ls' output.")
+@click.option("-u", "--uuid", is_flag=True, help="Print UUIDs instead of names.")
+@click.option("-v", "--verbose", is_flag=True, default=False, help="Print more metadata.")
+@click.option('--lhs-query', default="none", type=click.UNPROCESSED, callback=_parse_query,
+              help="""If lhs source is a lookup server, filter listed datasets by query.""")
+@click.option('--rhs-query', default="none", type=click.UNPROCESSED, callback=_parse_query,
+              help="""If rhs source is a lookup server, filter listed datasets by query.""")
+@click.option('--list-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of concurrent requests when listing datasets at base URIs.""")
+@click.option('--refresh', is_flag=True,
+              help="""Ignore and rebuild the local index of datasets' admin metadata at base URIs.""")
+@click.argument("source_base_uri")
+@click.argument("target_base_uri")
+def compare_extra(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                  json, ndjson, quiet, raw, uuid, verbose, list_jobs, refresh):
+    """Report datasets present at target but not at source."""
+    result = _batch_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=raw, list_jobs=list_jobs, refresh=refresh,
+                            fields=_listing_fields({"uuid": True}, quiet), restrict_target=False)
+    _echo_dataset_enumerable(result.extra, quiet=quiet, verbose=verbose, json=json, ls_output=not uuid,
+                             ndjson=ndjson, category="extra")
 
 
 # sync
@@ -186,6 +440,8 @@ def compare_missing(source_base_uri, target_base_uri, lhs_query, rhs_query,
                                   If 'TERTIARY_BASE_URI' specified, will compare with 'TARGET_BASE_URI', but actually 
                                   copy to 'TERTIARY_BASE_URI'.""")
 @click.option("-n", "--dry-run", is_flag=True, help="Only print datasets that will be transferred.")
+@click.option("--ndjson", is_flag=True,
+              help="With --dry-run, print one JSON object per compared dataset, tagged with its category, instead.")
 @click.option("-q", "--quiet", is_flag=True, help="Print less.")
 @click.option("-u", "--uuid", is_flag=True, help="Print UUIDs instead of names.")
 @click.option("-v", "--verbose", is_flag=True, default=False, help="Print more.")
@@ -200,66 +456,173 @@ def compare_missing(source_base_uri, target_base_uri, lhs_query, rhs_query,
                       to delete older cache entries when limit exceeded. Specify 
                       0 (zero) to empty cache after each copied dataset. Per
                       default, never empty cache.""")
+@click.option('--persist-cache-sizes', is_flag=True,
+              help="""Keep a ledger of cache entry sizes within the cache directory
+                      to avoid resizing unchanged entries when cleaning the cache.""")
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of datasets to transfer concurrently. Per default,
+                      transfer one dataset after another.""")
+@click.option('--schedule', default=DEFAULT_SCHEDULING_POLICY, type=click.Choice(SCHEDULING_POLICIES),
+              help="""Order of transfers. 'uuid' copies changed, then missing datasets by UUID,
+                      'smallest-first' and 'largest-first' by dataset size estimated from manifests,
+                      'frozen-at' oldest datasets first and 'balanced' spreads dataset sizes evenly
+                      over --jobs concurrent transfers. Per default, 'uuid'.""")
+@click.option('--max-bytes', default="none", type=click.UNPROCESSED, callback=_parse_file_size,
+              help="""Byte budget of this run (i.e. --max-bytes 500GB). Only transfer datasets
+                      up to this total size estimated from manifests, defer all others to a later run.
+                      Per default, no limit.""")
+@click.option('--item-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of items to copy concurrently when resuming the transfer
+                      of a partially copied dataset. Per default, one item after another.""")
+@click.option('--list-jobs', default=1, type=click.IntRange(min=1),
+              help="""Number of concurrent requests when listing datasets at base URIs.""")
+@click.option('--refresh', is_flag=True,
+              help="""Ignore and rebuild the local index of datasets' admin metadata at base URIs.""")
+@click.option('--compare-fields', 'marker', default=",".join(DEFAULT_COMPARISON_MARKER), show_default=True,
+              type=click.UNPROCESSED, callback=_parse_comparison_marker,
+              help="""Comma-separated dataset fields to compare, nested fields separated by dots,
+                      or JSON list of fields or nested marker, e.g. '{"uuid": true, "frozen_at": true}'.
+                      'all' compares everything. 'type' is always compared to tell partial copies.""")
+@click.option('--stream/--batch', default=False,
+              help="""Stream datasets into comparison as soon as they are listed at the source base URI
+                      instead of listing and sorting both base URIs first. Per default, batch.""")
+@click.option('--progress', is_flag=True,
+              help="""Show progress of transfers on stderr: datasets and bytes transferred,
+                      throughput and, unless streaming, estimated time of arrival.""")
+@click.option('--report', type=click.Path(dir_okay=False, writable=True),
+              help="""Write a JSON report of this run to the given file: bytes, duration, retries
+                      and errors per transferred dataset, overall throughput and cache evictions.
+                      Not available with --dry-run.""")
+@click.option('--direct', is_flag=True,
+              help="""Pipe item content from source to target storage broker in chunks instead of
+                      staging items in the local dtool cache. Built in for sources on local disk,
+                      symlinked or on HTTP(S) and targets on local disk only. Datasets on any other
+                      storage, e.g. S3 or Azure, are copied via the cache as without this flag.""")
+@click.option('--journal', 'journal_path', type=click.Path(dir_okay=False, writable=True),
+              help="""Record the state of every transfer in this journal file. If the last run with
+                      the same journal has been interrupted, continue it without listing and comparing
+                      base URIs again.""")
 @click.argument("source_base_uri")
 @click.argument("target_base_uri")
 @click.argument("tertiary_base_uri", required=False)
 def sync_all(source_base_uri, target_base_uri, lhs_query, rhs_query,
-             dry_run, ignore_errors, quiet, uuid, verbose,
-             max_cache_size, tertiary_base_uri=None, marker=DEFAULT_COMPARISON_MARKER):
+             dry_run, ndjson, ignore_errors, quiet, uuid, verbose,
+             max_cache_size, persist_cache_sizes, jobs, item_jobs, list_jobs, refresh, stream, tertiary_base_uri=None,
+             marker=DEFAULT_COMPARISON_MARKER, schedule=DEFAULT_SCHEDULING_POLICY, max_bytes=None,
+             progress=False, report=None, journal_path=None, direct=False):
     """Sync datasets from source to target base URIs."""
-    source_info = _list(source_base_uri, query=lhs_query, raw=True)
-    target_info = _list(target_base_uri, query=rhs_query, raw=True)
-
-    equal, changed, missing = compare_dataset_lists(source_info, target_info, marker)
-    out_dict = {
-        "equal": equal,
-        "changed": changed,
-        "missing": missing,
-    }
+    # only load storage brokers and dtool's copy machinery when actually syncing
+    from .transfer import run_transfers, transfer_datasets
+
+    if ndjson and not dry_run:
+        raise click.UsageError("--ndjson requires --dry-run.")
+    if report is not None and dry_run:
+        raise click.UsageError("--report cannot be combined with --dry-run, use --ndjson to record planned transfers.")
+
+    scheduled = schedule != DEFAULT_SCHEDULING_POLICY or max_bytes is not None
+    if stream and scheduled:
+        raise click.UsageError("--schedule and --max-bytes require --batch.")
+    if stream and journal_path is not None:
+        raise click.UsageError("--journal requires --batch.")
+
+    if stream:
+        categorized_datasets = _stream_compare(
+            source_base_uri, target_base_uri, lhs_query, rhs_query,
+            raw=True, list_jobs=list_jobs, refresh=refresh, marker=marker, fields=_listing_fields(marker, quiet))
+
+        if ndjson:
+            _echo_stream_compare(categorized_datasets, ndjson=True, quiet=quiet, verbose=verbose)
+            return
+
+        def tasks():
+            """Echo categorized datasets and yield transfers as they arrive."""
+            previous_key = None
+            for key, dataset in categorized_datasets:
+                if not quiet:
+                    click.echo(_txt_format_categorized_dataset(
+                        key, dataset, previous_key=previous_key, quiet=quiet, verbose=verbose, ls_output=not uuid))
+                previous_key = key
+
+                if key == "changed":
+                    yield dataset[0]["uri"], True
+                elif key == "missing":
+                    yield dataset["uri"], False
+
+        with _monitoring(progress, report, dry_run) as monitor:
+            run_transfers(tasks(), target_base_uri if tertiary_base_uri is None else tertiary_base_uri,
+                          jobs=jobs, dry_run=dry_run, ignore_errors=ignore_errors, quiet=quiet,
+                          max_cache_size=max_cache_size, persist_cache_sizes=persist_cache_sizes,
+                          item_jobs=item_jobs, monitor=monitor, direct=direct)
+        return
+
+    dest_base_uri = target_base_uri if tertiary_base_uri is None else tertiary_base_uri
+    journal = None
+    if journal_path is not None and not ndjson:
+        from .journal import SyncJournal
+        journal = SyncJournal(journal_path, source_base_uri, dest_base_uri,
+                              selection=_journal_selection(target_base_uri, lhs_query, rhs_query, marker))
+        if journal.interrupted():
+            tasks = journal.resumable_tasks(dry_run=dry_run)
+            if not quiet:
+                click.secho(f"Continue interrupted run from journal, {len(tasks)} datasets left to copy.")
+            with _monitoring(progress, report, dry_run, total=len(tasks)) as monitor:
+                run_transfers(tasks, dest_base_uri, jobs=jobs, dry_run=dry_run, ignore_errors=ignore_errors,
+                              quiet=quiet, max_cache_size=max_cache_size, persist_cache_sizes=persist_cache_sizes,
+                              item_jobs=item_jobs, monitor=monitor, journal=journal, direct=direct)
+            return
+
+    fields = _listing_fields(marker, quiet)
+    if fields is not None and schedule == "frozen-at":
+        fields |= {"frozen_at"}
+    result = _batch_compare(source_base_uri, target_base_uri, lhs_query, rhs_query,
+                            raw=True, list_jobs=list_jobs, refresh=refresh, marker=marker, fields=fields)
+    out_dict = result.categorized()
+
+    if ndjson:
+        _echo_dataset_enumerable(out_dict, quiet=quiet, verbose=verbose, ndjson=True)
+        return
 
     if not quiet:
-        click.echo(
-            _format_dataset_enumerable(out_dict, quiet=quiet, verbose=verbose, json=False, ls_output=not uuid)
-        )
-
-        click.secho("Resume copying of changed datasets, presuming their transfer had been interrupted in an earlier attempt.")
-
-    if tertiary_base_uri is not None:
-        target_base_uri = tertiary_base_uri
-
-    for src_ds, dst_ds in changed:
-        if dry_run:
-            click.secho(f"Dry run, would copy {src_ds['uri']} to {target_base_uri} now.")
-        else:
-            try:
-                copy_dataset(resume=True, quiet=quiet, dataset_uri=src_ds["uri"], dest_base_uri=target_base_uri)
-            except Exception as exc:
-                if not ignore_errors:
-                    raise
-                else:
-                    logger.exception(exc)
-
-    if not quiet:
-        click.secho("Copy missing datasets.")
-
-    for src_ds in missing:
-        if dry_run:
-            click.secho(f"Dry run, would copy {src_ds['uri']} to {target_base_uri} now.")
-        else:
-            try:
-                copy_dataset(resume=False, quiet=quiet, dataset_uri=src_ds["uri"], dest_base_uri=target_base_uri)
-            except OSError as exc:
-                raise # might have run out of storage
-            except Exception as exc:
-                try:
-                    copy_dataset(resume=True, quiet=quiet, dataset_uri=src_ds["uri"], dest_base_uri=target_base_uri)
-                except OSError as exc:
-                    raise  # might have run out of storage
-                except Exception as exc:
-                    if not ignore_errors:
-                        raise
-                    else:
-                        logger.exception(exc)
-
-            if max_cache_size is not None:
-                _clean_cache(max_cache_size)
+        _echo_dataset_enumerable(out_dict, quiet=quiet, verbose=verbose, json=False, ls_output=not uuid)
+
+    if scheduled:
+        transfers, deferred = schedule_transfers(
+            [*((src_ds, True) for src_ds, _ in result.changed), *((src_ds, False) for src_ds in result.missing)],
+            policy=schedule, workers=jobs, byte_budget=max_bytes, jobs=list_jobs)
+        if not quiet:
+            click.secho(f"Copy {len(transfers)} changed and missing datasets by policy '{schedule}'.")
+            if deferred:
+                click.secho(f"Defer {len(deferred)} datasets exceeding the byte budget to a later run:")
+                for transfer in deferred:
+                    click.secho(f"  {transfer.dataset['uri']}")
+
+        tasks = [(transfer.dataset["uri"], transfer.resume) for transfer in transfers]
+        if journal is not None and not dry_run:
+            journal.queue(tasks)
+        sizes = {transfer.dataset["uri"]: transfer.size for transfer in transfers if transfer.size is not None}
+        with _monitoring(progress, report, dry_run, total=len(transfers), sizes=sizes) as monitor:
+            run_transfers(tasks, dest_base_uri,
+                          jobs=jobs, dry_run=dry_run, ignore_errors=ignore_errors, quiet=quiet,
+                          max_cache_size=max_cache_size, persist_cache_sizes=persist_cache_sizes,
+                          item_jobs=item_jobs, monitor=monitor, journal=journal, direct=direct)
+        return
+
+    if journal is not None and not dry_run:
+        journal.queue([*((src_ds["uri"], True) for src_ds, _ in result.changed),
+                       *((src_ds["uri"], False) for src_ds in result.missing)])
+
+    with _monitoring(progress, report, dry_run, total=len(result.changed) + len(result.missing)) as monitor:
+        if not quiet:
+            click.secho("Resume copying of changed datasets, presuming their transfer had been interrupted in an earlier attempt.")
+
+        transfer_datasets([src_ds["uri"] for src_ds, _ in result.changed], dest_base_uri,
+                          resume=True, jobs=jobs, dry_run=dry_run, ignore_errors=ignore_errors, quiet=quiet,
+                          item_jobs=item_jobs, monitor=monitor, journal=journal, direct=direct)
+
+        if not quiet:
+            click.secho("Copy missing datasets.")
+
+        transfer_datasets([src_ds["uri"] for src_ds in result.missing], dest_base_uri,
+                          resume=False, jobs=jobs, dry_run=dry_run, ignore_errors=ignore_errors, quiet=quiet,
+                          max_cache_size=max_cache_size, persist_cache_sizes=persist_cache_sizes,
+                          item_jobs=item_jobs, monitor=monitor, journal=journal, direct=direct)
@@ -1,20 +1,17 @@
+import collections
+import collections.abc
 import logging
 
 import json
 import math
 
-import dtoolcore
-from dtool_cli.cli import CONFIG_PATH
+from .backends import _list_for_comparison
+from .record import DatasetPair
+from .timing import span
+from .verify import verify_equal
 
 
-def _make_marker(d):
-    """Mark everything for comparison."""
-    if isinstance(d, list):
-        return [_make_marker(e) for e in d]
-    elif isinstance(d, dict):
-        return {k: _make_marker(v) for k, v in d.items()}
-    else:
-        return True
+logger = logging.getLogger(__name__)
 
 
 def _equal(source, target):
@@ -29,89 +26,354 @@ def _equal(source, target):
         return source == target
 
 
-def _compare(source, target, marker):
-    """Compare source and target partially, as marked by marker."""
-    logger = logging.getLogger(__name__)
-    if isinstance(marker, dict):
-        for k, v in marker.items():
-            if k not in source:
-                logger.info("{} not in source '{}'.".format(k, source))
-                return False
-            if k not in target:
-                logger.info("{} not in target '{}'.".format(k, source))
-                return False
+def _compile_marker(marker, path=()):
+    """Flatten marker into a list of (key path, leaf) tuples in depth-first order.
+
+    Each key path is a tuple of (is_index, key) pairs. Along the path, dict
+    keys must exist in source and target, list indices beyond the length of
+    either source or target are skipped. Leaf is True if the values at the
+    end of the path are to be compared and False if only their existence
+    matters. Empty sub-markers only require their key to exist."""
+    if isinstance(marker, (dict, list)):
+        compiled = []
+        items = marker.items() if isinstance(marker, dict) else enumerate(marker)
+        for k, m in items:
+            compiled.extend(_compile_marker(m, path + ((isinstance(marker, list), k),)))
+        if not compiled and path:
+            return [(path, False)]
+        return compiled
+    else:
+        return [(path, marker is not False)]
 
-            logger.debug("Descending into sub-tree '{}' of '{}'.".format(
-                source[k], source))
-            # descend
-            if not _compare(source[k], target[k], v):
-                return False  # one failed comparison suffices
 
-    elif isinstance(marker, list):  # source, target and marker must have same length
-        logger.debug("Branching into element wise sub-trees of '{}'.".format(
-            source))
-        for s, t, m in zip(source, target, marker):
-            if not _compare(s, t, m):
+def _compare_compiled(source, target, compiled_marker):
+    """Compare source and target partially, as marked by compiled marker."""
+    for path, leaf in compiled_marker:
+        s, t = source, target
+        for is_index, k in path:
+            if is_index:
+                if k >= len(s) or k >= len(t):
+                    break  # nothing to compare beyond shorter list
+            else:
+                if k not in s:
+                    logger.info("%s not in source '%s'.", k, source)
+                    return False
+                if k not in t:
+                    logger.info("%s not in target '%s'.", k, target)
+                    return False
+            s, t = s[k], t[k]
+        else:
+            if leaf and not _equal(s, t):
+                logger.debug("Comparing '%s' == '%s' -> False.", s, t)
                 return False  # one failed comparison suffices
-    else:  # arrived at leaf, comparison desired?
-        if marker is not False:  # yes
-            logger.debug("Comparing '{}' == '{}' -> {}.".format(
-                source, target, _equal(source, target)))
-            return _equal(source, target)
 
-    # comparison either not desired or successfull for all elements
+    # comparison either not desired or successful for all elements
     return True
 
 
+def _compare_everything(source, target):
+    """Compare everything within source against target."""
+    if isinstance(source, collections.abc.Mapping):
+        for k, v in source.items():
+            if k not in target:
+                logger.info("%s not in target '%s'.", k, target)
+                return False
+            if not _compare_everything(v, target[k]):
+                return False
+        return True
+    elif isinstance(source, list):
+        for s, t in zip(source, target):
+            if not _compare_everything(s, t):
+                return False
+        return True
+    else:
+        return _equal(source, target)
+
+
+def _compare(source, target, marker):
+    """Compare source and target partially, as marked by marker."""
+    return _compare_compiled(source, target, _compile_marker(marker))
+
+
+def _make_comparator(marker=None):
+    """Return function comparing source and target as marked by marker, compiled only once.
+
+    If marker is None, then compare everything."""
+    if not marker:
+        return _compare_everything
+    compiled_marker = _compile_marker(marker)
+    return lambda source, target: _compare_compiled(source, target, compiled_marker)
+
+
 def _compare_nested(source, target, marker=None):
     """Compare source and target partially, as marked by marker. If marker is None, then compare everything."""
+    return _make_comparator(marker)(source, target)
+
+
+def make_comparison_marker(fields):
+    """Return comparison marker for a list of field names or a nested marker.
+
+    Field names address nested fields by dots, e.g. 'annotations.project'.
+    A dict is taken as nested marker as is, with True marking values to
+    compare and False marking keys that only need to exist."""
+    if isinstance(fields, dict):
+        return fields
+
+    if isinstance(fields, str) or not all(isinstance(field, str) for field in fields):
+        raise ValueError("Specify comparison fields as list of field names or as nested dict.")
+
+    marker = {}
+    for field in fields:
+        *parents, leaf = field.split('.')
+        node = marker
+        for parent in parents:
+            node = node.setdefault(parent, {})
+            if not isinstance(node, dict):
+                raise ValueError(f"Field '{field}' conflicts with field '{parent}'.")
+        node[leaf] = True
+    return marker
+
+
+def _marker_projection(marker):
+    """Return set of top-level fields a comparison by marker needs, None if it needs everything."""
     if not marker:
-        marker = _make_marker(source)
-    return _compare(source, target, marker)
-
-
-def _forward_compare(source, target, marker=None):
-    """One-way-compare two dicts of nested dict and categorize into 'equal', 'differing' and 'missing'."""
-    missing = dict()
-    differing = dict()
-    equal = dict()
-
-    for k, sd in source.items():
-        if k in target:
-            td = target[k]
-            is_equal = _compare_nested(sd, td, marker)
-            if is_equal:
-                equal[k] = (sd, td)
-            else:
-                differing[k] = (sd, td)
+        return None
+    return frozenset(marker.keys())
+
+
+CATEGORIES = ('equal', 'changed', 'missing')
+
+
+def _sort_key(dataset):
+    return dataset['uuid'], dataset['name']
+
+
+def _sorted_by_uuid_and_name(l):
+    """Return l if already sorted by UUID and name, as listed by _list, otherwise a sorted copy."""
+    if all(_sort_key(a) <= _sort_key(b) for a, b in zip(l, l[1:])):
+        return l
+    return sorted(l, key=_sort_key)
+
+
+def _match_name(dataset):
+    """Return name to match datasets sharing their UUID by, without the '*' marking formatted proto datasets."""
+    return dataset['name'].lstrip('*')
+
+
+def _index_by_uuid_and_name(datasets):
+    """Return dict of dicts of lists of datasets by UUID and name to match by."""
+    index = {}
+    for d in datasets:
+        index.setdefault(d['uuid'], {}).setdefault(_match_name(d), []).append(d)
+    return index
+
+
+def _pop_match(dataset, index, by_uuid=False):
+    """Remove and return the first dataset of equal UUID and name from index, None if there is none.
+
+    If by_uuid is set and no name matches, the only dataset of equal UUID left in index matches."""
+    by_name = index.get(dataset['uuid'], {})
+    candidates = by_name.get(_match_name(dataset))
+    if not candidates and by_uuid:
+        remaining = [tds for tds in by_name.values() if tds]
+        if len(remaining) == 1 and len(remaining[0]) == 1:
+            candidates = remaining[0]
+    return candidates.pop(0) if candidates else None
+
+
+def _match_duplicates(source_group, target_group):
+    """Match datasets sharing their UUID by name, duplicates of differing names do not match.
+
+    Returns lists of (source, target) pairs, unmatched source and unmatched target datasets."""
+    index = _index_by_uuid_and_name(target_group)
+    pairs, missing = [], []
+    for sd in source_group:
+        td = _pop_match(sd, index)
+        if td is None:
+            missing.append(sd)
+        else:
+            pairs.append(DatasetPair(sd, td))
+    remaining_target = sorted((td for by_name in index.values() for tds in by_name.values() for td in tds),
+                              key=_sort_key)
+    return pairs, missing, remaining_target
+
+
+def _merge_dataset_lists(source, target):
+    """Merge-join source and target sorted by UUID and name in a single pass.
+
+    Returns lists of matched (source, target) pairs, datasets only at source
+    and datasets only at target, all in order of UUID and name. The same
+    UUID may occur under different names on either side. If there is only
+    one dataset of a UUID on either side, they match whatever their names,
+    e.g. if renamed at the target. Otherwise, only datasets of equal UUID
+    and name match, see _match_duplicates."""
+    matched, missing, extra = [], [], []
+    i = j = 0
+    while i < len(source) or j < len(target):
+        if j >= len(target) or (i < len(source) and source[i]['uuid'] < target[j]['uuid']):
+            missing.append(source[i])
+            i += 1
+        elif i >= len(source) or target[j]['uuid'] < source[i]['uuid']:
+            extra.append(target[j])
+            j += 1
         else:
-            missing[k] = sd
+            uuid = source[i]['uuid']
+            i2, j2 = i + 1, j + 1
+            while i2 < len(source) and source[i2]['uuid'] == uuid:
+                i2 += 1
+            while j2 < len(target) and target[j2]['uuid'] == uuid:
+                j2 += 1
+            if i2 - i == 1 and j2 - j == 1:
+                matched.append(DatasetPair(source[i], target[j]))
+            else:
+                pairs, unmatched_source, unmatched_target = _match_duplicates(source[i:i2], target[j:j2])
+                matched.extend(pairs)
+                missing.extend(unmatched_source)
+                extra.extend(unmatched_target)
+            i, j = i2, j2
+    return matched, missing, extra
+
 
-    return equal, differing, missing
+class ComparisonResult:
+    """Categorization of source and target dataset lists, materialized on demand.
 
+    Source and target are merged by UUID in a single pass on first access of
+    any category. Matched pairs are only compared by marker once 'equal' or
+    'changed' are accessed, i.e. 'missing' and 'extra' never compare metadata.
+    Categories hold references to the listed entries, never copies."""
 
-def _ds_list_to_dict(l):
-    """Convert list of dataset metadata entries to dict with UUIDs as keys."""
-    return {e['uuid']: e for e in l}
+    __slots__ = ('_source', '_target', '_marker', '_matched', '_missing', '_extra', '_equal', '_changed')
 
+    def __init__(self, source, target, marker=None):
+        self._source = _sorted_by_uuid_and_name(source)
+        self._target = _sorted_by_uuid_and_name(target)
+        self._marker = marker
+        self._matched = self._missing = self._extra = None
+        self._equal = self._changed = None
 
-def _direct_list(base_uri, config_path=CONFIG_PATH):
-    """Directly list all datasets at base_uri via suitable storage broker."""
-    base_uri = dtoolcore.utils.sanitise_uri(base_uri)
-    StorageBroker = dtoolcore._get_storage_broker(base_uri, config_path)
-    info = []
+    def _merge(self):
+        if self._matched is None:
+            with span("compare"):
+                self._matched, self._missing, self._extra = _merge_dataset_lists(self._source, self._target)
 
-    for uri in StorageBroker.list_dataset_uris(base_uri, config_path):
-        admin_metadata = dtoolcore._admin_metadata_from_uri(uri, config_path)
-        info.append(admin_metadata)
+    def _compare(self):
+        if self._equal is None:
+            self._merge()
+            with span("compare"):
+                compare = _make_comparator(self._marker)
+                self._equal, self._changed = [], []
+                for pair in self._matched:
+                    (self._equal if compare(*pair) else self._changed).append(pair)
 
-    by_name = sorted(info, key=lambda d: d['name'])
-    return by_name
+    @property
+    def matched(self):
+        """(source, target) pairs of datasets present on both sides."""
+        self._merge()
+        return self._matched
+
+    @property
+    def equal(self):
+        """(source, target) pairs that compare equal by marker."""
+        self._compare()
+        return self._equal
+
+    @property
+    def changed(self):
+        """(source, target) pairs that differ by marker."""
+        self._compare()
+        return self._changed
+
+    @property
+    def missing(self):
+        """Datasets present at source, but missing on target."""
+        self._merge()
+        return self._missing
+
+    @property
+    def extra(self):
+        """Datasets present on target, but not at source."""
+        self._merge()
+        return self._extra
+
+    def verify_content(self, **kwargs):
+        """Move equal pairs with differing item manifests to changed.
+
+        Keyword arguments as for verify.verify_equal."""
+        equal, changed = self.equal, self.changed
+        with span("verify"):
+            self._equal, self._changed = verify_equal(equal, changed, **kwargs)
+
+    def categorized(self, *categories):
+        """Return dict of requested categories, 'equal', 'changed' and 'missing' per default."""
+        return {category: getattr(self, category) for category in (categories or CATEGORIES)}
 
 
 def compare_dataset_lists(source, target, marker=None):
     """One-way compare source and target dataset metadata lists by fields set True within marker."""
-    s = _ds_list_to_dict(source)
-    t = _ds_list_to_dict(target)
-    equal, differing, missing = _forward_compare(s, t, marker)
-    return list(equal.values()), list(differing.values()), list(missing.values())
+    result = ComparisonResult(source, target, marker)
+    return result.equal, result.changed, result.missing
+
+
+def iter_compare_datasets(source, target, marker=None):
+    """One-way compare datasets as yielded by source against target dataset metadata list.
+
+    Only target is indexed by UUID and name upfront, source may be any
+    iterable and is consumed lazily. Datasets match as for
+    _merge_dataset_lists. Yields ('equal', (source, target)),
+    ('changed', (source, target)) or ('missing', source) tuples in order of
+    source. Only source datasets without a target of equal name, but of
+    equal UUID, come last, as they may only match once source is exhausted."""
+    index = _index_by_uuid_and_name(target)
+    target_counts = {uuid: sum(map(len, by_name.values())) for uuid, by_name in index.items()}
+    source_counts = collections.Counter()
+    compare = _make_comparator(marker)
+
+    def categorize(sd, td):
+        if td is None:
+            return 'missing', sd
+        elif compare(sd, td):
+            return 'equal', DatasetPair(sd, td)
+        else:
+            return 'changed', DatasetPair(sd, td)
+
+    deferred = []
+    for sd in source:
+        if sd['uuid'] in index:
+            source_counts[sd['uuid']] += 1
+        td = _pop_match(sd, index)
+        if td is None and sd['uuid'] in index:
+            deferred.append(sd)
+        else:
+            yield categorize(sd, td)
+
+    for sd in deferred:
+        unique = source_counts[sd['uuid']] == 1 and target_counts[sd['uuid']] == 1
+        yield categorize(sd, _pop_match(sd, index, by_uuid=unique))
+
+
+def compare_base_uris(source_base_uri, target_base_uri, compare_fields=None,
+                      source_query=None, target_query=None, **kwargs):
+    """One-way compare datasets at source and target base URIs by compare_fields.
+
+    Parameters
+    ----------
+    source_base_uri: str
+    target_base_uri: str
+    compare_fields: list of str or dict or None, default: None
+        field names or nested marker as for make_comparison_marker,
+        compare everything if None. Listed entries are reduced to the
+        fields needed for comparison.
+    source_query: dict or None, default: None
+    target_query: dict or None, default: None
+        filter listings by mongo query where supported by the listing backend
+    further keyword arguments as for dtool_sync.backends.ListingBackend.iter_list
+
+    Returns
+    -------
+    equal, changed, missing: list
+        as returned by compare_dataset_lists
+    """
+    marker = None if compare_fields is None else make_comparison_marker(compare_fields)
+    source, target = _list_for_comparison(source_base_uri, target_base_uri, source_query, target_query,
+                                          fields=_marker_projection(marker), **kwargs)
+    return compare_dataset_lists(source, target, marker)
@@ -0,0 +1,138 @@
+"""Linear-time unified diff between sorted dataset lists."""
+
+import difflib
+
+from . import _txt_iter_dataset_list
+
+
+def _format_range_unified(start, stop):
+    """Convert range to the 'ed' format, as done by difflib.unified_diff."""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '{}'.format(beginning)
+    if not length:
+        beginning -= 1
+    return '{},{}'.format(beginning, length)
+
+
+class _PrecomputedSequenceMatcher(difflib.SequenceMatcher):
+    """SequenceMatcher that serves precomputed opcodes, only used for grouping."""
+
+    def __init__(self, opcodes):
+        super().__init__(None, [], [])
+        self._opcodes = opcodes
+
+    def get_opcodes(self):
+        return self._opcodes
+
+
+def _append_opcode(opcodes, tag, i1, i2, j1, j2):
+    """Append opcode, join adjacent equal ranges and adjacent differing ranges."""
+    if i1 == i2 and j1 == j2:
+        return
+    if opcodes:
+        previous_tag, pi1, _, pj1, _ = opcodes[-1]
+        if previous_tag == 'equal' and tag == 'equal':
+            opcodes[-1] = ('equal', pi1, i2, pj1, j2)
+            return
+        if previous_tag != 'equal' and tag != 'equal':
+            if i2 > pi1 and j2 > pj1:
+                tag = 'replace'
+            elif i2 > pi1:
+                tag = 'delete'
+            else:
+                tag = 'insert'
+            opcodes[-1] = (tag, pi1, i2, pj1, j2)
+            return
+    opcodes.append((tag, i1, i2, j1, j2))
+
+
+def _merge_opcodes(a_blocks, b_blocks):
+    """Merge-join two lists of (key, lines) blocks sorted by key into opcodes over their lines.
+
+    Blocks with equal keys are diffed line by line, all others are deleted or inserted."""
+    opcodes = []
+    ia = ib = 0  # block indices
+    i = j = 0  # line indices
+    while ia < len(a_blocks) or ib < len(b_blocks):
+        if ib >= len(b_blocks) or (ia < len(a_blocks) and a_blocks[ia][0] < b_blocks[ib][0]):
+            n = len(a_blocks[ia][1])
+            _append_opcode(opcodes, 'delete', i, i + n, j, j)
+            i += n
+            ia += 1
+        elif ia >= len(a_blocks) or b_blocks[ib][0] < a_blocks[ia][0]:
+            n = len(b_blocks[ib][1])
+            _append_opcode(opcodes, 'insert', i, i, j, j + n)
+            j += n
+            ib += 1
+        else:
+            a_lines, b_lines = a_blocks[ia][1], b_blocks[ib][1]
+            if a_lines == b_lines:
+                _append_opcode(opcodes, 'equal', i, i + len(a_lines), j, j + len(b_lines))
+            else:
+                for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a_lines, b_lines).get_opcodes():
+                    _append_opcode(opcodes, tag, i + i1, i + i2, j + j1, j + j2)
+            i += len(a_lines)
+            j += len(b_lines)
+            ia += 1
+            ib += 1
+    return opcodes
+
+
+def _dataset_blocks(dataset_list, quiet=False, verbose=False):
+    """Format every dataset as a block of text lines, keyed by UUID.
+
+    Lines end with line breaks, but the very last one, as in str.splitlines(keepends=True)
+    applied to the output of _txt_format_dataset_list."""
+    blocks = [(d['uuid'], [line + '\n' for line in _txt_iter_dataset_list(
+                  [d], quiet=quiet, verbose=verbose, ls_output=False)])
+              for d in dataset_list]
+    # the formatted output is stripped of trailing whitespace
+    while blocks and blocks[-1][1] and not blocks[-1][1][-1].strip():
+        blocks[-1][1].pop()
+    if blocks and blocks[-1][1]:
+        blocks[-1][1][-1] = blocks[-1][1][-1].rstrip()
+    return blocks
+
+
+def unified_merge_diff(lhs_info, rhs_info, fromfile='', tofile='', quiet=False, verbose=False, n=3, lineterm='\n'):
+    """Unified diff between text formatted dataset lists sorted by (uuid, name).
+
+    Yields lines in the format of difflib.unified_diff applied to the
+    formatted lists, but merges datasets by UUID in linear time instead of
+    searching for matching lines across the whole lists. Lines of a dataset
+    are only ever matched with lines of the same dataset on the other side.
+    difflib may align repeated lines across datasets differently and treats
+    lines frequent in long lists as junk, so hunks may differ from its output
+    while describing the same change."""
+    a_blocks = _dataset_blocks(lhs_info, quiet=quiet, verbose=verbose)
+    b_blocks = _dataset_blocks(rhs_info, quiet=quiet, verbose=verbose)
+    a = [line for _, lines in a_blocks for line in lines]
+    b = [line for _, lines in b_blocks for line in lines]
+
+    matcher = _PrecomputedSequenceMatcher(_merge_opcodes(a_blocks, b_blocks))
+
+    started = False
+    for group in matcher.get_grouped_opcodes(n):
+        if not started:
+            started = True
+            yield '--- {}{}'.format(fromfile, lineterm)
+            yield '+++ {}{}'.format(tofile, lineterm)
+
+        first, last = group[0], group[-1]
+        file1_range = _format_range_unified(first[1], last[2])
+        file2_range = _format_range_unified(first[3], last[4])
+        yield '@@ -{} +{} @@{}'.format(file1_range, file2_range, lineterm)
+
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in {'replace', 'delete'}:
+                for line in a[i1:i2]:
+                    yield '-' + line
+            if tag in {'replace', 'insert'}:
+                for line in b[j1:j2]:
+                    yield '+' + line
@@ -0,0 +1,115 @@
+"""Persistent local index of listed datasets' admin metadata.
+
+The admin metadata of frozen datasets never changes. Listing a base URI
+thus only needs to fetch admin metadata of dataset URIs not seen before
+and of proto datasets. Everything else is served from an SQLite database
+within the dtool cache directory.
+
+Datasets may be deleted and re-created at the same URI. Index entries are
+thus revalidated as cheaply as the storage allows: on local disk by the
+modification time of the admin metadata file, at URIs ending in a UUID by
+that UUID. Entries at other URIs are served until --refresh."""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import urllib.parse
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIRNAME = "dtool-sync"
+INDEX_FILENAME = "listing.sqlite"
+
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def _get_index_path(config_path=None):
+    from dtoolcore.utils import get_config_value, DEFAULT_CACHE_PATH
+    cache_abspath = get_config_value(
+        "DTOOL_CACHE_DIRECTORY",
+        config_path=config_path,
+        default=DEFAULT_CACHE_PATH
+    )
+    return os.path.join(cache_abspath, INDEX_DIRNAME, INDEX_FILENAME)
+
+
+def _connect(config_path=None):
+    index_path = _get_index_path(config_path)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    connection = sqlite3.connect(index_path, timeout=30)
+    connection.execute("""CREATE TABLE IF NOT EXISTS admin_metadata (
+                              base_uri TEXT NOT NULL,
+                              uri TEXT NOT NULL,
+                              admin_metadata TEXT NOT NULL,
+                              signature INTEGER,
+                              PRIMARY KEY (base_uri, uri))""")
+    return connection
+
+
+def _signature(uri):
+    """Return cheap fingerprint of the admin metadata stored at dataset uri, None if there is none.
+
+    On local disk, this is the modification time of the admin metadata file."""
+    parsed_uri = urllib.parse.urlsplit(uri)
+    if parsed_uri.scheme not in ("", "file"):
+        return None
+    try:
+        return os.stat(os.path.join(urllib.parse.unquote(parsed_uri.path), ".dtool", "dtool")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _is_current(uri, admin_metadata, indexed_signature, signature):
+    """Return False if the dataset at uri has evidently been replaced since indexed."""
+    if signature is not None and signature != indexed_signature:
+        return False
+    last_segment = uri.rstrip("/").rsplit("/", 1)[-1]
+    return UUID_PATTERN.fullmatch(last_segment) is None or last_segment == admin_metadata["uuid"]
+
+
+def load_index(base_uri, config_path=None):
+    """Return dict of indexed (admin metadata, signature) at base_uri, with dataset URIs as keys.
+
+    Returns empty dict if the index is not accessible."""
+    try:
+        connection = _connect(config_path)
+        try:
+            rows = connection.execute(
+                "SELECT uri, admin_metadata, signature FROM admin_metadata WHERE base_uri = ?",
+                (base_uri,)).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as exc:
+        logger.warning(f"Could not read listing index: {exc}")
+        return {}
+
+    return {uri: (json.loads(admin_metadata), signature) for uri, admin_metadata, signature in rows}
+
+
+def update_index(base_uri, admin_metadata_by_uri, listed_uris, signatures=None, config_path=None):
+    """Store admin metadata by dataset URI and drop index entries at base_uri not within listed_uris.
+
+    signatures maps dataset URIs to their signature at the time admin metadata was fetched."""
+    signatures = signatures or {}
+    listed_uris = set(listed_uris)
+    try:
+        connection = _connect(config_path)
+        try:
+            with connection:
+                indexed_uris = [uri for (uri,) in connection.execute(
+                    "SELECT uri FROM admin_metadata WHERE base_uri = ?", (base_uri,))]
+                connection.executemany(
+                    "DELETE FROM admin_metadata WHERE base_uri = ? AND uri = ?",
+                    [(base_uri, uri) for uri in indexed_uris if uri not in listed_uris])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO admin_metadata (base_uri, uri, admin_metadata, signature) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(base_uri, uri, json.dumps(admin_metadata), signatures.get(uri))
+                     for uri, admin_metadata in admin_metadata_by_uri.items()])
+        finally:
+            connection.close()
+    except sqlite3.Error as exc:
+        logger.warning(f"Could not update listing index: {exc}")
@@ -0,0 +1,156 @@
+"""Persistent journal of dataset transfers, for continuing interrupted sync runs.
+
+Before transferring anything, a sync run with a journal queues all of its
+transfers from a source to a destination base URI. Each transfer then
+passes through the states
+
+queued
+    not started yet
+copying
+    in flight, or interrupted if the run was killed
+frozen
+    copy complete and frozen at the destination
+failed
+    copying raised an error, the run continued or stopped
+
+A run that finds queued or copying transfers in the journal for the same
+pair of base URIs and the same selection of datasets, e.g. the same
+queries and compared fields, has been interrupted. It continues from the journal
+without listing and comparing both base URIs again. Only copies that have
+been in flight or failed are re-validated: those frozen in the meantime are
+skipped, those with a proto dataset at the destination are resumed and all
+others are started as queued. Otherwise, i.e. after a completed run, the
+next run lists and compares as usual and replaces the journal's entries.
+Runs selecting datasets differently never continue each other."""
+
+import json
+import logging
+import sqlite3
+import time
+
+from . import CONFIG_PATH
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+COPYING = "copying"
+FROZEN = "frozen"
+FAILED = "failed"
+TRANSFER_STATES = (QUEUED, COPYING, FROZEN, FAILED)
+
+
+def _get_copy_type(dataset_uri, dest_base_uri, config_path=CONFIG_PATH):
+    """Return type 'dataset' or 'protodataset' of the copy of dataset_uri at dest_base_uri, None if there is none."""
+    import dtoolcore
+    src_dataset = dtoolcore.DataSet.from_uri(dataset_uri, config_path=config_path)
+    dest_uri = dtoolcore._generate_uri(admin_metadata=src_dataset._admin_metadata, base_uri=dest_base_uri)
+    storage_broker = dtoolcore._get_storage_broker(dest_uri, config_path)
+    if not storage_broker.has_admin_metadata():
+        return None
+    return storage_broker.get_admin_metadata()["type"]
+
+
+class SyncJournal:
+    """Transfer states of sync runs from source_base_uri to dest_base_uri, stored in an SQLite database at path.
+
+    Selection is any JSON-serializable description of how a run selects
+    the datasets to transfer, e.g. queries and comparison marker. Several
+    pairs of base URIs and selections may share one journal file. All
+    methods are safe to call from several threads at once."""
+
+    def __init__(self, path, source_base_uri, dest_base_uri, selection=None):
+        self.path = path
+        self.source_base_uri = source_base_uri
+        self.dest_base_uri = dest_base_uri
+        self.selection = json.dumps(selection, sort_keys=True)
+
+    @property
+    def _key(self):
+        return self.source_base_uri, self.dest_base_uri, self.selection
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("""CREATE TABLE IF NOT EXISTS transfers (
+                                  source_base_uri TEXT NOT NULL,
+                                  dest_base_uri TEXT NOT NULL,
+                                  selection TEXT NOT NULL,
+                                  position INTEGER NOT NULL,
+                                  uri TEXT NOT NULL,
+                                  resume INTEGER NOT NULL,
+                                  state TEXT NOT NULL,
+                                  dest_uri TEXT,
+                                  error TEXT,
+                                  updated_at REAL NOT NULL,
+                                  PRIMARY KEY (source_base_uri, dest_base_uri, selection, uri))""")
+        return connection
+
+    def _execute(self, statement, parameters=()):
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute(statement, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def entries(self):
+        """Return list of (uri, resume, state) of all journaled transfers, in order of queueing."""
+        rows = self._execute(
+            "SELECT uri, resume, state FROM transfers "
+            "WHERE source_base_uri = ? AND dest_base_uri = ? AND selection = ? ORDER BY position", self._key)
+        return [(uri, bool(resume), state) for uri, resume, state in rows]
+
+    def interrupted(self):
+        """Return True if the last run did not get to the end of its transfers."""
+        return any(state in (QUEUED, COPYING) for _, _, state in self.entries())
+
+    def queue(self, tasks):
+        """Replace all journaled transfers by tasks, an iterable of (uri, resume), all queued."""
+        now = time.time()
+        rows = [(*self._key, position, uri, bool(resume), QUEUED, now) for position, (uri, resume) in enumerate(tasks)]
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "DELETE FROM transfers WHERE source_base_uri = ? AND dest_base_uri = ? AND selection = ?", self._key)
+                connection.executemany(
+                    "INSERT INTO transfers (source_base_uri, dest_base_uri, selection, position, uri, resume, state, "
+                    "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            connection.close()
+        logger.debug("Queued %d transfers in journal '%s'.", len(rows), self.path)
+
+    def mark(self, uri, state, dest_uri=None, error=None):
+        """Set state of the queued transfer of dataset at uri."""
+        if state not in TRANSFER_STATES:
+            raise ValueError(f"Unknown transfer state '{state}', choose from {', '.join(TRANSFER_STATES)}.")
+        try:
+            self._execute(
+                "UPDATE transfers SET state = ?, dest_uri = ?, error = ?, updated_at = ? "
+                "WHERE source_base_uri = ? AND dest_base_uri = ? AND selection = ? AND uri = ?",
+                (state, dest_uri, error, time.time(), *self._key, uri))
+        except sqlite3.Error as exc:
+            # never let bookkeeping break a transfer, the next run just re-validates more
+            logger.warning(f"Could not update journal: {exc}")
+
+    def resumable_tasks(self, config_path=CONFIG_PATH, dry_run=False):
+        """Return list of (uri, resume) of transfers left to continue an interrupted run.
+
+        Queued transfers keep their resume flag. Transfers that have been in
+        flight or failed are marked frozen if their copy has been completed in
+        the meantime, resumed if a proto dataset exists at the destination,
+        and keep their resume flag otherwise, e.g. if copying failed before
+        creating the proto dataset. Dry runs leave the journal as is."""
+        tasks = []
+        for uri, resume, state in self.entries():
+            if state == QUEUED:
+                tasks.append((uri, resume))
+            elif state in (COPYING, FAILED):
+                copy_type = _get_copy_type(uri, self.dest_base_uri, config_path=config_path)
+                if copy_type == "dataset":
+                    logger.info("Copy of %s has been frozen before the interruption, skip.", uri)
+                    if not dry_run:
+                        self.mark(uri, FROZEN)
+                else:
+                    tasks.append((uri, resume or copy_type == "protodataset"))
+        return tasks
@@ -0,0 +1,212 @@
+"""Bulk listing of datasets registered at a lookup server.
+
+Lookup URIs take the form
+
+    lookup://[HOST[:PORT][/PATH]][?base_uri=BASE_URI[&base_uri=BASE_URI ...]]
+
+An empty server part refers to the lookup server configured for
+dtool-lookup-api. Use the scheme 'lookup+http' for servers not offering
+https. If base URIs are given, only datasets registered at these base URIs
+are listed, with one bulk query per base URI filtered server-side.
+
+Instead of waiting for one query to return the whole result set, results are
+requested page by page. The first page tells about the total number of pages,
+all further pages are requested concurrently and handed on as they arrive.
+All requests share a single client session and thereby its connection pool."""
+
+import asyncio
+import datetime
+import email.utils
+import logging
+import urllib.parse
+
+from . import _format_admin_metadata, _project
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+UUID_CHUNK_SIZE = 1000
+
+LOOKUP_SCHEMES = {
+    "lookup": "https",
+    "lookup+https": "https",
+    "lookup+http": "http",
+}
+
+ADMIN_METADATA_KEYS = ("uuid", "dtoolcore_version", "name", "type", "creator_username", "created_at", "frozen_at")
+
+
+def _is_lookup_uri(uri):
+    return urllib.parse.urlsplit(uri).scheme in LOOKUP_SCHEMES
+
+
+def _parse_lookup_uri(uri):
+    """Return lookup server URL and list of base URIs to filter by.
+
+    Either is None if not specified within uri."""
+    parsed_uri = urllib.parse.urlsplit(uri)
+    if parsed_uri.scheme not in LOOKUP_SCHEMES:
+        raise ValueError(f"Not a lookup URI: {uri}")
+
+    lookup_url = None
+    if parsed_uri.netloc:
+        lookup_url = urllib.parse.urlunsplit(
+            (LOOKUP_SCHEMES[parsed_uri.scheme], parsed_uri.netloc, parsed_uri.path.rstrip("/"), "", ""))
+
+    base_uris = urllib.parse.parse_qs(parsed_uri.query).get("base_uri", None)
+    return lookup_url, base_uris
+
+
+def _parse_timestamp(value):
+    """Convert a date as returned by a lookup server into a POSIX timestamp.
+
+    Dates without time zone are in UTC, as stored by dtool."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        date = email.utils.parsedate_to_datetime(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+def _admin_metadata_from_lookup_entry(entry):
+    """Reduce a lookup server entry to admin metadata as stored with the dataset itself."""
+    admin_metadata = {key: entry[key] for key in ADMIN_METADATA_KEYS if key in entry}
+    admin_metadata.setdefault("type", "dataset")  # only frozen datasets are registered
+    for key in ("created_at", "frozen_at"):
+        if key in admin_metadata:
+            admin_metadata[key] = _parse_timestamp(admin_metadata[key])
+    return admin_metadata
+
+
+def _get_lookup_client_class():
+    try:
+        from dtool_lookup_api.core.LookupClient import ConfigurationBasedAuthenticatedLookupClient
+    except ImportError as exc:
+        logger.error("Please install dtool-lookup-api to compare against lookup server.")
+        raise exc
+    return ConfigurationBasedAuthenticatedLookupClient
+
+
+def _iter_filters(base_uris=None, uuids=None):
+    """Yield keyword arguments restricting one bulk query each to a single base URI and a chunk of UUIDs."""
+    uuid_chunks = [None]
+    if uuids is not None:
+        uuids = sorted(set(uuids))
+        uuid_chunks = [uuids[i:i + UUID_CHUNK_SIZE] for i in range(0, len(uuids), UUID_CHUNK_SIZE)]
+
+    for base_uri in (base_uris or [None]):
+        for uuid_chunk in uuid_chunks:
+            yield dict(base_uris=None if base_uri is None else [base_uri], uuids=uuid_chunk)
+
+
+async def _iter_query_pages(client, query={}, base_uris=None, uuids=None, page_size=DEFAULT_PAGE_SIZE, jobs=1):
+    """Yield pages of datasets matching query in order of arrival.
+
+    Issues one paginated bulk query per base URI, or a single one over all
+    base URIs if None. If uuids are given, queries are restricted to these,
+    in chunks of UUID_CHUNK_SIZE. The first page of each query tells about
+    the number of further pages. Up to 'jobs' pages are requested concurrently."""
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def fetch(filters, page_number):
+        pagination = {}  # never rely on the client's shared mutable default
+        async with semaphore:
+            page = await client.get_datasets_by_mongo_query(
+                query, **filters, page_number=page_number, page_size=page_size, pagination=pagination)
+        further_page_numbers = ()
+        if page_number == 1:
+            total_pages = pagination.get('total_pages', 1)
+            logger.debug("Lookup server query on base URIs %s matches %s datasets on %s pages.",
+                         filters['base_uris'], pagination.get('total', len(page)), total_pages)
+            further_page_numbers = range(2, total_pages + 1)
+        return filters, page, further_page_numbers
+
+    pending = {asyncio.ensure_future(fetch(filters, 1)) for filters in _iter_filters(base_uris, uuids)}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                filters, page, further_page_numbers = task.result()
+                yield page
+                # only request further pages if the consumer asks for more
+                pending.update(asyncio.ensure_future(fetch(filters, page_number))
+                               for page_number in further_page_numbers)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _iter_lookup_pages(query={}, lookup_url=None, **kwargs):
+    """Yield pages of datasets matching query via a single, authenticated lookup client session.
+
+    Further keyword arguments as for _iter_query_pages."""
+    client_class = _get_lookup_client_class()
+    async with client_class(lookup_url=lookup_url) as client:
+        async for page in _iter_query_pages(client, query, **kwargs):
+            yield page
+
+
+def _iter_lookup_list(lookup_uri="lookup://", *args, query={}, uuids=None, raw=True, fields=None,
+                      page_size=DEFAULT_PAGE_SIZE, jobs=1, **kwargs):
+    """List datasets registered at lookup server, filtered by query, yield them as they arrive.
+
+    Datasets are yielded unsorted and in the same shape as by _iter_direct_list.
+    Pages are only fetched while the consumer asks for more datasets, i.e. only
+    few pages are held in memory at a time.
+
+    Parameters
+    ----------
+    lookup_uri: str, default: 'lookup://'
+        lookup server and base URIs to list datasets at, see module docstring
+    query: dict
+        mongo query, empty query matches all datasets
+    uuids: iterable of str or None, default: None
+        if set, only list datasets with these UUIDs
+    raw: bool, default: True
+        if set, just yield admin metadata as stored with the datasets
+        otherwise, reformat list entries as done by dtool_info.dataset._list_datasets
+    fields: set of str or None, default: None
+        if set, reduce entries to these fields and 'uuid', 'name' and 'uri'
+        as they arrive. The lookup server always sends complete entries, thus
+        fields only save memory, not transfer.
+    page_size: int, default: DEFAULT_PAGE_SIZE
+        number of datasets per request
+    jobs: int, default: 1
+        number of pages requested concurrently
+    """
+    lookup_url, base_uris = _parse_lookup_uri(lookup_uri)
+    if uuids is not None and not uuids:
+        return
+    loop = asyncio.new_event_loop()
+    pages = _iter_lookup_pages(query, lookup_url=lookup_url, base_uris=base_uris, uuids=uuids,
+                               page_size=page_size, jobs=jobs)
+    try:
+        while True:
+            try:
+                page = loop.run_until_complete(pages.__anext__())
+            except StopAsyncIteration:
+                break
+            for entry in page:
+                yield _project(_format_admin_metadata(_admin_metadata_from_lookup_entry(entry), entry['uri'],
+                                                      raw=raw), fields)
+    finally:
+        loop.run_until_complete(pages.aclose())
+        loop.close()
+
+
+def _lookup_list(lookup_uri="lookup://", *args, **kwargs):
+    """List all datasets registered at lookup server, filtered by query.
+
+    Parameters as for _iter_lookup_list."""
+    # depending on the underlying storage, it is possible to have the same dataset with equivalent UUID
+    # exist multiple times under differing names.
+    by_uuid_and_name = sorted(_iter_lookup_list(lookup_uri, *args, **kwargs), key=lambda d: (d['uuid'], d['name']))
+    return by_uuid_and_name
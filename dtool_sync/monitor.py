@@ -0,0 +1,184 @@
+"""Instrumentation of dataset transfers.
+
+A TransferMonitor records bytes, duration, retries and errors per transferred
+dataset as well as cache evictions. It may render a live progress bar with
+throughput and estimated time of arrival and writes a machine-readable run
+report at the end, i.e. ::
+
+    {
+        "started_at": 1630851890.0,
+        "duration": 12.5,
+        "datasets": 2,
+        "failed": 0,
+        "bytes": 27,
+        "bytes_per_second": 2.16,
+        "datasets_per_second": 0.16,
+        "transfers": [
+            {"uri": "file:///lhs/people", "dest_uri": "file:///rhs/people", "resume": false,
+             "bytes": 19, "started_at": 1630851890.1, "duration": 8.2, "retries": 0, "error": null},
+            ...
+        ],
+        "cache_evictions": [{"name": "...", "bytes": 19, "at": 1630851898.4}, ...]
+    }
+
+Sizes are taken from source manifests, thus bytes of resumed transfers
+count the whole dataset, not only the items actually copied."""
+
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+
+import click
+
+from dtool_info.utils import sizeof_fmt
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransferRecord:
+    """Measurements of a single dataset transfer."""
+
+    __slots__ = ("uri", "dest_uri", "resume", "bytes", "started_at", "duration", "retries", "error")
+
+    def __init__(self, uri, resume=False):
+        self.uri = uri
+        self.dest_uri = None
+        self.resume = resume
+        self.bytes = None
+        self.started_at = time.time()
+        self.duration = None
+        self.retries = 0
+        self.error = None
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class TransferMonitor:
+    """Thread-safe collector of transfer measurements, see module docstring.
+
+    Parameters
+    ----------
+    total: int or None, default: None
+        number of datasets to transfer if known in advance, enables ETA
+    progress: bool, default: False
+        render live progress to stderr, as bar if total is known
+    sizes: dict or None, default: None
+        known sizes in bytes by dataset URI, e.g. from scheduling.
+        Sizes of all other datasets are taken from their manifests.
+    """
+
+    def __init__(self, total=None, progress=False, sizes=None):
+        self.total = total
+        self.sizes = dict(sizes or {})
+        self.transfers = []
+        self.cache_evictions = []
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._progressbar = None
+        self._progress = progress
+        if progress and total is not None:
+            self._progressbar = click.progressbar(
+                length=total, label="Syncing datasets", file=sys.stderr,
+                item_show_func=lambda _: self.status(), show_eta=False)
+            self._progressbar.__enter__()
+
+    def _size(self, uri):
+        if uri not in self.sizes:
+            from .schedule import _estimate_size
+            self.sizes[uri] = _estimate_size(uri)
+        return self.sizes[uri]
+
+    @contextlib.contextmanager
+    def transfer(self, uri, resume=False):
+        """Context measuring the transfer of dataset at uri, yields its TransferRecord."""
+        record = TransferRecord(uri, resume=resume)
+        start = time.monotonic()
+        try:
+            yield record
+        except Exception as exc:
+            record.error = f"{type(exc).__name__}: {exc}"
+            raise
+        else:
+            record.bytes = self._size(uri)
+        finally:
+            record.duration = time.monotonic() - start
+            with self._lock:
+                self.transfers.append(record)
+                self._render()
+
+    def evicted(self, name, size):
+        """Record deletion of cache entry name of size bytes, see dtool_sync._clean_cache."""
+        with self._lock:
+            self.cache_evictions.append({"name": name, "bytes": size, "at": time.time()})
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    @property
+    def bytes(self):
+        return sum(record.bytes or 0 for record in self.transfers)
+
+    def eta(self):
+        """Estimated seconds until all datasets are transferred, None if unknown."""
+        done = len(self.transfers)
+        if self.total is None or not done:
+            return None
+        return self.elapsed / done * max(self.total - done, 0)
+
+    def status(self):
+        """One line of progress, i.e. datasets and bytes transferred, throughput and ETA."""
+        elapsed = self.elapsed
+        done = len(self.transfers)
+        status = f"{done}" if self.total is None else f"{done}/{self.total}"
+        status += f" datasets, {sizeof_fmt(self.bytes).strip()} in {elapsed:.0f} s"
+        if elapsed > 0:
+            status += f", {sizeof_fmt(self.bytes / elapsed).strip()}/s"
+        eta = self.eta()
+        if eta is not None:
+            status += f", ETA {eta:.0f} s"
+        return status
+
+    def _render(self):
+        if self._progressbar is not None:
+            self._progressbar.update(1)
+        elif self._progress:
+            click.echo(self.status(), err=True)
+
+    def close(self):
+        """Finish rendering progress."""
+        if self._progressbar is not None:
+            self._progressbar.__exit__(None, None, None)
+            self._progressbar = None
+
+    def report(self):
+        """Return run report as dict, see module docstring."""
+        with self._lock:
+            transfers = [record.to_dict() for record in self.transfers]
+            cache_evictions = list(self.cache_evictions)
+        duration = self.elapsed
+        succeeded = [t for t in transfers if t["error"] is None]
+        nbytes = sum(t["bytes"] or 0 for t in succeeded)
+        return {
+            "started_at": self.started_at,
+            "duration": duration,
+            "datasets": len(succeeded),
+            "failed": len(transfers) - len(succeeded),
+            "bytes": nbytes,
+            "bytes_per_second": nbytes / duration if duration > 0 else None,
+            "datasets_per_second": len(succeeded) / duration if duration > 0 else None,
+            "transfers": transfers,
+            "cache_evictions": cache_evictions,
+        }
+
+    def dump_report(self, path):
+        """Write run report as JSON to path."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+        logger.info("Wrote run report to '%s'.", path)
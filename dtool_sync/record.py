@@ -0,0 +1,145 @@
+"""Compact records of listed datasets and compared dataset pairs.
+
+Listings of hundreds of thousands of datasets are held in memory as a whole
+for sorting and comparison. A DatasetRecord keeps the common admin metadata
+fields in slots instead of a per-dataset dict and shares values repeated
+across datasets, such as the creator and the dtoolcore version. URIs ending
+in the dataset's name are stored as shared prefix only. Records are
+read-only mappings, i.e. they are accessed just like admin metadata dicts,
+and keep the order of their keys as constructed."""
+
+import collections.abc
+import sys
+
+
+# admin metadata fields kept in slots, any others go into a dict
+RECORD_FIELDS = ("uuid", "dtoolcore_version", "name", "type", "creator_username", "created_at", "frozen_at", "uri")
+# fields with few distinct values across datasets, their values are shared between records
+SHARED_VALUE_FIELDS = frozenset({"dtoolcore_version", "type", "creator_username"})
+
+_RECORD_FIELD_SET = frozenset(RECORD_FIELDS)
+
+# orders of keys seen so far, records of the same shape share one tuple of keys
+_KEY_ORDERS = {}
+
+
+class DatasetRecord(collections.abc.Mapping):
+    """Read-only mapping of a listed dataset's metadata.
+
+    Constructed like a dict from a mapping or an iterable of (key, value)
+    pairs and keyword arguments."""
+
+    __slots__ = (*RECORD_FIELDS, "_uri_prefix", "_extra", "_keys")
+
+    def __init__(self, fields=(), **kwargs):
+        object.__setattr__(self, "_extra", None)
+        keys = {}
+        for key, value in (fields.items() if isinstance(fields, collections.abc.Mapping) else fields):
+            self._set(key, value)
+            keys[key] = None
+        for key, value in kwargs.items():
+            self._set(key, value)
+            keys[key] = None
+        keys = tuple(keys)
+        object.__setattr__(self, "_keys", _KEY_ORDERS.setdefault(keys, keys))
+        self._compact_uri()
+
+    def _set(self, key, value):
+        if key in _RECORD_FIELD_SET:
+            if key in SHARED_VALUE_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            object.__setattr__(self, key, value)
+        else:
+            if self._extra is None:
+                object.__setattr__(self, "_extra", {})
+            self._extra[key] = value
+
+    def _compact_uri(self):
+        """Replace uri '<prefix>/<name>' by its prefix, shared between all records of a base URI."""
+        uri, name = getattr(self, "uri", None), getattr(self, "name", None)
+        if type(uri) is str and type(name) is str and name and uri.endswith("/" + name):
+            object.__setattr__(self, "_uri_prefix", sys.intern(uri[:-len(name)]))
+            object.__delattr__(self, "uri")
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def _get_uri(self):
+        try:
+            return object.__getattribute__(self, "uri")
+        except AttributeError:
+            return self._uri_prefix + self.name
+
+    def __getitem__(self, key):
+        if key == "uri":
+            try:
+                return self._get_uri()
+            except AttributeError:
+                raise KeyError(key) from None
+        if key in _RECORD_FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        if key == "uri":
+            return hasattr(self, "uri") or hasattr(self, "_uri_prefix")
+        if key in _RECORD_FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    @property
+    def record(self):
+        """The record describing this dataset, see DatasetPair.record."""
+        return self
+
+
+class DatasetPair(tuple):
+    """(source, target) records of a dataset present on both sides of a comparison."""
+
+    __slots__ = ()
+
+    def __new__(cls, source, target):
+        return super().__new__(cls, (source, target))
+
+    @property
+    def record(self):
+        """The record describing this pair, i.e. the source."""
+        return self[0]
+
+
+def _record_of(element):
+    """Return the record describing element of a dataset list, either a single dataset or a compared pair."""
+    try:
+        return element.record
+    except AttributeError:  # plain dicts and tuples, e.g. as returned by third-party listing backends
+        return element[0] if isinstance(element, tuple) else element
+
+
+def _as_builtin(element):
+    """Convert element of a dataset list into dicts, e.g. for JSON serialization."""
+    if isinstance(element, tuple):
+        return [dict(e) for e in element]
+    return dict(element)
@@ -0,0 +1,143 @@
+"""Order dataset transfers by policy, based on dataset sizes estimated from manifests.
+
+Policies:
+
+uuid
+    changed datasets first, then missing ones, each in order of UUID
+smallest-first, largest-first
+    by estimated dataset size
+frozen-at
+    oldest source datasets first
+balanced
+    distribute datasets over 'workers' groups of about equal total size,
+    largest datasets first, and interleave these groups. Each of the
+    concurrent transfers is fed about the same number of bytes.
+
+Optionally, only datasets fitting into a byte budget are scheduled, all
+others are deferred to a later run. Datasets are considered in order of the
+policy and skipped as long as they exceed the remaining budget."""
+
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+
+from . import CONFIG_PATH
+from .timing import span
+from .verify import _get_manifest
+
+
+logger = logging.getLogger(__name__)
+
+SCHEDULING_POLICIES = ("uuid", "smallest-first", "largest-first", "frozen-at", "balanced")
+DEFAULT_SCHEDULING_POLICY = "uuid"
+
+ScheduledTransfer = collections.namedtuple("ScheduledTransfer", ["dataset", "resume", "size"])
+
+
+def _estimate_size(uri, config_path=CONFIG_PATH):
+    """Return total size of items in bytes as listed in manifest of dataset at uri, None if unknown."""
+    try:
+        manifest = _get_manifest(uri, config_path)
+    except Exception as exc:
+        logger.warning("Could not estimate size of '%s': %s", uri, exc)
+        return None
+    return sum(properties["size_in_bytes"] for properties in manifest["items"].values())
+
+
+def _estimate_sizes(uris, jobs=1, config_path=CONFIG_PATH):
+    """Return list of estimated sizes of datasets at uris, fetch up to 'jobs' manifests concurrently."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(lambda uri: _estimate_size(uri, config_path), uris))
+
+
+def _size_key(transfer, reverse=False):
+    """Sort key by size, datasets of unknown size always go last."""
+    if transfer.size is None:
+        return 1, 0
+    return 0, -transfer.size if reverse else transfer.size
+
+
+def _balanced_order(transfers, workers=1):
+    """Partition transfers into 'workers' groups of about equal total size, largest first, and interleave them.
+
+    Transfers of unknown size go last."""
+    groups = [[] for _ in range(workers)]
+    loads = [(0, i) for i in range(workers)]
+    for transfer in sorted((t for t in transfers if t.size is not None), key=lambda t: t.size, reverse=True):
+        load, i = heapq.heappop(loads)
+        groups[i].append(transfer)
+        heapq.heappush(loads, (load + transfer.size, i))
+    return [*(transfer for transfer in itertools.chain.from_iterable(itertools.zip_longest(*groups))
+              if transfer is not None),
+            *(t for t in transfers if t.size is None)]
+
+
+def _order(transfers, policy=DEFAULT_SCHEDULING_POLICY, workers=1):
+    if policy == "uuid":
+        return sorted(transfers, key=lambda t: (not t.resume, t.dataset['uuid'], t.dataset['name']))
+    if policy == "smallest-first":
+        return sorted(transfers, key=_size_key)
+    if policy == "largest-first":
+        return sorted(transfers, key=lambda t: _size_key(t, reverse=True))
+    if policy == "frozen-at":
+        return sorted(transfers, key=lambda t: (t.dataset.get('frozen_at') is None, t.dataset.get('frozen_at') or 0))
+    if policy == "balanced":
+        return _balanced_order(transfers, workers)
+    raise ValueError(f"Unknown scheduling policy '{policy}', choose from {', '.join(SCHEDULING_POLICIES)}.")
+
+
+def _within_budget(transfers, byte_budget):
+    """Split transfers into those fitting into byte_budget, in order, and deferred ones."""
+    scheduled, deferred = [], []
+    remaining = byte_budget
+    for transfer in transfers:
+        if transfer.size is not None and transfer.size <= remaining:
+            scheduled.append(transfer)
+            remaining -= transfer.size
+        else:
+            deferred.append(transfer)
+    return scheduled, deferred
+
+
+def schedule_transfers(datasets, policy=DEFAULT_SCHEDULING_POLICY, workers=1, byte_budget=None,
+                       jobs=1, config_path=CONFIG_PATH):
+    """Order transfers of datasets by policy, see module docstring.
+
+    Parameters
+    ----------
+    datasets: iterable of (dict, bool)
+        raw source dataset entry, i.e. with 'uri', 'uuid', 'name' and
+        'frozen_at', and resume flag per transfer as for transfer.run_transfers
+    policy: str, default: DEFAULT_SCHEDULING_POLICY
+        one of SCHEDULING_POLICIES
+    workers: int, default: 1
+        number of concurrent transfers, only used by policy 'balanced'
+    byte_budget: int or None, default: None
+        if set, only schedule datasets up to this total estimated size.
+        Datasets of unknown size are always deferred.
+    jobs: int, default: 1
+        number of manifests fetched concurrently for size estimates.
+        Sizes are only estimated if needed by policy or byte budget.
+
+    Returns
+    -------
+    scheduled, deferred: list of ScheduledTransfer
+    """
+    datasets = list(datasets)
+    sizes = itertools.repeat(None)
+    if policy in ("smallest-first", "largest-first", "balanced") or byte_budget is not None:
+        with span("estimate sizes"):
+            sizes = _estimate_sizes([dataset['uri'] for dataset, _ in datasets], jobs=jobs, config_path=config_path)
+
+    transfers = _order([ScheduledTransfer(dataset, resume, size)
+                        for (dataset, resume), size in zip(datasets, sizes)], policy, workers)
+
+    if byte_budget is None:
+        return transfers, []
+
+    scheduled, deferred = _within_budget(transfers, byte_budget)
+    logger.info("Scheduled %d datasets of %d bytes within budget of %d bytes, deferred %d.",
+                len(scheduled), sum(t.size for t in scheduled), byte_budget, len(deferred))
+    return scheduled, deferred
@@ -0,0 +1,153 @@
+"""Item streams, i.e. reading and writing the content of dataset items in chunks.
+
+Copying datasets via dtoolcore stages every item of a remote source in the
+dtool cache directory before putting it to the destination. With item
+streams, item content is piped from the source to the destination storage
+broker in chunks of CHUNK_SIZE bytes instead, without any local staging.
+Only one chunk per concurrent item transfer is held in memory at a time.
+
+Item streams are implemented per URI scheme, i.e. per kind of storage broker,
+and advertise whether they can read (READ) or write (WRITE) items. Built in
+are streams reading from local disk, symlinked and HTTP(S) datasets and
+writing to local disk, none for object stores such as S3 or Azure. Further
+implementations are discovered via the entry point group
+'dtool_sync.item_streams', e.g. in a package's setup.py::
+
+    entry_points={
+        'dtool_sync.item_streams': ['s3=my_package:S3ItemStreams'],
+    }
+
+Every entry point must refer to a subclass of ItemStreams and overrides
+built-in item streams for the schemes it declares. Datasets at any other
+scheme are copied via the dtool cache."""
+
+import contextlib
+import functools
+import logging
+import os
+
+from .backends import _iter_entry_point_backends
+
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "dtool_sync.item_streams"
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Capabilities item streams may advertise:
+# Item content is read from the source in place, without staging it in the dtool cache.
+READ = "read"
+# Item content is written to a proto dataset as it arrives.
+WRITE = "write"
+
+
+class ItemStreams:
+    """Base class of item streams.
+
+    Subclasses declare the URI schemes they serve and their capabilities
+    and implement open_item if they READ and create_item if they WRITE."""
+
+    schemes = ()
+    capabilities = frozenset()
+
+    def open_item(self, storage_broker, identifier):
+        """Return readable binary file object of item identifier's content."""
+        raise NotImplementedError()
+
+    def create_item(self, storage_broker, relpath):
+        """Return writable binary file object for the content of item relpath of a proto dataset.
+
+        The item is complete once the file object is closed."""
+        raise NotImplementedError()
+
+
+class DiskItemStreams(ItemStreams):
+    """Read and write items of datasets on local disk in place."""
+
+    schemes = ("file",)
+    capabilities = frozenset({READ, WRITE})
+
+    def open_item(self, storage_broker, identifier):
+        return open(storage_broker.get_item_abspath(identifier), "rb")
+
+    def create_item(self, storage_broker, relpath):
+        # as done by DiskStorageBroker.put_item
+        from dtoolcore.utils import IS_WINDOWS, handle_to_osrelpath, mkdir_parents
+        dest_path = os.path.join(storage_broker._data_abspath, handle_to_osrelpath(relpath, IS_WINDOWS))
+        mkdir_parents(os.path.dirname(dest_path))
+        return open(dest_path, "wb")
+
+
+class SymLinkItemStreams(DiskItemStreams):
+    """Read items of symlinked datasets in place."""
+
+    schemes = ("symlink",)
+    capabilities = frozenset({READ})
+
+
+class HTTPItemStreams(ItemStreams):
+    """Read items of datasets published via HTTP(S) as they are downloaded, see dtool-http."""
+
+    schemes = ("http", "https")
+    capabilities = frozenset({READ})
+
+    def open_item(self, storage_broker, identifier):
+        response = storage_broker._get_request(storage_broker.http_manifest["item_urls"][identifier], stream=True)
+        response.raw.decode_content = True
+        return response.raw
+
+
+BUILTIN_ITEM_STREAMS = [DiskItemStreams, SymLinkItemStreams, HTTPItemStreams]
+
+
+@functools.lru_cache(maxsize=None)
+def _generate_item_streams_lookup():
+    """Return dict of available item streams by URI scheme."""
+    item_streams_lookup = {}
+    for Streams in [*BUILTIN_ITEM_STREAMS, *_iter_entry_point_backends(ENTRY_POINT_GROUP)]:
+        for scheme in Streams.schemes:
+            item_streams_lookup[scheme] = Streams
+    return item_streams_lookup
+
+
+def _get_item_streams(uri, capability):
+    """Return item streams serving uri with capability, None if there are none."""
+    scheme = uri.split("://", 1)[0] if "://" in uri else "file"
+    Streams = _generate_item_streams_lookup().get(scheme)
+    if Streams is None or capability not in Streams.capabilities:
+        return None
+    return Streams()
+
+
+def _can_pipe(src_uri, dest_uri):
+    """Return True if items can be piped from dataset at src_uri to a copy at dest_uri."""
+    return _get_item_streams(src_uri, READ) is not None and _get_item_streams(dest_uri, WRITE) is not None
+
+
+def _get_item_pipe(src_dataset, dest_proto_dataset, chunk_size=None):
+    """Return function (identifier, relpath) -> relpath piping an item from src_dataset to dest_proto_dataset.
+
+    Items are piped in chunks of chunk_size bytes, CHUNK_SIZE per default.
+    Raises ValueError if fewer or more bytes arrive than the source manifest
+    records for an item. Returns None if either storage broker cannot
+    stream items."""
+    reader = _get_item_streams(src_dataset.uri, READ)
+    writer = _get_item_streams(dest_proto_dataset.uri, WRITE)
+    if reader is None or writer is None:
+        return None
+
+    def pipe(identifier, relpath):
+        size = chunk_size or CHUNK_SIZE
+        expected = src_dataset._manifest["items"][identifier]["size_in_bytes"]
+        written = 0
+        with contextlib.closing(reader.open_item(src_dataset._storage_broker, identifier)) as src, \
+                contextlib.closing(writer.create_item(dest_proto_dataset._storage_broker, relpath)) as dest:
+            for chunk in iter(functools.partial(src.read, size), b""):
+                dest.write(chunk)
+                written += len(chunk)
+        if written != expected:
+            raise ValueError(f"Piped {written} bytes of item '{relpath}', but its manifest records {expected} bytes.")
+        return relpath
+
+    return pipe
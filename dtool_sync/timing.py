@@ -0,0 +1,154 @@
+"""Timing spans around phases of commands, i.e. listing, comparison, formatting and transfers.
+
+Spans cost next to nothing unless a Profiler is active or hooks are
+registered. Embedding applications attach their own timers as hooks, i.e.
+callables that take the name of a span and return a context manager
+entered for the span's duration::
+
+    @contextlib.contextmanager
+    def my_timer(name):
+        start = time.perf_counter()
+        yield
+        print(name, time.perf_counter() - start)
+
+    dtool_sync.timing.add_span_hook(my_timer)
+
+With cProfile enabled, only outermost spans are profiled, one .pstats file
+each. cProfile only sees the thread that opened the span, not work handed
+to thread pools."""
+
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+
+import click
+
+
+logger = logging.getLogger(__name__)
+
+_span_hooks = []
+_active_profiler = None
+_local = threading.local()
+
+
+def add_span_hook(hook):
+    """Register hook, a callable taking a span name and returning a context manager."""
+    _span_hooks.append(hook)
+
+
+def remove_span_hook(hook):
+    _span_hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time the enclosed block as phase name, see module docstring."""
+    profiler = _active_profiler
+    if profiler is None and not _span_hooks:
+        yield
+        return
+
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        with contextlib.ExitStack() as stack:
+            for hook in list(_span_hooks):
+                stack.enter_context(hook(name))
+            if profiler is not None and depth == 0:
+                stack.enter_context(profiler._profile(name))
+            yield
+    finally:
+        _local.depth = depth
+        if profiler is not None:
+            profiler._record(name, time.perf_counter() - start, depth)
+
+
+class Profiler:
+    """Collect durations of spans while active.
+
+    Parameters
+    ----------
+    pstats_dir: str or None, default: None
+        if set, run cProfile within every outermost span and dump its
+        statistics to a numbered .pstats file named after the span.
+    """
+
+    def __init__(self, pstats_dir=None):
+        self.pstats_dir = pstats_dir
+        self.spans = []
+        self.elapsed = None
+        self._start = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        global _active_profiler
+        if _active_profiler is not None:
+            raise RuntimeError("Another profiler is already active.")
+        if self.pstats_dir is not None:
+            os.makedirs(self.pstats_dir, exist_ok=True)
+        self._start = time.perf_counter()
+        _active_profiler = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active_profiler
+        _active_profiler = None
+        self.elapsed = time.perf_counter() - self._start
+
+    def _record(self, name, duration, depth=0):
+        with self._lock:
+            self.spans.append((name, duration, depth))
+
+    @contextlib.contextmanager
+    def _profile(self, name):
+        if self.pstats_dir is None:
+            yield
+            return
+
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                index = sum(1 for _, _, depth in self.spans if depth == 0)
+            path = os.path.join(self.pstats_dir, f"{index:02d}-{name.replace(' ', '-')}.pstats")
+            profile.dump_stats(path)
+            logger.debug("Wrote profile of '%s' to '%s'.", name, path)
+
+    def summary(self):
+        """Return dict of (number of spans, total seconds) by span name, in order of first completion."""
+        summary = collections.OrderedDict()
+        for name, duration, _ in self.spans:
+            calls, total = summary.get(name, (0, 0.0))
+            summary[name] = (calls + 1, total + duration)
+        return summary
+
+    def format_summary(self):
+        """Format summary as table, with the share of every phase in the profiler's total wall time."""
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self._start
+        lines = [f"{'Phase':<20} {'Calls':>6} {'Seconds':>10} {'Share':>7}"]
+        for name, (calls, total) in self.summary().items():
+            lines.append(f"{name:<20} {calls:>6} {total:>10.3f} {100 * total / elapsed:>6.1f}%")
+        lines.append(f"{'Total':<20} {'':>6} {elapsed:>10.3f}")
+        return "\n".join(lines)
+
+
+def _profile_command(ctx, profile=False, pstats_dir=None):
+    """Profile the invoked subcommand of click group context ctx, print summary to stderr when done."""
+    if not profile and pstats_dir is None:
+        return
+
+    profiler = Profiler(pstats_dir=pstats_dir).__enter__()
+
+    def finish():
+        profiler.__exit__(None, None, None)
+        click.echo(profiler.format_summary(), err=True)
+
+    ctx.call_on_close(finish)
@@ -0,0 +1,429 @@
+"""Dataset transfer engine."""
+
+import collections
+import concurrent.futures
+import functools
+import logging
+import os
+
+import click
+import dtoolcore
+
+from . import CONFIG_PATH, _clean_cache
+from .streams import _can_pipe, _get_item_pipe
+from .timing import span
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_item_handles(proto_dataset):
+    """Return handles of items already present in proto dataset, with identifiers as keys."""
+    return {dtoolcore.utils.generate_identifier(handle): handle
+            for handle in proto_dataset._storage_broker.iter_item_handles()}
+
+
+def _get_item_properties(proto_dataset, identifiers, handles, jobs=1):
+    """Return manifest entries of items identifiers present in proto dataset, hashing each item once.
+
+    Entries are determined by up to 'jobs' threads, with identifiers as keys."""
+    storage_broker = proto_dataset._storage_broker
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        properties = executor.map(lambda identifier: storage_broker.item_properties(handles[identifier]), identifiers)
+        return dict(zip(identifiers, properties))
+
+
+def _get_items_to_transfer(manifest, proto_dataset, jobs=1):
+    """Return identifiers of items in manifest missing at proto dataset or differing in size or hash.
+
+    Also returns the manifest entries of all other items, i.e. those valid
+    at the proto dataset. Sizes of present items are compared first, only
+    items of matching size are hashed, by up to 'jobs' threads. If the proto
+    dataset's storage broker uses another hash function than the manifest,
+    present items cannot be validated and are transferred again."""
+    storage_broker = proto_dataset._storage_broker
+    items = manifest["items"]
+    handles = _get_item_handles(proto_dataset)
+    present = [identifier for identifier in items if identifier in handles]
+    hasher = getattr(storage_broker, "hasher", None)
+    if manifest.get("hash_function") != getattr(hasher, "name", None):
+        logger.warning("Cannot validate %d items present at %s by hash, transfer them again.",
+                       len(present), proto_dataset.uri)
+        return list(items), {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        sizes = executor.map(lambda identifier: storage_broker.get_size_in_bytes(handles[identifier]), present)
+        matching = [identifier for identifier, size in zip(present, sizes)
+                    if size == items[identifier]["size_in_bytes"]]
+    properties = _get_item_properties(proto_dataset, matching, handles, jobs=jobs)
+    valid = {identifier: entry for identifier, entry in properties.items()
+             if entry["hash"] == items[identifier]["hash"]}
+    return [identifier for identifier in items if identifier not in valid], valid
+
+
+def _freeze(proto_dataset, item_properties, progressbar=None):
+    """Freeze proto dataset via ProtoDataSet.freeze, with a manifest of item_properties already determined.
+
+    ProtoDataSet.freeze would hash all items once more to generate the manifest."""
+    hasher = getattr(proto_dataset._storage_broker, "hasher", None)
+    if hasher is None:
+        proto_dataset.freeze(progressbar=progressbar)
+        return
+
+    manifest = {
+        "items": item_properties,
+        "dtoolcore_version": dtoolcore.__version__,
+        "hash_function": hasher.name,
+    }
+    proto_dataset.generate_manifest = lambda progressbar=None: manifest
+    proto_dataset.freeze(progressbar=progressbar)
+
+
+def _put_item(src_dataset, dest_proto_dataset, identifier, relpath):
+    dest_proto_dataset.put_item(src_dataset.item_content_abspath(identifier), relpath)
+    return relpath
+
+
+def _copy_metadata(src_dataset, dest_proto_dataset):
+    """Copy readme, tags, overlays and annotations as done by dtoolcore._copy_content."""
+    dest_proto_dataset.put_readme(src_dataset.get_readme_content())
+
+    for tag in src_dataset.list_tags():
+        dest_proto_dataset.put_tag(tag)
+
+    for overlay_name in src_dataset.list_overlay_names():
+        overlay = src_dataset.get_overlay(overlay_name)
+        dest_proto_dataset._put_overlay(overlay_name, overlay)
+
+    for annotation_name in src_dataset.list_annotation_names():
+        annotation = src_dataset.get_annotation(annotation_name)
+        dest_proto_dataset.put_annotation(annotation_name, annotation)
+
+
+def _create_proto_dataset(src_dataset, dest_base_uri, config_path=CONFIG_PATH):
+    """Create empty proto dataset for a copy of src_dataset at dest_base_uri, as dtoolcore.copy does."""
+    admin_metadata = dict(src_dataset._admin_metadata, type="protodataset")
+    proto_dataset = dtoolcore.generate_proto_dataset(
+        admin_metadata=admin_metadata,
+        base_uri=dest_base_uri,
+        config_path=config_path
+    )
+    proto_dataset.create()
+    return proto_dataset
+
+
+def _check_copy_target(dest_uri, config_path=CONFIG_PATH):
+    """Raise UsageError if a fresh copy would overwrite anything at dest_uri."""
+    if dtoolcore._is_dataset(dest_uri, config_path=config_path):
+        raise click.UsageError(f"Dataset already exists: {dest_uri}")
+
+    parsed_dataset_uri = dtoolcore.utils.generous_parse_uri(dest_uri)
+    if parsed_dataset_uri.scheme == "file":
+        if os.path.exists(parsed_dataset_uri.path):
+            raise click.UsageError(f"Path already exists: {parsed_dataset_uri.path}")
+
+
+def _delta_copy(src_dataset, dest_base_uri, config_path=CONFIG_PATH, item_jobs=1, progressbar=None, direct=False):
+    """Resume copying src_dataset to a partial copy at dest_base_uri, transfer only what is missing.
+
+    Items missing at the destination or differing in size or hash from the
+    source manifest are copied by a pool of up to 'item_jobs' threads, then
+    the destination is frozen. Its manifest is generated from the items
+    actually stored there, each hashed exactly once. If direct is set, items
+    are piped from source to destination without staging them in the dtool
+    cache, see dtool_sync.streams, as far as both storage brokers support it.
+    Returns URI of copied dataset."""
+    dest_uri = dtoolcore._generate_uri(
+        admin_metadata=src_dataset._admin_metadata,
+        base_uri=dest_base_uri
+    )
+    dest_proto_dataset = dtoolcore.ProtoDataSet.from_uri(dest_uri, config_path=config_path)
+
+    put_item = _get_item_pipe(src_dataset, dest_proto_dataset) if direct else None
+    if put_item is None:
+        if direct:
+            logger.info("Cannot stream items from %s to %s, copy via cache.", src_dataset.uri, dest_uri)
+        put_item = functools.partial(_put_item, src_dataset, dest_proto_dataset)
+
+    manifest = src_dataset._manifest
+    identifiers, item_properties = _get_items_to_transfer(manifest, dest_proto_dataset, jobs=item_jobs)
+    logger.info("Copy %d out of %d items of %s.", len(identifiers), len(manifest["items"]), src_dataset.uri)
+
+    if progressbar:
+        progressbar.update(len(manifest["items"]) - len(identifiers))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=item_jobs) as executor:
+        futures = [executor.submit(put_item, identifier, manifest["items"][identifier]["relpath"])
+                   for identifier in identifiers]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                relpath = future.result()
+                if progressbar:
+                    progressbar.item_show_func = lambda x: relpath
+                    progressbar.update(1)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    item_properties.update(_get_item_properties(dest_proto_dataset, identifiers, _get_item_handles(dest_proto_dataset),
+                                                jobs=item_jobs))
+    _copy_metadata(src_dataset, dest_proto_dataset)
+
+    # a proto dataset never has the "frozen_at" timestamp, see dtoolcore.copy_resume
+    dest_proto_dataset._admin_metadata["frozen_at"] = src_dataset._admin_metadata["frozen_at"]
+    _freeze(dest_proto_dataset, item_properties, progressbar=progressbar)
+
+    return dest_proto_dataset.uri
+
+
+def _silent_copy(resume, dataset_uri, dest_base_uri, config_path=CONFIG_PATH, item_jobs=1, direct=False):
+    """Copy dataset like dtool_create.dataset._copy, but without any terminal output.
+
+    Resuming transfers only items missing at the destination, see _delta_copy.
+    If direct is set and both storage brokers support item streams, fresh
+    copies are piped item by item as well instead of staging items in the cache.
+    Safe to use from several threads at once. Returns URI of copied dataset."""
+    src_dataset = dtoolcore.DataSet.from_uri(dataset_uri, config_path=config_path)
+    if resume:
+        return _delta_copy(src_dataset, dest_base_uri, config_path=config_path, item_jobs=item_jobs, direct=direct)
+
+    dest_uri = dtoolcore._generate_uri(
+        admin_metadata=src_dataset._admin_metadata,
+        base_uri=dest_base_uri
+    )
+    _check_copy_target(dest_uri, config_path=config_path)
+
+    if direct and _can_pipe(dataset_uri, dest_uri):
+        _create_proto_dataset(src_dataset, dest_base_uri, config_path=config_path)
+        return _delta_copy(src_dataset, dest_base_uri, config_path=config_path, item_jobs=item_jobs, direct=True)
+
+    return dtoolcore.copy(
+        src_uri=dataset_uri,
+        dest_base_uri=dest_base_uri,
+        config_path=config_path
+    )
+
+
+def _verbose_copy(resume, dataset_uri, dest_base_uri, quiet=False, item_jobs=1, direct=False):
+    """Copy dataset via dtool_create.dataset._copy, with progress bar unless quiet.
+
+    Resuming transfers only items missing at the destination, see _delta_copy.
+    Direct copies pipe items from source to destination, see _silent_copy."""
+    if not resume and not (direct and _can_pipe(dataset_uri, dest_base_uri)):
+        from dtool_create.dataset import _copy as copy_dataset  # loads dtool's command line interface
+        return copy_dataset(resume=resume, quiet=quiet, dataset_uri=dataset_uri, dest_base_uri=dest_base_uri)
+
+    src_dataset = dtoolcore.DataSet.from_uri(dataset_uri, config_path=CONFIG_PATH)
+    if not resume:
+        _check_copy_target(dtoolcore._generate_uri(admin_metadata=src_dataset._admin_metadata,
+                                                   base_uri=dest_base_uri))
+        _create_proto_dataset(src_dataset, dest_base_uri)
+
+    if quiet:
+        dest_uri = _delta_copy(src_dataset, dest_base_uri, item_jobs=item_jobs, direct=direct)
+        click.secho(dest_uri)
+    else:
+        num_items = len(list(src_dataset.identifiers))
+        with click.progressbar(length=num_items, label="Copying dataset") as progressbar:
+            dest_uri = _delta_copy(src_dataset, dest_base_uri, item_jobs=item_jobs, progressbar=progressbar,
+                                   direct=direct)
+        click.secho(f"Dataset copied to:\n{dest_uri}")
+    return dest_uri
+
+
+def _transfer(dataset_uri, dest_base_uri, resume=False, copy_func=_silent_copy, record=None):
+    """Copy a single dataset.
+
+    If resume is not set, try a fresh copy first and fall back to resuming
+    a possibly existing partial copy on failure. Such retries are counted
+    within record, if given."""
+    if resume:
+        return copy_func(True, dataset_uri, dest_base_uri)
+
+    try:
+        return copy_func(False, dataset_uri, dest_base_uri)
+    except OSError:
+        raise  # might have run out of storage
+    except Exception as exc:
+        logger.warning(f"Copying {dataset_uri} failed ({exc}), try to resume.")
+        if record is not None:
+            record.retries += 1
+        return copy_func(True, dataset_uri, dest_base_uri)
+
+
+def _monitored_transfer(dataset_uri, dest_base_uri, resume=False, copy_func=_silent_copy, monitor=None):
+    """Copy a single dataset as _transfer does, measured by monitor if given."""
+    if monitor is None:
+        return _transfer(dataset_uri, dest_base_uri, resume=resume, copy_func=copy_func)
+
+    with monitor.transfer(dataset_uri, resume=resume) as record:
+        record.dest_uri = _transfer(dataset_uri, dest_base_uri, resume=resume, copy_func=copy_func, record=record)
+    return record.dest_uri
+
+
+def _journaled_transfer(dataset_uri, dest_base_uri, resume=False, copy_func=_silent_copy, monitor=None,
+                        journal=None):
+    """Copy a single dataset as _monitored_transfer does, its state journaled if given.
+
+    The transfer is marked copying while in flight, then frozen or failed."""
+    if journal is None:
+        return _monitored_transfer(dataset_uri, dest_base_uri, resume=resume, copy_func=copy_func, monitor=monitor)
+
+    from .journal import COPYING, FAILED, FROZEN
+    journal.mark(dataset_uri, COPYING)
+    try:
+        dest_uri = _monitored_transfer(dataset_uri, dest_base_uri, resume=resume, copy_func=copy_func,
+                                       monitor=monitor)
+    except Exception as exc:  # an interrupted transfer stays in state 'copying'
+        journal.mark(dataset_uri, FAILED, error=f"{type(exc).__name__}: {exc}")
+        raise
+    journal.mark(dataset_uri, FROZEN, dest_uri=dest_uri)
+    return dest_uri
+
+
+def _handle_transfer_error(exc, resume=False, ignore_errors=False):
+    """Re-raise exc unless errors are to be ignored.
+
+    OSErrors during fresh copies are never ignored, we might have run out of storage."""
+    if not ignore_errors or (not resume and isinstance(exc, OSError)):
+        raise exc
+    logger.exception(exc)
+
+
+def _report_transfer(dest_uri, quiet=False):
+    if quiet:
+        click.secho(dest_uri)
+    else:
+        click.secho(f"Dataset copied to:\n{dest_uri}")
+
+
+def _serial_transfer(tasks, dest_base_uri, ignore_errors=False, quiet=False, clean_cache=None, item_jobs=1,
+                     monitor=None, journal=None, direct=False):
+    copy_func = functools.partial(_verbose_copy, quiet=quiet, item_jobs=item_jobs, direct=direct)
+    for dataset_uri, resume in tasks:
+        try:
+            _journaled_transfer(dataset_uri, dest_base_uri, resume=resume, copy_func=copy_func, monitor=monitor,
+                                journal=journal)
+        except Exception as exc:
+            _handle_transfer_error(exc, resume=resume, ignore_errors=ignore_errors)
+
+        # only clean after fresh copies, i.e. of missing datasets
+        if clean_cache is not None and not resume:
+            clean_cache()
+
+
+def _parallel_transfer(tasks, dest_base_uri, jobs=2, ignore_errors=False, quiet=False, clean_cache=None,
+                       item_jobs=1, monitor=None, journal=None, direct=False):
+    copy_func = functools.partial(_silent_copy, item_jobs=item_jobs, direct=direct)
+    pending = collections.deque()
+
+    def collect_next():
+        """Wait for the earliest submitted transfer and report its result."""
+        resume, future = pending.popleft()
+        try:
+            dest_uri = future.result()
+        except Exception as exc:
+            _handle_transfer_error(exc, resume=resume, ignore_errors=ignore_errors)
+        else:
+            _report_transfer(dest_uri, quiet=quiet)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            n = 0
+            staged = False  # any fresh copies, i.e. of missing datasets, since last cleaning
+            for n, (dataset_uri, resume) in enumerate(tasks, start=1):
+                staged = staged or not resume
+                pending.append((resume, executor.submit(
+                    _journaled_transfer, dataset_uri, dest_base_uri, resume=resume, copy_func=copy_func,
+                    monitor=monitor, journal=journal)))
+
+                # report finished transfers early, but always in order of submission
+                while pending and pending[0][1].done():
+                    collect_next()
+
+                # Cleaning the cache while other workers still fill it might remove entries in use.
+                # With a cache limit, transfer in waves of 'jobs' datasets and clean in between.
+                if clean_cache is not None and staged and n % jobs == 0:
+                    while pending:
+                        collect_next()
+                    clean_cache()
+                    staged = False
+
+            while pending:
+                collect_next()
+        except Exception:
+            for _, future in pending:
+                future.cancel()
+            raise
+
+        if clean_cache is not None and staged:
+            clean_cache()
+
+
+def run_transfers(tasks, dest_base_uri, jobs=1, dry_run=False,
+                  ignore_errors=False, quiet=False, max_cache_size=None, persist_cache_sizes=False, item_jobs=1,
+                  monitor=None, journal=None, direct=False):
+    """Copy datasets to dest_base_uri, with up to 'jobs' transfers running concurrently.
+
+    Parameters
+    ----------
+    tasks: iterable of (str, bool)
+        dataset URI and resume flag per transfer. If the resume flag is set,
+        resume copying a partially transferred dataset, i.e. only copy items
+        missing at the destination. Otherwise, attempt a fresh copy and only
+        resume on failure. Consumed lazily, i.e. transfers
+        start while tasks are still being generated.
+    dest_base_uri: str
+    jobs: int, default: 1
+        number of concurrent transfers. Results are reported in the order
+        of tasks, independent of the order of completion.
+    dry_run: bool, default: False
+        only print datasets that would be transferred.
+    ignore_errors: bool, default: False
+        log errors and continue with next dataset instead of raising.
+    quiet: bool, default: False
+    max_cache_size: int or None, default: None
+        if set, clean dtool cache down to this size in bytes after each
+        transfer (or after each wave of 'jobs' transfers).
+    persist_cache_sizes: bool, default: False
+        keep a ledger of cache entry sizes between cache cleanings and runs.
+    item_jobs: int, default: 1
+        number of items copied concurrently when resuming a transfer.
+    monitor: monitor.TransferMonitor or None, default: None
+        if set, record measurements of every transfer and cache eviction.
+    journal: journal.SyncJournal or None, default: None
+        if set, record the state of every transfer. Transfers must have
+        been queued in the journal before.
+    direct: bool, default: False
+        pipe item content from source to destination storage broker in
+        chunks instead of staging items in the dtool cache, see
+        dtool_sync.streams. Falls back to copying via the cache for storage
+        brokers without item streams.
+    """
+    if dry_run:
+        for dataset_uri, _ in tasks:
+            click.secho(f"Dry run, would copy {dataset_uri} to {dest_base_uri} now.")
+        return
+
+    clean_cache = None
+    if max_cache_size is not None:
+        clean_cache = functools.partial(_clean_cache, max_cache_size, persist_sizes=persist_cache_sizes, jobs=jobs,
+                                        on_evict=None if monitor is None else monitor.evicted)
+
+    with span("transfer"):
+        if jobs > 1:
+            _parallel_transfer(tasks, dest_base_uri, jobs=jobs, ignore_errors=ignore_errors, quiet=quiet,
+                               clean_cache=clean_cache, item_jobs=item_jobs, monitor=monitor, journal=journal,
+                               direct=direct)
+        else:
+            _serial_transfer(tasks, dest_base_uri, ignore_errors=ignore_errors, quiet=quiet,
+                             clean_cache=clean_cache, item_jobs=item_jobs, monitor=monitor, journal=journal,
+                             direct=direct)
+
+
+def transfer_datasets(dataset_uris, dest_base_uri, resume=False, **kwargs):
+    """Copy datasets to dest_base_uri, all with the same resume flag.
+
+    Further keyword arguments as for run_transfers."""
+    run_transfers(((dataset_uri, resume) for dataset_uri in dataset_uris), dest_base_uri, **kwargs)
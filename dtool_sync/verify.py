@@ -0,0 +1,162 @@
+"""Content verification of datasets that compare equal by their admin metadata.
+
+Manifests of source and target are compared item by item, cheapest checks
+first: number of items, item identifiers, item sizes and eventually item
+hashes. Then, the items actually stored at the target are checked against
+its manifest: in mode 'content', every item must be present with its
+recorded size, and in mode 'hashes', additionally with its recorded hash as
+regenerated by the target's storage broker. Only mode 'hashes' reads item
+data. Verification of a dataset pair stops at the first mismatch."""
+
+import collections
+import concurrent.futures
+import logging
+
+from . import CONFIG_PATH
+
+
+logger = logging.getLogger(__name__)
+
+VERIFICATION_MODES = ("metadata", "content", "hashes")
+
+
+def _is_proto(dataset):
+    """Tell proto datasets by raw admin metadata or by formatted name."""
+    if "type" in dataset:
+        return dataset["type"] == "protodataset"
+    return dataset["name"].startswith("*")
+
+
+def _get_manifest(uri, config_path=CONFIG_PATH):
+    import dtoolcore
+    return dtoolcore._get_storage_broker(uri, config_path).get_manifest()
+
+
+def _compare_manifests(source_manifest, target_manifest):
+    """Return None if manifests describe the same content, otherwise the first mismatch found."""
+    source_items = source_manifest["items"]
+    target_items = target_manifest["items"]
+    if len(source_items) != len(target_items):
+        return f"{len(source_items)} items at source, {len(target_items)} items at target"
+
+    if source_items.keys() != target_items.keys():
+        return "item identifiers differ"
+
+    for identifier, properties in source_items.items():
+        if properties["size_in_bytes"] != target_items[identifier]["size_in_bytes"]:
+            return f"size of item '{properties['relpath']}' differs"
+
+    if source_manifest.get("hash_function") != target_manifest.get("hash_function"):
+        logger.warning("Manifests use different hash functions %s and %s, item hashes not compared.",
+                       source_manifest.get("hash_function"), target_manifest.get("hash_function"))
+        return None
+
+    for identifier, properties in source_items.items():
+        if properties["hash"] != target_items[identifier]["hash"]:
+            return f"hash of item '{properties['relpath']}' differs"
+
+    return None
+
+
+def _check_items(uri, manifest, hashes=False, config_path=CONFIG_PATH):
+    """Return None if items stored at dataset uri agree with its manifest, otherwise the first mismatch found.
+
+    Checks presence and size of every item and, with hashes, its hash."""
+    import dtoolcore
+    storage_broker = dtoolcore._get_storage_broker(uri, config_path)
+    try:
+        handles = {dtoolcore.utils.generate_identifier(handle): handle
+                   for handle in storage_broker.iter_item_handles()}
+    except (AttributeError, NotImplementedError):
+        logger.warning("Cannot check items stored at '%s', only compared manifests.", uri)
+        return None
+
+    items = manifest["items"]
+    for identifier, properties in items.items():
+        if identifier not in handles:
+            return f"item '{properties['relpath']}' missing at target"
+        if storage_broker.get_size_in_bytes(handles[identifier]) != properties["size_in_bytes"]:
+            return f"size of item '{properties['relpath']}' at target differs from its manifest"
+
+    if hashes:
+        for identifier, properties in items.items():
+            if storage_broker.get_hash(handles[identifier]) != properties["hash"]:
+                return f"hash of item '{properties['relpath']}' at target differs from its manifest"
+
+    return None
+
+
+def _verify_content(source_uri, target_uri, hashes=False, config_path=CONFIG_PATH):
+    """Return None if content of datasets at source_uri and target_uri agrees, otherwise the reason."""
+    try:
+        source_manifest = _get_manifest(source_uri, config_path)
+        target_manifest = _get_manifest(target_uri, config_path)
+    except Exception as exc:
+        return f"manifest not readable ({exc})"
+    reason = _compare_manifests(source_manifest, target_manifest)
+    if reason is not None:
+        return reason
+    try:
+        return _check_items(target_uri, target_manifest, hashes=hashes, config_path=config_path)
+    except Exception as exc:
+        return f"items not readable ({exc})"
+
+
+def _verify_pair(pair, hashes=False, config_path=CONFIG_PATH):
+    source, target = pair
+    if _is_proto(source) or _is_proto(target):
+        return None  # proto datasets come without manifest
+    reason = _verify_content(source["uri"], target["uri"], hashes=hashes, config_path=config_path)
+    if reason is not None:
+        logger.info("Content of '%s' differs from '%s': %s.", source["uri"], target["uri"], reason)
+    return reason
+
+
+def verify_equal(equal, changed, jobs=1, hashes=False, config_path=CONFIG_PATH):
+    """Verify content of (source, target) pairs in equal.
+
+    Content of up to 'jobs' pairs is verified concurrently, with hashes
+    regenerated from the target's item data if hashes is True. Returns new
+    lists equal and changed, the latter extended by all pairs in equal
+    with differing content and sorted by UUID and name."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        reasons = list(executor.map(lambda pair: _verify_pair(pair, hashes, config_path), equal))
+
+    verified = [pair for pair, reason in zip(equal, reasons) if reason is None]
+    differing = [pair for pair, reason in zip(equal, reasons) if reason is not None]
+    if differing:
+        changed = sorted([*changed, *differing], key=lambda pair: (pair[0]['uuid'], pair[0]['name']))
+    return verified, changed
+
+
+def iter_verify_categorized_datasets(categorized_datasets, jobs=1, hashes=False, config_path=CONFIG_PATH):
+    """Verify content of 'equal' datasets as yielded by compare.iter_compare_datasets.
+
+    Categorized datasets are yielded in their original order, 'equal' pairs
+    with differing content as 'changed'. Hashes as for verify_equal. Content of up to 'jobs' pairs is
+    verified concurrently while further datasets are consumed."""
+    pending = collections.deque()
+
+    def next_result():
+        key, dataset, future = pending.popleft()
+        if future is not None and future.result() is not None:
+            key = "changed"
+        return key, dataset
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for key, dataset in categorized_datasets:
+                future = None
+                if key == "equal":
+                    future = executor.submit(_verify_pair, dataset, hashes, config_path)
+                pending.append((key, dataset, future))
+
+                while pending and (pending[0][2] is None or pending[0][2].done() or len(pending) > 2*jobs):
+                    yield next_result()
+
+            while pending:
+                yield next_result()
+        finally:
+            for _, _, future in pending:
+                if future is not None:
+                    future.cancel()
@@ -1,10 +1,12 @@
 """Test fixtures."""
 
+import asyncio
 import json
 import os
 import shutil
 import sys
 import tempfile
+import threading
 
 import pytest
 
@@ -33,6 +35,19 @@ def dir_to_uri(d):
     return "file://" + d
 
 
+@pytest.fixture(autouse=True)
+def dtool_cache_dir_fixture(request, monkeypatch):
+    """Keep dtool cache and listing index of tests apart from the user's."""
+    d = tempfile.mkdtemp()
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", d)
+
+    @request.addfinalizer
+    def teardown():
+        shutil.rmtree(d)
+
+    return d
+
+
 @pytest.fixture
 def lhs_uri_fixture(request):
     d = tempfile.mkdtemp()
@@ -101,6 +116,74 @@ def comparable_repositories_fixture(request):
     return lhs_uri, rhs_uri
 
 
+@pytest.fixture
+def lookup_server_fixture(request, monkeypatch, lhs_repository_fixture):
+    """Local stand-in for a lookup server with all datasets at lhs_repository_fixture registered.
+
+    Serves paginated mongo queries filtered by base URIs and UUIDs like dserver, but ignores the actual query."""
+    pytest.importorskip("dtool_lookup_api")
+    web = pytest.importorskip("aiohttp.web")
+
+    storage_broker = dtoolcore._get_storage_broker(lhs_repository_fixture, None)
+    datasets = []
+    for uri in storage_broker.list_dataset_uris(lhs_repository_fixture, None):
+        admin_metadata = dtoolcore._admin_metadata_from_uri(uri, None)
+        admin_metadata.update(uri=uri, base_uri=lhs_repository_fixture, tags=[], annotations={})
+        datasets.append(admin_metadata)
+    datasets.sort(key=lambda d: d["uri"])
+
+    token = "stand-in-token"
+    requested_pages = []
+
+    async def config_info(web_request):
+        if web_request.headers.get("Authorization") != f"Bearer {token}":
+            return web.json_response({"msg": "Unauthorized"}, status=401)
+        return web.json_response({"version": "stand-in"})
+
+    async def mongo_query(web_request):
+        page = int(web_request.query.get("page", 1))
+        page_size = int(web_request.query.get("page_size", 10))
+        requested_pages.append(page)
+        body = await web_request.json()
+        base_uris, uuids = body.get("base_uris", None), body.get("uuids", None)
+        matches = [d for d in datasets
+                   if (base_uris is None or d["base_uri"] in base_uris) and (uuids is None or d["uuid"] in uuids)]
+        total_pages = max(1, -(-len(matches) // page_size))
+        pagination = {"total": len(matches), "total_pages": total_pages, "page": page}
+        return web.json_response(matches[(page - 1)*page_size:page*page_size],
+                                 headers={"X-Pagination": json.dumps(pagination)})
+
+    app = web.Application()
+    app.router.add_get("/config/info", config_info)
+    app.router.add_post("/mongo/query", mongo_query)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = runner.addresses[0][1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    # the client reads the token from the configuration file only
+    config_path = os.path.join(tempfile.mkdtemp(), "dtool.json")
+    with open(config_path, "w") as f:
+        json.dump({"DSERVER_TOKEN": token}, f)
+    monkeypatch.setattr(dtoolcore.utils, "DEFAULT_CONFIG_PATH", config_path)
+    monkeypatch.setenv("DSERVER_URL", f"http://127.0.0.1:{port}")
+
+    @request.addfinalizer
+    def teardown():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        shutil.rmtree(os.path.dirname(config_path))
+
+    return datasets, requested_pages
+
+
 # expected outputs
 @pytest.fixture
 def expected_output_diff_q(request):
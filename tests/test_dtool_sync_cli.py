@@ -48,6 +48,20 @@ def test_dtool_compare_all_jr(comparable_repositories_fixture, expected_output_c
     assert compare_nested(out, expected)
 
 
+def test_dtool_compare_all_jv(comparable_repositories_fixture):
+    from dtool_sync.cli import compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    runner = CliRunner()
+    result = runner.invoke(compare_all, ['-j', '-v', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    out = json.loads(result.stdout)
+    datasets = [dataset for category in out.values() for entry in category
+                for dataset in (entry if isinstance(entry, list) else [entry])]
+    assert len(datasets) > 0
+    for dataset in datasets:
+        assert list(dataset) == ['name', 'uuid', 'creator_username', 'uri', 'frozen_at'][:len(dataset)]
+
+
 def test_dtool_compare_all_qu(comparable_repositories_fixture, expected_output_compare_all_qu):
     from dtool_sync.cli import compare_all
     lhs_uri, rhs_uri = comparable_repositories_fixture
@@ -82,3 +96,297 @@ def test_dtool_sync_all(comparable_repositories_fixture, expected_output_compare
     assert compare_nested(out, expected)
 
 
+def test_dtool_sync_all_jobs(comparable_repositories_fixture, expected_output_post_sync_all_compare_all_jr):
+    from dtool_sync.cli import sync_all, compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+
+    runner = CliRunner()
+
+    result = runner.invoke(sync_all, ['--jobs', '4', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+
+    result = runner.invoke(compare_all, ['-j', '-r', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    out = json.loads(result.stdout)
+    expected = json.loads(expected_output_post_sync_all_compare_all_jr)
+    assert compare_nested(out, expected)
+
+
+def test_dtool_sync_all_schedule(comparable_repositories_fixture, expected_output_post_sync_all_compare_all_jr):
+    from dtool_sync.cli import sync_all, compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+
+    runner = CliRunner()
+
+    # 'changed' holds 8 bytes, 'people' 19 bytes
+    result = runner.invoke(sync_all, ['-n', '-q', '--schedule', 'largest-first', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    assert [line.split()[4].rsplit('/', 1)[-1] for line in result.stdout.splitlines()] == ['people', 'changed']
+
+    result = runner.invoke(sync_all, ['--max-bytes', '10', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    assert 'people' in result.stdout.split('Defer 1 datasets')[1]
+
+    result = runner.invoke(compare_all, ['-j', '-r', lhs_uri, rhs_uri])
+    out = json.loads(result.stdout)
+    assert out['changed'] == []
+    assert [d['name'] for d in out['missing']] == ['people']
+
+    result = runner.invoke(sync_all, ['--stream', '--schedule', 'balanced', lhs_uri, rhs_uri])
+    assert result.exit_code == 2
+
+
+def test_dtool_sync_all_report(comparable_repositories_fixture, tmp_path):
+    from dtool_sync.cli import sync_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    report_path = tmp_path / "report.json"
+
+    runner = CliRunner()
+    # dry runs transfer nothing to report
+    for args in [['--dry-run'], ['--dry-run', '--stream']]:
+        result = runner.invoke(sync_all, ['-q', '--report', str(report_path), *args, lhs_uri, rhs_uri])
+        assert result.exit_code == 2
+        assert not report_path.exists()
+
+    result = runner.invoke(sync_all, ['-q', '--progress', '--report', str(report_path), lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+
+    report = json.loads(report_path.read_text())
+    assert report['datasets'] == 2 and report['failed'] == 0
+    # 'changed' holds 8 bytes, 'people' 19 bytes
+    assert report['bytes'] == 27
+    assert [(t['uri'].rsplit('/', 1)[-1], t['resume'], t['bytes']) for t in report['transfers']] == [
+        ('changed', True, 8), ('people', False, 19)]
+    assert all(t['duration'] >= 0 and t['retries'] == 0 for t in report['transfers'])
+
+
+def test_dtool_sync_all_stream(comparable_repositories_fixture, expected_output_post_sync_all_compare_all_jr):
+    from dtool_sync.cli import sync_all, compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+
+    runner = CliRunner()
+
+    result = runner.invoke(sync_all, ['--stream', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+
+    result = runner.invoke(compare_all, ['-j', '-r', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    out = json.loads(result.stdout)
+    expected = json.loads(expected_output_post_sync_all_compare_all_jr)
+    assert compare_nested(out, expected)
+
+
+def test_dtool_compare_all_ndjson(comparable_repositories_fixture, expected_output_compare_all_jr):
+    from dtool_sync.cli import compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    runner = CliRunner()
+    expected = json.loads(expected_output_compare_all_jr)
+
+    for args in [['-r', '--ndjson'], ['-r', '--ndjson', '--stream']]:
+        result = runner.invoke(compare_all, args + [lhs_uri, rhs_uri])
+        assert result.exit_code == 0
+        lines = [json.loads(line) for line in result.stdout.splitlines()]
+        for category, datasets in expected.items():
+            uuids = sorted(d['uuid'] for d in datasets)
+            assert sorted(line['dataset']['uuid'] for line in lines if line['category'] == category) == uuids
+
+
+def test_dtool_diff_difflib(lhs_repository_fixture, rhs_repository_fixture):
+    from dtool_sync.cli import diff
+    runner = CliRunner()
+    for args in [['-q'], [], ['-v']]:
+        merged = runner.invoke(diff, args + [lhs_repository_fixture, rhs_repository_fixture])
+        assert merged.exit_code == 0
+        fallback = runner.invoke(diff, args + ['--difflib', lhs_repository_fixture, rhs_repository_fixture])
+        assert fallback.exit_code == 0
+        assert merged.stdout == fallback.stdout
+
+
+def test_dtool_compare_all_verify_content(comparable_repositories_fixture, expected_output_compare_all_jr):
+    import os
+    from dtool_sync.cli import compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    runner = CliRunner()
+    expected = json.loads(expected_output_compare_all_jr)
+
+    # corrupt manifest of a target dataset that equals its source by metadata
+    corrupted = next(d for d in expected['equal'] if d['name'] == 'cat')
+    manifest_path = os.path.join(rhs_uri[len('file://'):], 'cat', '.dtool', 'manifest.json')
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    item = next(iter(manifest['items'].values()))
+    item['hash'] = '0' * len(item['hash'])
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    for args in [['-r', '--ndjson'], ['-r', '--ndjson', '--stream'], ['-r', '--ndjson', '--list-jobs', '4']]:
+        result = runner.invoke(compare_all, args + [lhs_uri, rhs_uri])
+        assert result.exit_code == 0
+        categories = {line['dataset']['uuid']: line['category']
+                      for line in map(json.loads, result.stdout.splitlines())}
+        assert categories[corrupted['uuid']] == 'equal'
+
+        result = runner.invoke(compare_all, args + ['--verify', 'content', lhs_uri, rhs_uri])
+        assert result.exit_code == 0
+        verified_categories = {line['dataset']['uuid']: line['category']
+                               for line in map(json.loads, result.stdout.splitlines())}
+        assert verified_categories == {**categories, corrupted['uuid']: 'changed'}
+
+
+def test_dtool_compare_all_verify_items(comparable_repositories_fixture, expected_output_compare_all_jr):
+    import os
+    from dtool_sync.cli import compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    runner = CliRunner()
+    expected = json.loads(expected_output_compare_all_jr)
+
+    # corrupt item data of target datasets that equal their sources by metadata and manifest
+    truncated, overwritten = [d for d in expected['equal'] if not d['name'].startswith('*')][:2]
+    for dataset, corrupt in [(truncated, lambda content: content[:-1]),
+                             (overwritten, lambda content: bytes(byte ^ 0xff for byte in content))]:
+        data_path = os.path.join(rhs_uri[len('file://'):], dataset['name'], 'data')
+        item_path = next(os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(data_path)
+                         for filename in filenames)
+        with open(item_path, 'rb') as f:
+            content = f.read()
+        with open(item_path, 'wb') as f:
+            f.write(corrupt(content))
+
+    for args in [['-r', '--ndjson'], ['-r', '--ndjson', '--stream']]:
+        categories = {}
+        for verify in ['metadata', 'content', 'hashes']:
+            result = runner.invoke(compare_all, args + ['--verify', verify, lhs_uri, rhs_uri])
+            assert result.exit_code == 0
+            categories[verify] = {line['dataset']['uuid']: line['category']
+                                  for line in map(json.loads, result.stdout.splitlines())}
+        assert categories['metadata'][truncated['uuid']] == 'equal'
+        assert categories['metadata'][overwritten['uuid']] == 'equal'
+        assert categories['content'] == {**categories['metadata'], truncated['uuid']: 'changed'}
+        assert categories['hashes'] == {**categories['content'], overwritten['uuid']: 'changed'}
+
+
+def test_dtool_compare_all_compare_fields(comparable_repositories_fixture, expected_output_compare_all_jr):
+    from dtool_sync.cli import compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    runner = CliRunner()
+    expected = json.loads(expected_output_compare_all_jr)
+
+    for fields in ['uuid,name', '["uuid", "name"]', '{"uuid": true, "name": true}']:
+        result = runner.invoke(compare_all, ['-q', '-j', '-r', '--compare-fields', fields, lhs_uri, rhs_uri])
+        assert result.exit_code == 0
+        out = json.loads(result.stdout)
+        # the partial copy at rhs is told apart by type, with or without -q
+        assert sorted(out['equal']) == sorted(d['uuid'] for d in expected['equal'])
+        assert sorted(out['changed']) == sorted(d['uuid'] for d in expected['changed'])
+
+        result = runner.invoke(compare_all, ['-j', '-r', '--compare-fields', fields, lhs_uri, rhs_uri])
+        assert result.exit_code == 0
+        out = json.loads(result.stdout)
+        assert sorted(d['uuid'] for d in out['changed']) == sorted(d['uuid'] for d in expected['changed'])
+
+    result = runner.invoke(compare_all, ['-q', '-j', '-r', '--compare-fields', '{"uuid": ', lhs_uri, rhs_uri])
+    assert result.exit_code == 2
+
+
+def test_dtool_compare_extra(comparable_repositories_fixture, expected_output_compare_all_jr):
+    from dtool_sync.cli import compare_extra
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    runner = CliRunner()
+    expected = json.loads(expected_output_compare_all_jr)
+
+    # datasets extra on target are the ones missing at source in reverse direction
+    result = runner.invoke(compare_extra, ['-q', '-j', rhs_uri, lhs_uri])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == [d['uuid'] for d in expected['missing']]
+
+    result = runner.invoke(compare_extra, ['-j', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    assert [d['name'] for d in json.loads(result.stdout)] == ['he']
+
+
+def test_dtool_compare_profile(comparable_repositories_fixture, tmp_path):
+    from dtool_sync.cli import compare
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+
+    runner = CliRunner()
+    result = runner.invoke(compare, ['--profile-dir', str(tmp_path), 'all', '-j', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    json.loads(result.stdout)  # summary goes to stderr only
+
+    for phase in ("list source", "list target", "compare", "format"):
+        assert phase in result.stderr
+    assert sorted(p.name for p in tmp_path.iterdir())[:2] == ["00-list-source.pstats", "01-list-target.pstats"]
+
+
+def test_dtool_sync_all_journal(comparable_repositories_fixture, expected_output_post_sync_all_compare_all_jr,
+                                tmp_path, mocker):
+    from dtool_sync.cli import DEFAULT_COMPARISON_MARKER, _journal_selection, sync_all, compare_all
+    from dtool_sync.journal import COPYING, FAILED, FROZEN, SyncJournal
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+    journal_path = str(tmp_path / "journal.sqlite")
+
+    runner = CliRunner()
+
+    # dry runs do not touch the journal
+    result = runner.invoke(sync_all, ['-n', '-q', '--journal', journal_path, lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    journal = SyncJournal(journal_path, lhs_uri, rhs_uri,
+                          selection=_journal_selection(rhs_uri, marker=DEFAULT_COMPARISON_MARKER))
+    assert journal.entries() == []
+
+    # pretend a run has been killed while copying 'changed', after copying 'people' failed before creating it
+    journal.queue([(f"{lhs_uri}/changed", True), (f"{lhs_uri}/people", False)])
+    journal.mark(f"{lhs_uri}/changed", COPYING)
+    journal.mark(f"{lhs_uri}/people", FAILED)
+
+    # runs selecting datasets differently do not continue it
+    batch_compare = mocker.patch("dtool_sync.cli._batch_compare")
+    result = runner.invoke(sync_all, ['-n', '-q', '--journal', journal_path, '--compare-fields', 'uuid',
+                                      lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    batch_compare.assert_called_once()
+
+    # dry runs continuing it do not touch it either
+    mocker.patch("dtool_sync.journal._get_copy_type",
+                 side_effect=lambda uri, *args, **kwargs: "dataset" if uri.endswith("changed") else None)
+    result = runner.invoke(sync_all, ['-n', '--journal', journal_path, lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    assert "Continue interrupted run from journal, 1 datasets left to copy." in result.stdout
+    assert [state for _, _, state in journal.entries()] == [COPYING, FAILED]
+    mocker.stopall()
+
+    batch_compare = mocker.patch("dtool_sync.cli._batch_compare")
+    result = runner.invoke(sync_all, ['--journal', journal_path, lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    assert "Continue interrupted run from journal, 2 datasets left to copy." in result.stdout
+    batch_compare.assert_not_called()
+    assert [state for _, _, state in journal.entries()] == [FROZEN, FROZEN]
+    mocker.stopall()
+
+    result = runner.invoke(compare_all, ['-j', '-r', lhs_uri, rhs_uri])
+    out = json.loads(result.stdout)
+    expected = json.loads(expected_output_post_sync_all_compare_all_jr)
+    assert compare_nested(out, expected)
+
+    # after a completed run, compare again and replace the journal's entries
+    result = runner.invoke(sync_all, ['-q', '--journal', journal_path, lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    assert journal.entries() == []
+
+
+def test_dtool_sync_all_direct(comparable_repositories_fixture, expected_output_post_sync_all_compare_all_jr, mocker):
+    import dtoolcore
+    from dtool_sync.cli import sync_all, compare_all
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+
+    copy = mocker.spy(dtoolcore, "copy")
+    runner = CliRunner()
+    result = runner.invoke(sync_all, ['--direct', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    copy.assert_not_called()
+
+    result = runner.invoke(compare_all, ['-j', '-r', lhs_uri, rhs_uri])
+    assert result.exit_code == 0
+    out = json.loads(result.stdout)
+    expected = json.loads(expected_output_post_sync_all_compare_all_jr)
+    assert compare_nested(out, expected)
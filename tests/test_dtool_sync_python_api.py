@@ -2,7 +2,701 @@
 
 from click.testing import CliRunner
 
+
 def test_version_is_string():
     import dtool_sync
     assert isinstance(dtool_sync.__version__, str)
 
+
+def test_import_cost():
+    """Importing the command line interface must neither load storage brokers or dtool's own CLI nor take as long."""
+    import json
+    import os
+    import subprocess
+    import sys
+    import dtool_sync
+    cwd = os.path.dirname(os.path.dirname(dtool_sync.__file__))
+    heavy_modules = ["dtoolcore", "dtool_cli", "dtool_create", "dtool_lookup_api", "aiohttp", "humanfriendly",
+                     "difflib", "importlib.metadata"]
+    out = subprocess.run([sys.executable, "-c", "import json, sys, dtool_sync.cli; print(json.dumps(list(sys.modules)))"],
+                         cwd=cwd, capture_output=True, text=True, check=True).stdout
+    loaded = set(json.loads(out))
+    assert [m for m in heavy_modules if m in loaded] == []
+
+    def import_time(module):
+        """Cumulative import time of module in microseconds as reported by a fresh interpreter."""
+        err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             cwd=cwd, capture_output=True, text=True, check=True).stderr
+        return min(int(line.split("|")[1]) for line in err.splitlines() if line.split("|")[-1].strip() == module)
+
+    assert import_time("dtool_sync.cli") < import_time("dtool_cli.cli") / 2
+
+
+def test_direct_list_concurrent(lhs_repository_fixture):
+    from dtool_sync import _direct_list
+    serial = _direct_list(lhs_repository_fixture, raw=False)
+    concurrent = _direct_list(lhs_repository_fixture, raw=False, jobs=4)
+    assert len(serial) == 4
+    assert concurrent == serial
+
+
+def test_direct_list_index(lhs_repository_fixture, mocker):
+    import dtoolcore
+    from dtool_sync import _direct_list
+    spy = mocker.spy(dtoolcore, "_admin_metadata_from_uri")
+
+    first = _direct_list(lhs_repository_fixture, use_index=True)
+    assert spy.call_count == 4
+
+    # frozen datasets are served from index
+    second = _direct_list(lhs_repository_fixture, use_index=True)
+    assert spy.call_count == 4
+    assert second == first
+
+    third = _direct_list(lhs_repository_fixture, use_index=True, refresh=True)
+    assert spy.call_count == 8
+    assert third == first
+
+    # the index is only used on request
+    _direct_list(lhs_repository_fixture)
+    assert spy.call_count == 12
+
+
+def test_direct_list_index_revalidation(lhs_repository_fixture):
+    import shutil
+    import dtoolcore
+    from dtool_sync import _direct_list
+    from dtool_sync.index import _is_current
+
+    first = {d["name"]: d["uuid"] for d in _direct_list(lhs_repository_fixture, use_index=True)}
+
+    # delete and re-create a dataset at the same URI
+    dataset = dtoolcore.DataSet.from_uri(f"{lhs_repository_fixture}/cat")
+    shutil.rmtree(dtoolcore.utils.generous_parse_uri(dataset.uri).path)
+    with dtoolcore.DataSetCreator("cat", lhs_repository_fixture):
+        pass
+
+    second = {d["name"]: d["uuid"] for d in _direct_list(lhs_repository_fixture, use_index=True)}
+    assert second["cat"] != first["cat"]
+    assert {k: v for k, v in second.items() if k != "cat"} == {k: v for k, v in first.items() if k != "cat"}
+
+    # URIs ending in a UUID are checked against the indexed one
+    uuid = "c2249963-6459-4901-8263-85610a7a2ac9"
+    assert _is_current(f"s3://bucket/{uuid}", {"uuid": uuid}, None, None)
+    assert not _is_current(f"s3://bucket/{uuid}", {"uuid": uuid.replace("c", "d")}, None, None)
+
+
+def test_clean_cache(dtool_cache_dir_fixture, mocker):
+    import os
+    import dtool_sync
+    from dtool_sync import _clean_cache, _get_cache_size
+
+    for i, name in enumerate(["oldest", "older", "newest"]):
+        entry = os.path.join(dtool_cache_dir_fixture, name)
+        os.makedirs(os.path.join(entry, "sub"))
+        with open(os.path.join(entry, "sub", "item"), 'w') as f:
+            f.write("x"*100)
+        os.utime(entry, (1000 + i, 1000 + i))
+
+    assert _get_cache_size() == 300
+
+    assert _clean_cache(150) == 100
+    assert _get_cache_size() == 100
+    assert os.listdir(dtool_cache_dir_fixture) == ["newest"]
+
+    # unchanged entries are sized only once with ledger
+    _clean_cache(150, persist_sizes=True)
+    spy = mocker.spy(dtool_sync, "_get_dir_size")
+    _clean_cache(150, persist_sizes=True)
+    assert spy.call_count == 0
+
+    # files added deep within an entry invalidate its recorded size
+    with open(os.path.join(dtool_cache_dir_fixture, "newest", "sub", "another"), 'w') as f:
+        f.write("x"*10)
+    assert _clean_cache(150, persist_sizes=True) == 110
+    assert spy.call_count == 1
+    os.remove(os.path.join(dtool_cache_dir_fixture, "newest", "sub", "another"))
+
+    # the kept listing index does not count towards the cache size
+    with open(os.path.join(dtool_cache_dir_fixture, "dtool-sync", "listing.sqlite"), 'w') as f:
+        f.write("x"*1000)
+    assert _get_cache_size() == 100
+    assert _clean_cache(100) == 100
+    assert sorted(os.listdir(dtool_cache_dir_fixture)) == ["dtool-sync", "newest"]
+
+    assert _clean_cache(0) == _get_cache_size() == 0
+    assert os.listdir(dtool_cache_dir_fixture) == ["dtool-sync"]
+
+
+def test_get_dir_entry_sizes(tmp_path):
+    from dtool_sync import _get_dir_entry_sizes, _get_dir_size
+
+    for i in range(4):
+        (tmp_path / str(i) / "sub").mkdir(parents=True)
+        (tmp_path / str(i) / "sub" / "item").write_text("x"*(i + 1))
+    (tmp_path / "file").write_text("x"*10)
+    (tmp_path / "link").symlink_to(tmp_path / "file")
+    (tmp_path / "0" / "link").symlink_to(tmp_path / "1")
+
+    expected = {"0": 1, "1": 2, "2": 3, "3": 4, "file": 10, "link": 0}
+    assert _get_dir_entry_sizes(str(tmp_path)) == (expected, 20)
+    assert _get_dir_entry_sizes(str(tmp_path), jobs=3) == (expected, 20)
+    assert _get_dir_size(str(tmp_path)) == 20
+
+
+def test_compare_nested():
+    from dtool_sync.compare import _compare_nested
+
+    source = {"uuid": "a", "name": "x", "frozen_at": 1.0, "nested": {"list": [1, 2, {"c": 3}]}}
+    target = {"uuid": "a", "name": "y", "frozen_at": 1.0 + 1e-12, "nested": {"list": [1, 2, {"c": 4}, 5]}}
+
+    assert _compare_nested(source, target, {"uuid": True, "frozen_at": True})
+    assert not _compare_nested(source, target, {"uuid": True, "name": True})
+    assert _compare_nested(source, target, {"uuid": True, "name": False})
+    assert not _compare_nested(source, target, {"uuid": True, "type": False})
+    # empty sub-markers still require their key to exist
+    assert _compare_nested(source, target, {"nested": {}})
+    assert not _compare_nested(source, target, {"annotations": {}})
+    assert not _compare_nested(source, target, {"annotations": []})
+    assert _compare_nested(source, target, {"nested": {"list": [True, True]}})
+    assert not _compare_nested(source, target, {"nested": {"list": [True, True, {"c": True}]}})
+    assert _compare_nested(source, target, {"nested": {"list": [True, True, {"c": False}, True, True]}})
+    assert not _compare_nested(source, target)
+    assert _compare_nested(source, dict(source, extra=True))
+
+
+def test_dataset_record():
+    import json
+    import pickle
+    import pytest
+    from dtool_sync import _json_format_dataset_list, _txt_format_dataset_list
+    from dtool_sync.record import DatasetPair, DatasetRecord
+
+    admin_metadata = json.loads('{"uuid": "a", "name": "x", "type": "dataset", "creator_username": "me", '
+                                '"frozen_at": 1.0, "tags": ["t"]}')
+    record = DatasetRecord(admin_metadata, uri="file:///x")
+    assert record == dict(admin_metadata, uri="file:///x")
+    assert list(record) == [*admin_metadata, "uri"]
+    assert "frozen_at" in record and "created_at" not in record and "tags" in record
+    assert record.get("created_at") is None
+    assert pickle.loads(pickle.dumps(record)) == record
+    # values repeated across datasets are shared
+    assert DatasetRecord(json.loads('{"creator_username": "me"}'))["creator_username"] is record["creator_username"]
+    # uris ending in the name are restored from their prefix, others kept as is
+    other = DatasetRecord(name="x", uri="s3://bucket/a")
+    assert record["uri"] == "file:///x" and other["uri"] == "s3://bucket/a"
+    assert "uri" in record and list(record).count("uri") == 1
+    assert "uri" not in DatasetRecord(name="x")
+    with pytest.raises(KeyError):
+        DatasetRecord(name="x")["uri"]
+    # records are read-only
+    with pytest.raises(AttributeError):
+        record.name = "y"
+    with pytest.raises(AttributeError):
+        del record.name
+    assert record["name"] == "x"
+
+    pair = DatasetPair(record, DatasetRecord(record, type="protodataset"))
+    assert pair.record is record
+    assert _txt_format_dataset_list([pair], verbose=True) == _txt_format_dataset_list([record], verbose=True)
+    assert json.dumps(_json_format_dataset_list([pair], verbose=True)) == json.dumps(
+        [[dict(record), dict(record, type="protodataset")]])
+
+
+def test_comparison_result(mocker):
+    import dtool_sync.compare
+    from dtool_sync.compare import ComparisonResult, iter_compare_datasets
+
+    source = [{"uuid": "a", "name": "x", "v": 1},
+              {"uuid": "b", "name": "x", "v": 1},
+              {"uuid": "b", "name": "y", "v": 1},
+              {"uuid": "b", "name": "z", "v": 1},
+              {"uuid": "d", "name": "x", "v": 1},
+              {"uuid": "e", "name": "old", "v": 1}]
+    target = [{"uuid": "a", "name": "x", "v": 2},
+              {"uuid": "b", "name": "w", "v": 1},
+              {"uuid": "b", "name": "y", "v": 1},
+              {"uuid": "c", "name": "x", "v": 1},
+              {"uuid": "e", "name": "new", "v": 1}]
+
+    spy = mocker.spy(dtool_sync.compare, "_make_comparator")
+    result = ComparisonResult(list(reversed(source)), target, {"uuid": True, "name": True, "v": True})
+    # duplicate UUIDs are matched by name, differing names do not match unless the UUID is unique
+    assert [(s["name"], t["name"]) for s, t in result.matched] == [("x", "x"), ("y", "y"), ("old", "new")]
+    assert [(d["uuid"], d["name"]) for d in result.missing] == [("b", "x"), ("b", "z"), ("d", "x")]
+    assert [(d["uuid"], d["name"]) for d in result.extra] == [("b", "w"), ("c", "x")]
+    assert spy.call_count == 0
+
+    assert [(s["uuid"], s["name"]) for s, _ in result.equal] == [("b", "y")]
+    assert [(s["uuid"], s["name"]) for s, _ in result.changed] == [("a", "x"), ("e", "old")]
+    assert result.categorized("missing", "extra") == {"missing": result.missing, "extra": result.extra}
+    assert spy.call_count == 1
+
+    # streamed comparison matches alike
+    streamed = list(iter_compare_datasets(reversed(source), target, {"uuid": True, "name": True, "v": True}))
+    assert sorted((key, (d[0] if key != "missing" else d)["uuid"], (d[0] if key != "missing" else d)["name"])
+                  for key, d in streamed) == [("changed", "a", "x"), ("changed", "e", "old"), ("equal", "b", "y"),
+                                              ("missing", "b", "x"), ("missing", "b", "z"), ("missing", "d", "x")]
+
+    # formatted proto datasets match their source by name without the leading '*'
+    proto = {"uuid": "a", "name": "*x"}
+    assert [(s["name"], t["name"]) for s, t in ComparisonResult(source[:1], [proto]).matched] == [("x", "*x")]
+    assert [key for key, _ in iter_compare_datasets(source[:1], [proto], {"uuid": True})] == ["equal"]
+
+
+def test_txt_format_dataset_enumerable():
+    from dtool_sync import _txt_format_dataset_enumerable, _txt_iter_dataset_enumerable
+
+    lion = {"name": "lion", "uuid": "065d9fe0", "creator_username": "jotelha",
+            "uri": "file:///lhs/lion", "frozen_at": "2021-09-05"}
+    proto = {"name": "*changed ", "uuid": "af16c00d", "creator_username": "jotelha",
+             "uri": "file:///rhs/changed"}
+
+    out_dict = {"equal": [lion], "changed": [], "missing": [proto]}
+    expected = ("\x1b[1mDatasets equal on source and target:\x1b[0m\n"
+                "\x1b[32mlion\n  file:///lhs/lion\n  jotelha  2021-09-05  065d9fe0\x1b[0m\n"
+                "\x1b[1mDatasets changed from source to target:\x1b[0m\n"
+                "\x1b[33m\x1b[0m\n"
+                "\x1b[1mDatasets missing on target:\x1b[0m\n"
+                "\x1b[31m*changed \n  file:///rhs/changed\n  jotelha  af16c00d\x1b[0m")
+    assert _txt_format_dataset_enumerable(out_dict, verbose=True) == expected
+    assert "\n".join(_txt_iter_dataset_enumerable(out_dict, verbose=True)) == expected
+
+    # trailing whitespace is stripped from plain lists
+    assert _txt_format_dataset_enumerable([lion, proto], quiet=True, ls_output=False) == "065d9fe0\naf16c00d"
+    assert _txt_format_dataset_enumerable([proto], ls_output=False, verbose=True) == \
+        "af16c00d\n  file:///rhs/changed\n  jotelha  *changed"
+
+
+def test_parse_timestamp(monkeypatch):
+    import time
+    from dtool_sync.lookup import _parse_timestamp
+
+    # naive dates are in UTC, independent of the local time zone
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        for value in ["1630800000.0", "2021-09-05T00:00:00", "2021-09-05T02:00:00+02:00",
+                      "Sun, 05 Sep 2021 00:00:00 GMT", "Sun, 05 Sep 2021 00:00:00 -0000"]:
+            assert _parse_timestamp(value) == 1630800000.0
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_lookup_list_no_uuids(mocker):
+    import asyncio
+    from dtool_sync.lookup import _lookup_list
+
+    new_event_loop = mocker.spy(asyncio, "new_event_loop")
+    assert _lookup_list("lookup://", uuids=[]) == []
+    new_event_loop.assert_not_called()
+
+
+def test_lookup_list_paginated(lookup_server_fixture):
+    from dtool_sync import _iter_list, _list
+    datasets, requested_pages = lookup_server_fixture
+    assert len(datasets) == 4
+
+    streamed = list(_iter_list("lookup://", query={}, page_size=1, jobs=3))
+    assert sorted(requested_pages) == [1, 2, 3, 4]
+    assert sorted(d["uri"] for d in streamed) == [d["uri"] for d in datasets]
+
+    listed = _list("lookup://", query={}, page_size=3)
+    assert [d["uri"] for d in listed] == [d["uri"] for d in sorted(datasets, key=lambda d: (d["uuid"], d["name"]))]
+
+    # pages are only requested while datasets are consumed
+    requested_pages.clear()
+    entries = _iter_list("lookup://", query={}, page_size=1)
+    assert next(entries)["uri"] == datasets[0]["uri"]
+    entries.close()
+    assert requested_pages == [1]
+
+
+def test_lookup_list_base_uri(lookup_server_fixture, lhs_repository_fixture, rhs_uri_fixture):
+    import os
+    import urllib.parse
+    from dtool_sync import _direct_list, _list
+    from dtool_sync.lookup import _parse_lookup_uri
+
+    assert _parse_lookup_uri("lookup://") == (None, None)
+    assert _parse_lookup_uri("lookup+http://localhost:5000/api/?base_uri=s3://a&base_uri=s3://b") == (
+        "http://localhost:5000/api", ["s3://a", "s3://b"])
+
+    netloc = urllib.parse.urlsplit(os.environ["DSERVER_URL"]).netloc
+    for lookup_uri in [f"lookup://?base_uri={lhs_repository_fixture}",
+                       f"lookup+http://{netloc}?base_uri={lhs_repository_fixture}"]:
+        # lookup server entries are reduced to what the storage broker lists
+        for raw in [True, False]:
+            assert _list(lookup_uri, query={}, raw=raw) == _direct_list(lhs_repository_fixture, raw=raw)
+
+    assert _list(f"lookup://?base_uri={rhs_uri_fixture}", query={}) == []
+
+
+def test_listing_backend_registry(lhs_repository_fixture, mocker):
+    from dtool_sync import _list
+    from dtool_sync import backends
+
+    assert isinstance(backends._get_listing_backend("lookup://"), backends.LookupListingBackend)
+    assert isinstance(backends._get_listing_backend(lhs_repository_fixture), backends.StorageBrokerListingBackend)
+
+    class MemoryListingBackend(backends.ListingBackend):
+        schemes = ("memory",)
+        capabilities = frozenset({backends.BULK_METADATA})
+
+        def iter_list(self, base_uri, *args, **kwargs):
+            yield {"uuid": "b", "name": "second"}
+            yield {"uuid": "a", "name": "first"}
+
+    mocker.patch.object(backends, "_iter_entry_point_backends", return_value=[MemoryListingBackend])
+    backends._generate_listing_backend_lookup.cache_clear()
+    try:
+        assert _list("memory://anywhere") == [{"uuid": "a", "name": "first"}, {"uuid": "b", "name": "second"}]
+        assert not backends._has_capability("memory://anywhere", backends.STREAMING)
+    finally:
+        backends._generate_listing_backend_lookup.cache_clear()
+
+
+def test_list_for_comparison_server_side_filtering(lookup_server_fixture, lhs_repository_fixture, rhs_repository_fixture):
+    from dtool_sync import _direct_list
+    from dtool_sync.backends import _list_for_comparison
+
+    # only datasets also present at rhs are requested from the lookup server
+    source_info, target_info = _list_for_comparison(rhs_repository_fixture, "lookup://")
+    assert source_info == _direct_list(rhs_repository_fixture)
+    rhs_uuids = {d["uuid"] for d in source_info}
+    assert target_info == [d for d in _direct_list(lhs_repository_fixture) if d["uuid"] in rhs_uuids]
+    assert len(target_info) < 4
+
+
+def test_delta_copy(lhs_uri_fixture, rhs_uri_fixture, mocker):
+    import os
+    import tempfile
+    import dtoolcore
+    from dtool_sync import transfer
+    from dtool_sync.verify import _verify_content
+
+    with dtoolcore.DataSetCreator("delta", lhs_uri_fixture) as creator:
+        for i in range(5):
+            handle = creator.prepare_staging_abspath_promise(f"item_{i}.txt")
+            with open(handle, "w") as f:
+                f.write(f"content of item {i}\n")
+        src_uri = creator.uri
+    src_dataset = dtoolcore.DataSet.from_uri(src_uri)
+
+    # partial copy: one item complete, one corrupted at equal size, one truncated, two missing
+    proto_dataset = dtoolcore._copy_create_proto_dataset(src_dataset, rhs_uri_fixture)
+    with tempfile.TemporaryDirectory() as d:
+        corrupted = os.path.join(d, "corrupted")
+        with open(corrupted, "w") as f:
+            f.write("content of item X\n")
+        truncated = os.path.join(d, "truncated")
+        with open(truncated, "w") as f:
+            f.write("content")
+        proto_dataset.put_item(src_dataset.item_content_abspath(
+            dtoolcore.utils.generate_identifier("item_0.txt")), "item_0.txt")
+        proto_dataset.put_item(corrupted, "item_1.txt")
+        proto_dataset.put_item(truncated, "item_2.txt")
+
+    spy = mocker.spy(transfer, "_put_item")
+    hash_spy = mocker.spy(dtoolcore.storagebroker.DiskStorageBroker, "get_hash")
+    dest_uri = transfer._silent_copy(True, src_uri, rhs_uri_fixture, item_jobs=2)
+    assert sorted(call.args[3] for call in spy.call_args_list) == [
+        "item_1.txt", "item_2.txt", "item_3.txt", "item_4.txt"]
+    # every item at the destination is hashed exactly once, a corrupted one before and after its transfer
+    assert sorted(call.args[1] for call in hash_spy.call_args_list) == [
+        "item_0.txt", "item_1.txt", "item_1.txt", "item_2.txt", "item_3.txt", "item_4.txt"]
+
+    dest_dataset = dtoolcore.DataSet.from_uri(dest_uri)
+    assert dest_dataset._admin_metadata["frozen_at"] == src_dataset._admin_metadata["frozen_at"]
+    assert _verify_content(src_uri, dest_uri) is None
+    # the manifest matches the actual content
+    for properties in dest_dataset._manifest["items"].values():
+        actual = dest_dataset._storage_broker.item_properties(properties["relpath"])
+        assert (actual["hash"], actual["size_in_bytes"]) == (properties["hash"], properties["size_in_bytes"])
+
+
+def test_compare_base_uris_fields(comparable_repositories_fixture, mocker):
+    import dtoolcore
+    from dtool_sync.compare import compare_base_uris, make_comparison_marker
+    lhs_uri, rhs_uri = comparable_repositories_fixture
+
+    assert make_comparison_marker(["uuid", "annotations.project", "annotations.owner"]) == {
+        "uuid": True, "annotations": {"project": True, "owner": True}}
+    assert make_comparison_marker({"uuid": True}) == {"uuid": True}
+
+    equal, changed, missing = compare_base_uris(lhs_uri, rhs_uri, ["uuid", "type"], use_index=True)
+    assert [s["name"] for s, _ in equal] == ["lion", "she", "cat"]
+    assert [s["name"] for s, _ in changed] == ["changed"]
+    assert [s["name"] for s in missing] == ["people"]
+    for dataset in [*(s for s, _ in equal), *missing]:
+        assert set(dataset.keys()) == {"uuid", "name", "uri", "type"}
+
+    # proto datasets are never served from the index, whatever fields are compared
+    spy = mocker.spy(dtoolcore, "_admin_metadata_from_uri")
+    equal, changed, missing = compare_base_uris(lhs_uri, rhs_uri, ["uuid", "name"], use_index=True)
+    assert spy.call_count == 1
+    assert spy.call_args.args[0].endswith("changed")
+    assert len(equal) == 4 and not changed
+
+
+def test_schedule_transfers(mocker):
+    from dtool_sync import schedule
+    from dtool_sync.schedule import schedule_transfers
+
+    sizes = {"a": 3, "b": 10, "c": 1, "d": 6, "e": None}
+    mocker.patch.object(schedule, "_estimate_size", side_effect=lambda uri, config_path: sizes[uri])
+    datasets = [({"uuid": uuid, "name": uuid, "uri": uuid, "frozen_at": -i}, uuid == "d")
+                for i, uuid in enumerate(sorted(sizes))]
+
+    def order(*args, **kwargs):
+        scheduled, deferred = schedule_transfers(datasets, *args, **kwargs)
+        return [t.dataset["uuid"] for t in scheduled], [t.dataset["uuid"] for t in deferred]
+
+    assert order("uuid") == (["d", "a", "b", "c", "e"], [])
+    assert schedule._estimate_size.call_count == 0
+    assert order("smallest-first") == (["c", "a", "d", "b", "e"], [])
+    assert order("largest-first") == (["b", "d", "a", "c", "e"], [])
+    assert order("frozen-at") == (["e", "d", "c", "b", "a"], [])
+    # groups b and d, a, c of 10 bytes each
+    assert order("balanced", workers=2) == (["b", "d", "a", "c", "e"], [])
+    assert order("largest-first", byte_budget=10) == (["b"], ["d", "a", "c", "e"])
+    assert order("smallest-first", byte_budget=10) == (["c", "a", "d"], ["b", "e"])
+
+
+def test_transfer_monitor():
+    import pytest
+    from dtool_sync.monitor import TransferMonitor
+    from dtool_sync.transfer import _monitored_transfer
+
+    monitor = TransferMonitor(total=3, sizes={"a": 10, "b": 20})
+
+    attempts = []
+
+    def copy_func(resume, dataset_uri, dest_base_uri):
+        attempts.append(resume)
+        if dataset_uri == "c" or not resume:
+            raise ValueError("interrupted")
+        return f"{dest_base_uri}/{dataset_uri}"
+
+    assert _monitored_transfer("a", "dest", resume=True, copy_func=copy_func, monitor=monitor) == "dest/a"
+    assert _monitored_transfer("b", "dest", copy_func=copy_func, monitor=monitor) == "dest/b"
+    with pytest.raises(ValueError):
+        _monitored_transfer("c", "dest", resume=True, copy_func=copy_func, monitor=monitor)
+    monitor.evicted("entry", 5)
+
+    report = monitor.report()
+    assert (report["datasets"], report["failed"], report["bytes"]) == (2, 1, 30)
+    assert [(t["uri"], t["dest_uri"], t["retries"]) for t in report["transfers"]] == [
+        ("a", "dest/a", 0), ("b", "dest/b", 1), ("c", None, 0)]
+    assert report["transfers"][2]["error"] == "ValueError: interrupted"
+    assert [e["bytes"] for e in report["cache_evictions"]] == [5]
+    assert monitor.eta() == 0
+
+
+def test_timing_spans(tmp_path):
+    import contextlib
+    import pytest
+    from dtool_sync.timing import Profiler, add_span_hook, remove_span_hook, span
+
+    entered = []
+
+    @contextlib.contextmanager
+    def hook(name):
+        entered.append(name)
+        yield
+
+    add_span_hook(hook)
+    try:
+        with Profiler(pstats_dir=str(tmp_path)) as profiler:
+            with span("list source"):
+                with span("format"):
+                    pass
+            with span("format"):
+                pass
+            with pytest.raises(RuntimeError):
+                Profiler().__enter__()
+    finally:
+        remove_span_hook(hook)
+
+    with span("ignored"):
+        pass
+
+    assert entered == ["list source", "format", "format"]
+    assert {name: calls for name, (calls, _) in profiler.summary().items()} == {"format": 2, "list source": 1}
+    assert list(profiler.summary()) == ["format", "list source"]  # in order of completion
+    # only outermost spans are profiled
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["00-list-source.pstats", "01-format.pstats"]
+    assert profiler.format_summary().splitlines()[-1].startswith("Total")
+
+
+def test_sync_journal(lhs_uri_fixture, rhs_uri_fixture, tmp_path, mocker):
+    import dtoolcore
+    import pytest
+    from dtool_sync.journal import COPYING, FAILED, FROZEN, QUEUED, SyncJournal
+    from dtool_sync.transfer import _journaled_transfer
+
+    journal = SyncJournal(str(tmp_path / "journal.sqlite"), "src", "dest")
+    other = SyncJournal(journal.path, "src", "elsewhere")
+    selected = SyncJournal(journal.path, "src", "dest", selection={"query": {"name": "a"}})
+    journal.queue([("a", True), ("b", False), ("c", False), ("d", False), ("e", False)])
+    other.queue([("a", False)])
+    selected.queue([("a", False)])
+    assert journal.interrupted()
+
+    def copy_func(resume, dataset_uri, dest_base_uri):
+        if dataset_uri == "b":
+            raise ValueError("broken")
+        return f"{dest_base_uri}/{dataset_uri}"
+
+    assert _journaled_transfer("a", "dest", resume=True, copy_func=copy_func, journal=journal) == "dest/a"
+    with pytest.raises(ValueError):
+        _journaled_transfer("b", "dest", resume=True, copy_func=copy_func, journal=journal)
+    journal.mark("c", COPYING)
+    journal.mark("e", COPYING)
+    assert journal.entries() == [("a", True, FROZEN), ("b", False, FAILED), ("c", False, COPYING),
+                                 ("d", False, QUEUED), ("e", False, COPYING)]
+    assert other.entries() == selected.entries() == [("a", False, QUEUED)]
+
+    # 'b' failed after creating its proto dataset, 'c' got frozen before the interruption and 'e' got
+    # interrupted before creating its proto dataset, dry runs do not mark 'c'
+    copy_types = {"b": "protodataset", "c": "dataset"}
+    mocker.patch("dtool_sync.journal._get_copy_type", side_effect=lambda uri, *args, **kwargs: copy_types.get(uri))
+    assert journal.resumable_tasks(dry_run=True) == [("b", True), ("d", False), ("e", False)]
+    assert journal.entries()[2] == ("c", False, COPYING)
+    assert journal.resumable_tasks() == [("b", True), ("d", False), ("e", False)]
+    assert journal.entries()[2] == ("c", False, FROZEN)
+
+    journal.mark("d", FROZEN)
+    journal.mark("e", FROZEN)
+    assert not journal.interrupted()
+    mocker.stopall()
+
+    # copy types of actual datasets
+    with dtoolcore.DataSetCreator("frozen", lhs_uri_fixture) as creator:
+        frozen_uri = creator.uri
+    with dtoolcore.DataSetCreator("proto", lhs_uri_fixture) as creator:
+        proto_uri = creator.uri
+    with dtoolcore.DataSetCreator("missing", lhs_uri_fixture) as creator:
+        missing_uri = creator.uri
+    dtoolcore.copy(frozen_uri, rhs_uri_fixture)
+    dtoolcore._copy_create_proto_dataset(dtoolcore.DataSet.from_uri(proto_uri), rhs_uri_fixture)
+    journal = SyncJournal(journal.path, lhs_uri_fixture, rhs_uri_fixture)
+    journal.queue([(uri, False) for uri in (frozen_uri, proto_uri, missing_uri)])
+    for uri in (frozen_uri, proto_uri, missing_uri):
+        journal.mark(uri, COPYING)
+    assert journal.resumable_tasks() == [(proto_uri, True), (missing_uri, False)]
+    assert journal.entries()[0] == (frozen_uri, False, FROZEN)
+
+
+def test_direct_copy(lhs_uri_fixture, rhs_uri_fixture, tmp_path, mocker):
+    import dtoolcore
+    import pytest
+    from dtool_sync import streams, transfer
+    from dtool_sync.verify import _verify_content
+
+    with dtoolcore.DataSetCreator("direct", lhs_uri_fixture) as creator:
+        for i in range(3):
+            handle = creator.prepare_staging_abspath_promise(f"sub/item_{i}.txt")
+            with open(handle, "w") as f:
+                f.write(f"content of item {i}\n" * 1000)
+        src_uri = creator.uri
+
+    read_sizes = []
+    open_item = streams.DiskItemStreams.open_item
+
+    def recording_open_item(self, storage_broker, identifier):
+        f = open_item(self, storage_broker, identifier)
+        return mocker.Mock(read=lambda size: read_sizes.append(size) or f.read(size), close=f.close)
+
+    # items are piped in small chunks, never staged in the cache
+    mocker.patch.object(streams, "CHUNK_SIZE", 1024)
+    mocker.patch.object(streams.DiskItemStreams, "open_item", recording_open_item)
+    mocker.patch.object(dtoolcore.DataSet, "item_content_abspath", side_effect=AssertionError("staged"))
+    copy = mocker.spy(dtoolcore, "copy")
+    dest_uri = transfer._silent_copy(False, src_uri, rhs_uri_fixture, item_jobs=2, direct=True)
+    copy.assert_not_called()
+    # 18000 bytes per item in 18 chunks, then end of file
+    assert set(read_sizes) == {1024} and len(read_sizes) == 3 * (18 + 1)
+    assert _verify_content(src_uri, dest_uri, hashes=True) is None
+    assert dtoolcore.DataSet.from_uri(dest_uri)._admin_metadata["type"] == "dataset"
+
+    # items arriving incomplete are rejected
+    mocker.stopall()
+    src_dataset = dtoolcore.DataSet.from_uri(src_uri)
+    (tmp_path / "incomplete").mkdir()
+    proto_dataset = transfer._create_proto_dataset(src_dataset, (tmp_path / "incomplete").as_uri())
+    identifier = dtoolcore.utils.generate_identifier("sub/item_0.txt")
+    src_dataset._manifest["items"][identifier]["size_in_bytes"] += 1
+    with pytest.raises(ValueError):
+        streams._get_item_pipe(src_dataset, proto_dataset, chunk_size=1024)(identifier, "sub/item_0.txt")
+
+    # storage without item streams is copied via the cache
+    mocker.stopall()
+    mocker.patch.object(streams, "_generate_item_streams_lookup", return_value={})
+    copy = mocker.spy(dtoolcore, "copy")
+    dest_uri = transfer._silent_copy(False, src_uri, tmp_path.as_uri(), direct=True)
+    copy.assert_called_once()
+    assert _verify_content(src_uri, dest_uri) is None
+
+
+def test_transfer_cache_cleaning(mocker):
+    from dtool_sync import transfer
+
+    def copy(resume, dataset_uri, dest_base_uri, **kwargs):
+        return f"{dest_base_uri}/{dataset_uri}"
+
+    mocker.patch.object(transfer, "_verbose_copy", side_effect=copy)
+    mocker.patch.object(transfer, "_silent_copy", side_effect=copy)
+    tasks = [("a", True), ("b", True), ("c", False), ("d", True)]
+
+    # only clean after fresh copies
+    clean_cache = mocker.Mock()
+    transfer._serial_transfer(tasks, "dest", quiet=True, clean_cache=clean_cache)
+    assert clean_cache.call_count == 1
+
+    clean_cache = mocker.Mock()
+    transfer._parallel_transfer(tasks, "dest", jobs=2, quiet=True, clean_cache=clean_cache)
+    assert clean_cache.call_count == 1
+
+
+def test_unified_merge_diff_large():
+    """Beyond 200 lines, difflib junks frequent lines, the merged diff must still turn lhs into rhs."""
+    import random
+    import re
+    import uuid
+    from dtool_sync import _format_dataset_enumerable
+    from dtool_sync.diff import unified_merge_diff
+    from dtool_sync.record import DatasetRecord
+
+    rng = random.Random(1)
+    uuids = sorted(str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(400))
+
+    def datasets(p):
+        # few distinct names and creators, i.e. many repeated lines
+        return [DatasetRecord(uuid=u, name=f"n{i % 7}", creator_username="me", frozen_at="2021-09-05",
+                              uri=f"file:///base/n{i % 7}") for i, u in enumerate(uuids) if rng.random() < p]
+
+    lhs, rhs = datasets(0.9), datasets(0.9)
+    for kwargs in [dict(quiet=True), dict(), dict(verbose=True)]:
+        a = _format_dataset_enumerable(lhs, **kwargs).splitlines(keepends=True)
+        b = _format_dataset_enumerable(rhs, **kwargs).splitlines(keepends=True)
+        assert len(a) > 200
+
+        patched, i = [], 0
+        for line in list(unified_merge_diff(lhs, rhs, **kwargs))[2:]:
+            hunk = re.match(r"@@ -(\d+)(,(\d+))?", line)
+            if hunk:
+                start, length = int(hunk.group(1)), hunk.group(3)
+                start = start if length == "0" else start - 1
+                patched.extend(a[i:start])
+                i = start
+            elif line.startswith("-"):
+                i += 1
+            elif line.startswith("+"):
+                patched.append(line[1:])
+            else:
+                patched.append(a[i])
+                i += 1
+        patched.extend(a[i:])
+        assert patched == b